@@ -6,19 +6,30 @@ import logging
 
 from virttest import utils_test
 
+from provider.libguestfs import appliance
+from provider.libguestfs import image_cache
+
 
 def prepare_image(test, params):
     """
     1) Create a image
     2) Create file system on the image
     """
+    # Kept appliances of the image which is going to be re-created
+    if params.get("image_path"):
+        appliance.forget(params["image_path"])
+    if image_cache.is_enabled(params):
+        status, output = image_cache.prepare_image(params)
+        if status is False:
+            test.fail(output)
+        return
 
     params["image_path"] = utils_test.libguestfs.preprocess_image(params)
 
     if not params.get("image_path"):
         test.fail("Image could not be created for some reason")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     status, output = gf.create_fs()
     if status is False:
         gf.close_session()
@@ -38,7 +49,7 @@ def test_aug_clear(test, vm, params):
 
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -96,7 +107,7 @@ def test_aug_close(test, vm, params):
 
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -142,7 +153,7 @@ def test_aug_defnode(test, vm, params):
 
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -204,7 +215,7 @@ def test_aug_defvar(test, vm, params):
 
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -261,7 +272,7 @@ def test_aug_set_get(test, vm, params):
 
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -331,7 +342,7 @@ def test_aug_init(test, vm, params):
 
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -395,7 +406,7 @@ def test_aug_insert(test, vm, params):
 
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -480,7 +491,7 @@ def test_aug_ls(test, vm, params):
 
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -558,7 +569,7 @@ def test_aug_match(test, vm, params):
 
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -626,7 +637,7 @@ def test_aug_mv(test, vm, params):
 
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -687,7 +698,7 @@ def test_aug_rm(test, vm, params):
 
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -748,7 +759,7 @@ def test_aug_label(test, vm, params):
 
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -803,7 +814,7 @@ def test_aug_setm(test, vm, params):
 
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -874,7 +885,7 @@ def test_aug_load(test, vm, params):
 
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -965,7 +976,7 @@ def test_aug_save(test, vm, params):
 
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -1028,7 +1039,7 @@ def test_aug_save(test, vm, params):
     logging.info("Save changes to disk successfully")
     gf.close_session()
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     gf.add_drive_opts(image_path, readonly=readonly)
 
     # Launch
@@ -1089,11 +1100,14 @@ def run(test, params, env):
     fs_types = params.get("fs_types")
     image_formats = params.get("image_formats")
 
-    for image_format in re.findall(r"\w+", image_formats):
-        params["image_format"] = image_format
-        for partition_type in re.findall(r"\w+", partition_types):
-            params["partition_type"] = partition_type
-            for fs_type in re.findall(r"\w+", fs_types):
-                params["fs_type"] = fs_type
-                prepare_image(test, params)
-                testcase(test, vm, params)
+    try:
+        for image_format in re.findall(r"\w+", image_formats):
+            params["image_format"] = image_format
+            for partition_type in re.findall(r"\w+", partition_types):
+                params["partition_type"] = partition_type
+                for fs_type in re.findall(r"\w+", fs_types):
+                    params["fs_type"] = fs_type
+                    prepare_image(test, params)
+                    testcase(test, vm, params)
+    finally:
+        appliance.close_all()
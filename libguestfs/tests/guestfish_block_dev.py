@@ -6,18 +6,30 @@ from virttest import utils_test
 from virttest import data_dir
 from virttest import qemu_storage
 
+from provider.libguestfs import appliance
+from provider.libguestfs import image_cache
+
 
 def prepare_image(test, params):
     """
     (1) Create a image
     (2) Create file system on the image
     """
+    # Kept appliances of the image which is going to be re-created
+    if params.get("image_path"):
+        appliance.forget(params["image_path"])
+    if image_cache.is_enabled(params):
+        status, output = image_cache.prepare_image(params)
+        if status is False:
+            test.fail(output)
+        return
+
     params["image_path"] = utils_test.libguestfs.preprocess_image(params)
 
     if not params.get("image_path"):
         test.fail("Image could not be created for some reason.")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     status, output = gf.create_fs()
     if status is False:
         gf.close_session()
@@ -32,7 +44,7 @@ def test_blockdev_flushbufs(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -66,7 +78,7 @@ def test_blockdev_set_get_ro_rw(test, vm, params):
     gf_result = []
     expect_result = ['false', 'true', 'false']
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -96,7 +108,7 @@ def test_blockdev_getsz(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -126,7 +138,7 @@ def test_blockdev_getbsz(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -151,7 +163,7 @@ def test_blockdev_getss(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -176,7 +188,7 @@ def test_blockdev_getsize64(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -206,7 +218,7 @@ def test_blockdev_rereadpt(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         # add three disks here
@@ -232,7 +244,7 @@ def test_canonical_device_name(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -275,7 +287,7 @@ def test_device_index(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         # add three disks here
@@ -304,7 +316,7 @@ def test_list_devices(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         # add three disks here
@@ -335,7 +347,7 @@ def test_disk_format(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -373,7 +385,7 @@ def test_max_disks(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -397,7 +409,7 @@ def test_nr_devices(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -421,7 +433,7 @@ def test_list_partitions(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -457,7 +469,7 @@ def test_disk_has_backing_file(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -502,7 +514,7 @@ def test_disk_virtual_size(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -539,7 +551,7 @@ def test_scrub_device(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -611,7 +623,7 @@ def test_scrub_file(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -645,7 +657,7 @@ def test_scrub_freespace(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -697,7 +709,7 @@ def test_md_test(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
     elif add_ref == "domain":
@@ -770,7 +782,7 @@ def test_part_add(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -817,7 +829,7 @@ def test_part_del(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -869,7 +881,7 @@ def test_part_init(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -914,7 +926,7 @@ def test_part_set_get_bootable(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -944,7 +956,7 @@ def test_part_set_get_mbr_id(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -974,7 +986,7 @@ def test_part_disk(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -1011,7 +1023,7 @@ def test_part_to_dev(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -1042,7 +1054,7 @@ def test_part_to_partnum(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -1075,7 +1087,7 @@ def test_sfdisk(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -1120,7 +1132,7 @@ def test_sfdiskM(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -1155,7 +1167,7 @@ def test_sfdisk_N(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -1197,7 +1209,7 @@ def test_sfdisk_disk_geometry(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -1225,7 +1237,7 @@ def test_sfdisk_kernel_geometry(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -1272,9 +1284,12 @@ def run(test, params, env):
     fs_types = params.get("fs_types")
     image_formats = params.get("image_formats")
 
-    for image_format in re.findall("\w+", image_formats):
-        params["image_format"] = image_format
-        for partition_type in re.findall("\w+", partition_types):
-            params["partition_type"] = partition_type
-            prepare_image(test, params)
-            testcase(test, vm, params)
+    try:
+        for image_format in re.findall("\w+", image_formats):
+            params["image_format"] = image_format
+            for partition_type in re.findall("\w+", partition_types):
+                params["partition_type"] = partition_type
+                prepare_image(test, params)
+                testcase(test, vm, params)
+    finally:
+        appliance.close_all()
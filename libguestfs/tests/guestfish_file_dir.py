@@ -10,24 +10,36 @@ from avocado.utils import process
 from virttest import utils_test
 from virttest import data_dir
 
+from provider.libguestfs import appliance
+from provider.libguestfs import image_cache
+
 
 def prepare_image(test, params):
     """
     (1) Create a image
     (2) Create file system on the image
     """
-    params["image_path"] = utils_test.libguestfs.preprocess_image(params)
-
-    if not params.get("image_path"):
-        test.fail("Image could not be created for some reason.")
-
+    # Kept appliances of the image which is going to be re-created
+    if params.get("image_path"):
+        appliance.forget(params["image_path"])
     tarball_file = params.get("tarball_file")
     if tarball_file:
         tarball_path = os.path.join(data_dir.get_deps_dir(), "tarball",
                                     tarball_file)
     params["tarball_path"] = tarball_path
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    if image_cache.is_enabled(params):
+        status, output = image_cache.prepare_image(params)
+        if status is False:
+            test.fail(output)
+        return
+
+    params["image_path"] = utils_test.libguestfs.preprocess_image(params)
+
+    if not params.get("image_path"):
+        test.fail("Image could not be created for some reason.")
+
+    gf = appliance.new_guestfish(params)
     status, output = gf.create_fs()
     if status is False:
         gf.close_session()
@@ -42,7 +54,7 @@ def test_chmod(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -96,7 +108,7 @@ def test_chown(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -138,7 +150,7 @@ def test_lchown(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -180,7 +192,7 @@ def test_du(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -204,7 +216,7 @@ def test_file(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -240,7 +252,7 @@ def test_file_architecture(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -273,7 +285,7 @@ def test_filesize(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -308,7 +320,7 @@ def test_stat(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -343,7 +355,7 @@ def test_lstat(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -378,7 +390,7 @@ def test_lstatlist(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -413,7 +425,7 @@ def test_touch(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -448,7 +460,7 @@ def test_umask(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -543,7 +555,7 @@ def test_cat(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -573,7 +585,7 @@ def test_checksum(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -623,7 +635,7 @@ def test_checksum_device(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -665,7 +677,7 @@ def test_checksums_out(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -733,7 +745,7 @@ def test_equal(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -769,7 +781,7 @@ def test_fill(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -826,7 +838,7 @@ def test_fill_dir(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -862,7 +874,7 @@ def test_fill_pattern(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -924,7 +936,7 @@ def test_head(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -970,7 +982,7 @@ def test_hexdump(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -1006,7 +1018,7 @@ def test_more(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -1032,7 +1044,7 @@ def test_pread(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -1090,9 +1102,12 @@ def run(test, params, env):
     fs_types = params.get("fs_types")
     image_formats = params.get("image_formats")
 
-    for image_format in re.findall("\w+", image_formats):
-        params["image_format"] = image_format
-        for partition_type in re.findall("\w+", partition_types):
-            params["partition_type"] = partition_type
-            prepare_image(test, params)
-            testcase(test, vm, params)
+    try:
+        for image_format in re.findall("\w+", image_formats):
+            params["image_format"] = image_format
+            for partition_type in re.findall("\w+", partition_types):
+                params["partition_type"] = partition_type
+                prepare_image(test, params)
+                testcase(test, vm, params)
+    finally:
+        appliance.close_all()
@@ -7,18 +7,30 @@ from avocado.utils import process
 from virttest import utils_test
 from virttest import data_dir
 
+from provider.libguestfs import appliance
+from provider.libguestfs import image_cache
+
 
 def prepare_image(test, params):
     """
     (1) Create a image
     (2) Create file system on the image
     """
+    # Kept appliances of the image which is going to be re-created
+    if params.get("image_path"):
+        appliance.forget(params["image_path"])
+    if image_cache.is_enabled(params):
+        status, output = image_cache.prepare_image(params)
+        if status is False:
+            test.fail(output)
+        return
+
     params["image_path"] = utils_test.libguestfs.preprocess_image(params)
 
     if not params.get("image_path"):
         test.fail("Image could not be created for some reason.")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     status, output = gf.create_fs()
     if status is False:
         gf.close_session()
@@ -33,7 +45,7 @@ def test_set_get_e2uuid(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -77,7 +89,7 @@ def test_set_uuid(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -108,7 +120,7 @@ def test_set_get_e2label(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -153,7 +165,7 @@ def test_set_label(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -184,7 +196,7 @@ def test_set_get_e2attrs(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -260,7 +272,7 @@ def test_set_get_e2generation(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -295,7 +307,7 @@ def test_statvfs(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -350,7 +362,7 @@ def test_tune2fs_l(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -386,7 +398,7 @@ def test_tune2fs(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -431,7 +443,7 @@ def test_checkfs(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -466,7 +478,7 @@ def test_mkfs_opts(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -546,7 +558,7 @@ def test_blkid(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -588,7 +600,7 @@ def test_filesystem_available(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -620,7 +632,7 @@ def test_e2fsck(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -650,7 +662,7 @@ def test_list_filesystems(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -681,7 +693,7 @@ def test_mkfifo(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -713,7 +725,7 @@ def test_sync(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -742,7 +754,7 @@ def test_mklost_and_found(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -773,7 +785,7 @@ def test_mknod(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -828,7 +840,7 @@ def test_mknod_b(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -868,7 +880,7 @@ def test_mknod_c(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -908,7 +920,7 @@ def test_ntfsresize_opts(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -971,7 +983,7 @@ def test_resize2fs(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -1031,7 +1043,7 @@ def test_resize2fs_M(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -1080,7 +1092,7 @@ def test_resize2fs_size(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -1140,31 +1152,34 @@ def run(test, params, env):
     image_formats = params.get("image_formats")
     image_name = params.get("image_name", "gs_common")
 
-    for image_format in re.findall("\w+", image_formats):
-        params["image_format"] = image_format
-        for partition_type in re.findall("\w+", partition_types):
-            params["partition_type"] = partition_type
-            image_dir = params.get("img_dir", data_dir.get_tmp_dir())
-            image_path = image_dir + '/' + image_name + '.' + image_format
-            image_name_with_fs_pt = image_name + '.' + fs_type + '.' + partition_type
-            params['image_name'] = image_name_with_fs_pt
-            image_path = image_dir + '/' + image_name_with_fs_pt + '.' + image_format
-
-            if params["gf_create_img_force"] == "no" and os.path.exists(image_path):
-                params["image_path"] = image_path
-                # get mount_point
-                if partition_type == 'lvm':
-                    pv_name = params.get("pv_name", "/dev/sdb")
-                    vg_name = params.get("vg_name", "vol_test")
-                    lv_name = params.get("lv_name", "vol_file")
-                    mount_point = "/dev/%s/%s" % (vg_name, lv_name)
-                elif partition_type == "physical":
-                    logging.info("create physical partition...")
-                    pv_name = params.get("pv_name", "/dev/sdb")
-                    mount_point = pv_name + "1"
-                params["mount_point"] = mount_point
-
-                logging.debug("Skip preparing image, " + image_path + " exists")
-            else:
-                prepare_image(test, params)
-            testcase(test, vm, params)
+    try:
+        for image_format in re.findall("\w+", image_formats):
+            params["image_format"] = image_format
+            for partition_type in re.findall("\w+", partition_types):
+                params["partition_type"] = partition_type
+                image_dir = params.get("img_dir", data_dir.get_tmp_dir())
+                image_path = image_dir + '/' + image_name + '.' + image_format
+                image_name_with_fs_pt = image_name + '.' + fs_type + '.' + partition_type
+                params['image_name'] = image_name_with_fs_pt
+                image_path = image_dir + '/' + image_name_with_fs_pt + '.' + image_format
+
+                if params["gf_create_img_force"] == "no" and os.path.exists(image_path):
+                    params["image_path"] = image_path
+                    # get mount_point
+                    if partition_type == 'lvm':
+                        pv_name = params.get("pv_name", "/dev/sdb")
+                        vg_name = params.get("vg_name", "vol_test")
+                        lv_name = params.get("lv_name", "vol_file")
+                        mount_point = "/dev/%s/%s" % (vg_name, lv_name)
+                    elif partition_type == "physical":
+                        logging.info("create physical partition...")
+                        pv_name = params.get("pv_name", "/dev/sdb")
+                        mount_point = pv_name + "1"
+                    params["mount_point"] = mount_point
+
+                    logging.debug("Skip preparing image, " + image_path + " exists")
+                else:
+                    prepare_image(test, params)
+                testcase(test, vm, params)
+    finally:
+        appliance.close_all()
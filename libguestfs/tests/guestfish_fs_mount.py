@@ -5,18 +5,30 @@ import re
 from virttest import utils_test
 from virttest import data_dir
 
+from provider.libguestfs import appliance
+from provider.libguestfs import image_cache
+
 
 def prepare_image(test, params):
     """
     (1) Create a image
     (2) Create file system on the image
     """
+    # Kept appliances of the image which is going to be re-created
+    if params.get("image_path"):
+        appliance.forget(params["image_path"])
+    if image_cache.is_enabled(params):
+        status, output = image_cache.prepare_image(params)
+        if status is False:
+            test.fail(output)
+        return
+
     params["image_path"] = utils_test.libguestfs.preprocess_image(params)
 
     if not params.get("image_path"):
         test.fail("Image could not be created for some reason.")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     status, output = gf.create_fs()
     if status is False:
         gf.close_session()
@@ -31,7 +43,7 @@ def test_mount(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -67,7 +79,7 @@ def test_mount_options(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -104,7 +116,7 @@ def test_mount_ro(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -141,7 +153,7 @@ def test_mounts(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -166,7 +178,7 @@ def test_mount_loop(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -208,7 +220,7 @@ def test_mountpoints(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -237,7 +249,7 @@ def test_umount(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -305,7 +317,7 @@ def test_mount_vfs(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -343,7 +355,7 @@ def test_umount_all(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     image_path = params.get("image_path")
     gf.add_drive_opts(image_path, readonly=readonly)
@@ -389,31 +401,34 @@ def run(test, params, env):
     image_formats = params.get("image_formats")
     image_name = params.get("image_name", "gs_common")
 
-    for image_format in re.findall("\w+", image_formats):
-        params["image_format"] = image_format
-        for partition_type in re.findall("\w+", partition_types):
-            params["partition_type"] = partition_type
-            image_dir = params.get("img_dir", data_dir.get_tmp_dir())
-            image_path = image_dir + '/' + image_name + '.' + image_format
-            image_name_with_fs_pt = image_name + '.' + fs_type + '.' + partition_type
-            params['image_name'] = image_name_with_fs_pt
-            image_path = image_dir + '/' + image_name_with_fs_pt + '.' + image_format
-
-            if params["gf_create_img_force"] == "no" and os.path.exists(image_path):
-                params["image_path"] = image_path
-                # get mount_point
-                if partition_type == 'lvm':
-                    pv_name = params.get("pv_name", "/dev/sdb")
-                    vg_name = params.get("vg_name", "vol_test")
-                    lv_name = params.get("lv_name", "vol_file")
-                    mount_point = "/dev/%s/%s" % (vg_name, lv_name)
-                elif partition_type == "physical":
-                    logging.info("create physical partition...")
-                    pv_name = params.get("pv_name", "/dev/sdb")
-                    mount_point = pv_name + "1"
-                params["mount_point"] = mount_point
-
-                logging.debug("Skip preparing image, " + image_path + " exists")
-            else:
-                prepare_image(test, params)
-            testcase(test, vm, params)
+    try:
+        for image_format in re.findall("\w+", image_formats):
+            params["image_format"] = image_format
+            for partition_type in re.findall("\w+", partition_types):
+                params["partition_type"] = partition_type
+                image_dir = params.get("img_dir", data_dir.get_tmp_dir())
+                image_path = image_dir + '/' + image_name + '.' + image_format
+                image_name_with_fs_pt = image_name + '.' + fs_type + '.' + partition_type
+                params['image_name'] = image_name_with_fs_pt
+                image_path = image_dir + '/' + image_name_with_fs_pt + '.' + image_format
+
+                if params["gf_create_img_force"] == "no" and os.path.exists(image_path):
+                    params["image_path"] = image_path
+                    # get mount_point
+                    if partition_type == 'lvm':
+                        pv_name = params.get("pv_name", "/dev/sdb")
+                        vg_name = params.get("vg_name", "vol_test")
+                        lv_name = params.get("lv_name", "vol_file")
+                        mount_point = "/dev/%s/%s" % (vg_name, lv_name)
+                    elif partition_type == "physical":
+                        logging.info("create physical partition...")
+                        pv_name = params.get("pv_name", "/dev/sdb")
+                        mount_point = pv_name + "1"
+                    params["mount_point"] = mount_point
+
+                    logging.debug("Skip preparing image, " + image_path + " exists")
+                else:
+                    prepare_image(test, params)
+                testcase(test, vm, params)
+    finally:
+        appliance.close_all()
@@ -3,18 +3,30 @@ import re
 
 from virttest import utils_test
 
+from provider.libguestfs import appliance
+from provider.libguestfs import image_cache
+
 
 def prepare_image(test, params):
     """
     (1) Create a image
     (2) Create file system on the image
     """
+    # Kept appliances of the image which is going to be re-created
+    if params.get("image_path"):
+        appliance.forget(params["image_path"])
+    if image_cache.is_enabled(params):
+        status, output = image_cache.prepare_image(params)
+        if status is False:
+            test.fail(output)
+        return
+
     params["image_path"] = utils_test.libguestfs.preprocess_image(params)
 
     if not params.get("image_path"):
         test.fail("Image could not be created for some reason.")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     status, output = gf.create_fs()
     if status is False:
         gf.close_session()
@@ -57,7 +69,7 @@ def test_is_lv(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -94,7 +106,7 @@ def test_lvcreate(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -136,7 +148,7 @@ def test_lvm_canonical_lv_name(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -171,7 +183,7 @@ def test_lvremove(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -205,7 +217,7 @@ def test_lvm_remove_all(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -246,7 +258,7 @@ def test_lvrename(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -281,7 +293,7 @@ def test_lvresize(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -323,7 +335,7 @@ def test_lvresize_free(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -368,7 +380,7 @@ def test_lvm_set_filter(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -412,7 +424,7 @@ def test_lvuuid(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -450,7 +462,7 @@ def test_vgcreate(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
     if add_ref == "disk":
         image_path = params.get("image_path")
         gf.add_drive_opts(image_path, readonly=readonly)
@@ -487,7 +499,7 @@ def test_vgremove(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -521,7 +533,7 @@ def test_vgrename(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -556,7 +568,7 @@ def test_vgscan(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -585,7 +597,7 @@ def test_vguuid(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -623,7 +635,7 @@ def test_vg_activate(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -666,7 +678,7 @@ def test_vg_activate_all(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -709,7 +721,7 @@ def test_vglvuuids(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -743,7 +755,7 @@ def test_vgpvuuids(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -777,7 +789,7 @@ def test_pvcreate(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -808,7 +820,7 @@ def test_pvremove(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -843,7 +855,7 @@ def test_pvresize(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -887,7 +899,7 @@ def test_pvuuid(test, vm, params):
     add_ref = params.get("gf_add_ref", "disk")
     readonly = "yes" == params.get("gf_add_readonly")
 
-    gf = utils_test.libguestfs.GuestfishTools(params)
+    gf = appliance.new_guestfish(params)
 
     if add_ref == "disk":
         image_path = params.get("image_path")
@@ -942,9 +954,12 @@ def run(test, params, env):
     fs_types = params.get("fs_types")
     image_formats = params.get("image_formats")
 
-    for image_format in re.findall("\w+", image_formats):
-        params["image_format"] = image_format
-        for partition_type in re.findall("\w+", partition_types):
-            params["partition_type"] = partition_type
-            prepare_image(test, params)
-            testcase(test, vm, params)
+    try:
+        for image_format in re.findall("\w+", image_formats):
+            params["image_format"] = image_format
+            for partition_type in re.findall("\w+", partition_types):
+                params["partition_type"] = partition_type
+                prepare_image(test, params)
+                testcase(test, vm, params)
+    finally:
+        appliance.close_all()
@@ -11,6 +11,7 @@ from virttest.libvirt_xml import vm_xml
 from virttest.utils_libvirt import libvirt_misc
 from virttest.utils_test import libvirt
 
+from provider import virsh_pool
 from provider.backingchain import blockcommand_base
 from provider.virtual_disk import disk_base
 
@@ -152,7 +153,7 @@ def run(test, params, env):
         :return: alloc_dict: Return {"0":"1129906176", "1":"196616"} if get
         'block.0.allocation=1129906176', 'block.1.allocation=196616'
         """
-        domstats_result = virsh.domstats(vm_name, domstats_option,
+        domstats_result = virsh_pool.run("domstats", vm_name, domstats_option,
                                          ignore_status=True, debug=True).stdout
         alloc_dict = libvirt_misc.convert_to_dict(
             domstats_result.strip("\n"), pattern=r"block.(\d+).allocation=(\d+)")
@@ -65,12 +65,12 @@ def run(test, params, env):
         :param property_item: The property you want to check.
         """
         if property_item == "extended_l2_and_cluster_size":
-            check_obj.check_image_info(path, 'extended l2',
-                                       expected_extended_l2)
+            chain = check_obj.check_image_info(path, 'extended l2',
+                                               expected_extended_l2)
 
             cluster_size_value = int(re.findall(r"\d+", cluster_size)[0])*1024*1024
             check_obj.check_image_info(path, 'csize',
-                                       cluster_size_value)
+                                       cluster_size_value, chain=chain)
 
     def prepare_disk():
         """
@@ -3,11 +3,11 @@ import os
 from virttest import data_dir
 from virttest import virsh
 from virttest import utils_libvirtd
-from virttest import utils_misc
 from virttest.libvirt_xml import vm_xml
 from virttest.utils_test import libvirt
 from virttest.utils_libvirt import libvirt_disk
 
+from provider import log_watcher
 from provider.backingchain import blockcommand_base
 from provider.virtual_disk import disk_base
 
@@ -50,7 +50,8 @@ def run(test, params, env):
         """
         if not os.path.exists(libvirtd_log_file):
             test.fail("Expected VM log file: %s not exists" % libvirtd_log_file)
-        result = utils_misc.wait_for(lambda: libvirt.check_logfile(expected_log, libvirtd_log_file), timeout=20)
+        result = log_watcher.LogWatcher().wait_for(libvirtd_log_file,
+                                                   expected_log, timeout=20)
         if not result:
             test.fail("Can't get expected log %s in %s" % (expected_log, libvirtd_log_file))
 
@@ -10,6 +10,8 @@ from virttest.libvirt_xml import domcapability_xml
 from virttest.libvirt_xml import vm_xml
 from virttest.utils_test import libvirt
 
+from provider import host_facts
+
 
 # Using as lower capital is not the best way to do, but this is just a
 # workaround to avoid changing the entire file.
@@ -241,7 +243,7 @@ def run(test, params, env):
 
     try:
         if check_vendor_id:
-            output = virsh.capabilities(debug=True)
+            output = host_facts.get_capabilities()
             host_vendor = re.findall(r'<vendor>(\w+)<', output)[0]
 
             cpu_vendor_id = 'GenuineIntel'
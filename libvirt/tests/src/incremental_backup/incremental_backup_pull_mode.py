@@ -19,6 +19,8 @@ from virttest.utils_conn import TLSConnection
 from virttest.utils_libvirt import libvirt_secret
 from virttest.utils_test import libvirt
 
+from provider.virtual_disk import backup_verify
+
 
 # Using as lower capital is not the best way to do, but this is just a
 # workaround to avoid changing the entire file.
@@ -393,15 +395,15 @@ def run(test, params, env):
             vm.destroy(gracefully=False)
 
         # Compare the backup data and original data
-        original_data_file = os.path.join(tmp_dir, "original_data.qcow2")
-        cmd = "qemu-img convert -f qcow2 %s -O qcow2 %s" % (disk_path, original_data_file)
-        process.run(cmd, shell=True, verbose=True)
-        for backup_file in backup_file_list:
-            if not utils_backup.cmp_backup_data(original_data_file, backup_file):
-                test.fail("Backup and original data are not identical for"
-                          "'%s' and '%s'" % (disk_path, backup_file))
-            else:
-                logging.debug("'%s' contains correct backup data", backup_file)
+        for result in backup_verify.verify_backups(disk_path, backup_file_list,
+                                                   tmp_dir=tmp_dir):
+            if not result['identical']:
+                test.fail("Backup and original data are not identical for "
+                          "'%s' and '%s' at offset %s" % (
+                              disk_path, result['backup'], result['mismatch']))
+            logging.debug("'%s' contains correct backup data, compared %d "
+                          "bytes, skipped %d bytes", result['backup'],
+                          result['compared'], result['skipped'])
     except utils_backup.BackupBeginError as detail:
         if backup_error:
             logging.debug("Backup failed as expected.")
@@ -6,6 +6,8 @@ from virttest import virsh
 from virttest import utils_test
 from virttest import utils_misc
 
+from provider.libvirt_bench import workload_results
+
 
 # Using as lower capital is not the best way to do, but this is just a
 # workaround to avoid changing the entire file.
@@ -47,7 +49,8 @@ def run(test, params, env):
     1) Get the params from params.
     2) Run iozone on guest.
     3) Run domstate_switch test for each VM.
-    3) Clean up.
+    4) Save the iozone scores tagged with the domstate switching.
+    5) Clean up.
     """
     vms = env.get_all_vms()
     iozone_control_file = params.get("iozone_control_file",
@@ -80,20 +83,35 @@ def run(test, params, env):
                         "such as gcc, tar, bzip2")
     logging.debug("Iozone is already running in VMs.")
 
+    # Record the iozone scores while switching domain states.
+    log_path = params.get("LB_workload_log", workload_results.AUTOTEST_LOG)
+    collector = workload_results.WorkloadResultCollector("iozone", log_path)
+    poll_interval = int(params.get("LB_workload_poll_interval", "10"))
+    log_sessions = dict((vm.name, vm.wait_for_login()) for vm in vms)
+    time.sleep(int(params.get("LB_workload_baseline_time", "0")))
+    collector.poll_all(log_sessions)
+
     try:
         # Create a BackgroundTest for each vm to run test domstate_switch.
         backgroud_tests = []
-        for vm in vms:
-            bt = utils_test.BackgroundTest(func_in_thread, [vm, timeout, test])
-            bt.start()
-            backgroud_tests.append(bt)
+        with collector.operation("domstate_switch"):
+            for vm in vms:
+                bt = utils_test.BackgroundTest(func_in_thread,
+                                               [vm, timeout, test])
+                bt.start()
+                backgroud_tests.append(bt)
 
-        for bt in backgroud_tests:
-            bt.join()
+            while any(bt.is_alive() for bt in backgroud_tests):
+                collector.poll_all(log_sessions)
+                time.sleep(poll_interval)
+            for bt in backgroud_tests:
+                bt.join()
+        collector.poll_all(log_sessions)
 
         # Reboot vms after func_in_thread to check vm is running normally.
         for vm in vms:
             vm.reboot()
     finally:
+        collector.save(test.outputdir)
         # Clean up.
         logging.debug("No cleaning operation for this test.")
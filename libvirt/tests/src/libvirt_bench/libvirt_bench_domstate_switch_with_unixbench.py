@@ -9,6 +9,8 @@ from virttest import utils_test
 from virttest import utils_misc
 from virttest import data_dir
 
+from provider.libvirt_bench import workload_results
+
 
 # Using as lower capital is not the best way to do, but this is just a
 # workaround to avoid changing the entire file.
@@ -50,7 +52,8 @@ def run(test, params, env):
     1) Get the params from params.
     2) Run unixbench on guest.
     3) Run domstate_switch test for each VM.
-    3) Clean up.
+    4) Save the unixbench scores tagged with the domstate switching.
+    5) Clean up.
     """
     vms = env.get_all_vms()
     unixbench_control_file = params.get("unixbench_controle_file",
@@ -93,17 +96,32 @@ def run(test, params, env):
             '-t', unixbench_control_file]
     host_unixbench_process = subprocess.Popen(args)
 
+    # Record the unixbench scores while switching domain states.
+    log_path = params.get("LB_workload_log", workload_results.AUTOTEST_LOG)
+    collector = workload_results.WorkloadResultCollector("unixbench", log_path)
+    poll_interval = int(params.get("LB_workload_poll_interval", "10"))
+    log_sessions = dict((vm.name, vm.wait_for_login()) for vm in vms)
+    time.sleep(int(params.get("LB_workload_baseline_time", "0")))
+    collector.poll_all(log_sessions)
+
     try:
         # Create a BackgroundTest for each vm to run test domstate_switch.
         backgroud_tests = []
-        for vm in vms:
-            bt = utils_test.BackgroundTest(func_in_thread, [vm, timeout, test])
-            bt.start()
-            backgroud_tests.append(bt)
+        with collector.operation("domstate_switch"):
+            for vm in vms:
+                bt = utils_test.BackgroundTest(func_in_thread,
+                                               [vm, timeout, test])
+                bt.start()
+                backgroud_tests.append(bt)
 
-        for bt in backgroud_tests:
-            bt.join()
+            while any(bt.is_alive() for bt in backgroud_tests):
+                collector.poll_all(log_sessions)
+                time.sleep(poll_interval)
+            for bt in backgroud_tests:
+                bt.join()
+        collector.poll_all(log_sessions)
     finally:
+        collector.save(test.outputdir)
         # Kill process on host running unixbench.
         utils_misc.kill_process_tree(host_unixbench_process.pid)
         # Remove the result dir produced by subprocess host_unixbench_process.
@@ -1,10 +1,13 @@
 import os
+import time
 import logging as log
 
 from virttest import utils_test
 from virttest import utils_misc
 from virttest import data_dir
 
+from provider.libvirt_bench import workload_results
+
 
 # Using as lower capital is not the best way to do, but this is just a
 # workaround to avoid changing the entire file.
@@ -18,7 +21,8 @@ def run(test, params, env):
     1) Get the params from params.
     2) Run netperf on guest.
     3) Dump each VM and check result.
-    3) Clean up.
+    4) Save the netperf scores tagged with the dump in progress.
+    5) Clean up.
     """
     vms = env.get_all_vms()
     netperf_control_file = params.get("netperf_controle_file",
@@ -53,10 +57,19 @@ def run(test, params, env):
 
     logging.debug("Netperf is already running in VMs.")
 
+    # Record the netperf scores before and after every dump.
+    log_path = params.get("LB_workload_log", workload_results.AUTOTEST_LOG)
+    collector = workload_results.WorkloadResultCollector("netperf", log_path)
+    log_sessions = dict((vm.name, vm.wait_for_login()) for vm in vms)
+    time.sleep(int(params.get("LB_workload_baseline_time", "0")))
+    collector.poll_all(log_sessions)
+
     try:
         dump_path = os.path.join(data_dir.get_tmp_dir(), "dump_file")
         for vm in vms:
-            vm.dump(dump_path)
+            with collector.operation("dump"):
+                vm.dump(dump_path)
+            collector.poll_all(log_sessions)
             # Check the status after vm.dump()
             if not vm.is_alive():
                 test.fail("VM is shutoff after dump.")
@@ -65,6 +78,8 @@ def run(test, params, env):
             # Check VM is running normally.
             vm.wait_for_login()
     finally:
+        collector.poll_all(log_sessions)
+        collector.save(test.outputdir)
         # Destroy VM.
         for vm in vms:
             vm.destroy()
@@ -1,39 +1,103 @@
+import json
+import os
+import re
+import threading
 import time
 import logging as log
 
-import aexpect
-
 from avocado.utils import path
+from avocado.utils import process
 
 from virttest import utils_net
-from virttest import remote
 from virttest import utils_misc
 
+from provider.libvirt_bench import bench_utils
+
 
 # Using as lower capital is not the best way to do, but this is just a
 # workaround to avoid changing the entire file.
 logging = log.getLogger('avocado.' + __name__)
 
 
+def parse_ttcp_throughput(output):
+    """
+    Get throughput in KB/s from ttcp output, like
+    "ttcp-t: 65536000 bytes in 0.56 real seconds = 114285.71 KB/sec +++"
+
+    :param output: str, output of ttcp client
+    :return: float, throughput in KB/s, None if not found
+    """
+    units = {'b': 1.0 / 1024, 'k': 1, 'm': 1024, 'g': 1024 ** 2}
+    mobj = re.search(r'=\s*([\d.]+)\s*([bBkKmMgG])\w*/sec', output)
+    if not mobj:
+        return None
+    return float(mobj.group(1)) * units[mobj.group(2).lower()]
+
+
+def set_ttcp_port(command, port):
+    """
+    Replace the port in ttcp command
+
+    :param command: str, ttcp command
+    :param port: int, port to use
+    :return: str, the new command
+    """
+    if re.search(r'-p\s*\d+', command):
+        return re.sub(r'-p\s*\d+', '-p%d' % port, command)
+    return "%s -p%d" % (command, port)
+
+
 def run(test, params, env):
     """
     Test steps:
 
     1) Check the environment and get the params from params.
     2) while(loop_time < timeout):
-            ttcp command.
-    3) clean up.
+            ttcp command from all guests concurrently.
+    3) Save the throughput and compare it with the baseline.
+    4) clean up.
     """
+    def _run_client(vm, session, cmd, iteration):
+        """
+        Run ttcp client in guest and record the throughput
+
+        :param vm: vm object
+        :param session: login session of vm
+        :param cmd: ttcp client command
+        :param iteration: index of the loop
+        """
+        result = {}
+
+        def _ttcp_good():
+            status, output = session.cmd_status_output(cmd, timeout=120)
+            logging.debug("%s: %s", vm.name, output)
+            result['status'], result['output'] = status, output
+            return not status
+
+        if not utils_misc.wait_for(_ttcp_good, timeout=60):
+            errors.append("Failed to run ttcp command on guest %s.\n"
+                          "Detail: %s." % (vm.name, result.get('output')))
+            return
+        throughput = parse_ttcp_throughput(result['output'])
+        if throughput is None:
+            errors.append("Failed to get throughput of ttcp on guest %s "
+                          "from: %s" % (vm.name, result['output']))
+            return
+        with lock:
+            samples.append({'vm': vm.name, 'iteration': iteration,
+                            'kbps': throughput})
+
     # Find the ttcp command.
     try:
         path.find_command("ttcp")
     except path.CmdNotFoundError:
         test.cancel("Not find ttcp command on host.")
-    # Get VM.
+    # Get VM and keep one session per vm for the whole test.
     vms = env.get_all_vms()
+    sessions = {}
     for vm in vms:
-        session = vm.wait_for_login()
-        status, _ = session.cmd_status_output("which ttcp")
+        sessions[vm.name] = vm.wait_for_login()
+        status, _ = sessions[vm.name].cmd_status_output("which ttcp")
         if status:
             test.cancel("Not find ttcp command on guest.")
     # Get parameters from params.
@@ -42,35 +106,84 @@ def run(test, params, env):
                                      "ttcp -s -r -v -D -p5015")
     ttcp_client_command = params.get("LB_ttcp_client_command",
                                      "ttcp -s -t -v -D -p5015 -b65536 -l65536 -n1000 -f K")
+    # Every guest talks to its own ttcp server on base_port + index
+    base_port = int(params.get("LB_ttcp_base_port", "5015"))
+    baseline_file = params.get("LB_ttcp_baseline_file")
+    baseline_ratio = float(params.get("LB_ttcp_baseline_ratio", "0.9"))
+    save_baseline = "yes" == params.get("LB_ttcp_save_baseline", "no")
+    host_ip = utils_net.get_host_ip_address(params)
 
-    host_session = aexpect.ShellSession("sh")
-
+    samples = []
+    errors = []
+    lock = threading.Lock()
+    servers = []
+    iteration = 0
     try:
         current_time = int(time.time())
         end_time = current_time + timeout
         # Start the loop from current_time to end_time.
         while current_time < end_time:
-            for vm in vms:
-                session = vm.wait_for_login()
-                host_session.sendline(ttcp_server_command)
-
-                cmd = ("%s %s" % (ttcp_client_command, utils_net.get_host_ip_address(params)))
-
-                def _ttcp_good():
-                    status, output = session.cmd_status_output(cmd)
-                    logging.debug(output)
-                    if status:
-                        return False
-                    return True
-
-                if not utils_misc.wait_for(_ttcp_good, timeout=60):
-                    status, output = session.cmd_status_output(cmd)
-                    if status:
-                        test.fail("Failed to run ttcp command on guest.\n"
-                                  "Detail: %s." % output)
-                remote.handle_prompts(host_session, None, None, r"[\#\$]\s*$")
-                current_time = int(time.time())
+            servers = []
+            threads = []
+            for index, vm in enumerate(vms):
+                port = base_port + index
+                server = process.SubProcess(
+                    set_ttcp_port(ttcp_server_command, port), shell=True)
+                server.start()
+                servers.append(server)
+                cmd = "%s %s" % (set_ttcp_port(ttcp_client_command, port),
+                                 host_ip)
+                threads.append(threading.Thread(
+                    target=_run_client,
+                    args=(vm, sessions[vm.name], cmd, iteration)))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for server in servers:
+                server.wait(timeout=60)
+            if errors:
+                test.fail("\n".join(errors))
+            iteration += 1
+            current_time = int(time.time())
+
+        # Aggregate throughput of all guests per loop
+        aggregate = {}
+        for sample in samples:
+            aggregate[sample['iteration']] = (aggregate.get(
+                sample['iteration'], 0) + sample['kbps'])
+        aggregate_kbps = (sum(aggregate.values()) / len(aggregate)
+                          if aggregate else 0)
+        result = {'samples': samples,
+                  'per_vm': dict((vm.name, bench_utils.summarize(
+                      [s['kbps'] for s in samples if s['vm'] == vm.name]))
+                      for vm in vms),
+                  'aggregate_kbps': aggregate_kbps}
+        logging.info("ttcp throughput per guest:\n%s",
+                     bench_utils.format_summary_table(result['per_vm'],
+                                                      unit='KB/s'))
+        logging.info("Aggregate ttcp throughput: %.2f KB/s", aggregate_kbps)
+        bench_utils.save_json(result, test.outputdir, "ttcp_throughput.json")
+
+        if baseline_file:
+            if save_baseline:
+                with open(baseline_file, 'w') as fd:
+                    json.dump({'aggregate_kbps': aggregate_kbps}, fd)
+                logging.info("Saved ttcp baseline to %s", baseline_file)
+            elif os.path.exists(baseline_file):
+                with open(baseline_file) as fd:
+                    baseline_kbps = json.load(fd)['aggregate_kbps']
+                if aggregate_kbps < baseline_kbps * baseline_ratio:
+                    test.fail("Aggregate ttcp throughput %.2f KB/s is lower "
+                              "than %s of the baseline %.2f KB/s" %
+                              (aggregate_kbps, baseline_ratio, baseline_kbps))
+            else:
+                test.error("ttcp baseline file %s does not exist"
+                           % baseline_file)
     finally:
         # Clean up.
-        host_session.close()
-        session.close()
+        for server in servers:
+            if server.poll() is None:
+                server.kill()
+        for session in sessions.values():
+            session.close()
@@ -8,7 +8,9 @@ from virttest import virsh
 from virttest.libvirt_xml import vm_xml
 from virttest.utils_test import libvirt
 
+from provider import log_watcher
 from provider.save import save_base
+from provider.save import save_format_bench
 
 LOG = logging.getLogger('avocado.test.' + __name__)
 VIRSH_ARGS = {'debug': True, 'ignore_status': False}
@@ -35,9 +37,11 @@ def save_with_format(save_format, test, params, env):
     libvirtd = utils_libvirtd.Libvirtd()
     qemu_conf.save_image_format = save_format
     libvirtd.restart()
+    watcher = log_watcher.LogWatcher()
 
     try:
         pid_ping, upsince = save_base.pre_save_setup(vm)
+        watcher.mark(log_file, 'save')
         save_result = virsh.save(vm_name, save_path, debug=True)
         duration = save_result.duration
         LOG.debug(f'Duration of {format}: {duration}')
@@ -47,13 +51,17 @@ def save_with_format(save_format, test, params, env):
 
         if save_format != 'raw':
             log_pattern = f'virCommandRunAsync.*{save_format} -c'
-            libvirt.check_logfile(log_pattern, log_file)
+            if not watcher.wait_for(log_file, log_pattern, 10, step='save'):
+                test.fail(f'Not found {log_pattern} in {log_file}')
 
+        watcher.mark(log_file, 'restore')
         virsh.restore(save_path, **VIRSH_ARGS)
 
         if save_format != 'raw':
             log_pattern = f'virCommandRunAsync.*{save_format} -dc'
-            libvirt.check_logfile(log_pattern, log_file)
+            if not watcher.wait_for(log_file, log_pattern, 10,
+                                    step='restore'):
+                test.fail(f'Not found {log_pattern} in {log_file}')
 
         save_base.post_save_check(vm, pid_ping, upsince)
 
@@ -66,6 +74,29 @@ def save_with_format(save_format, test, params, env):
         libvirtd.restart()
 
 
+def run_save_bench(test, params, vm):
+    """
+    Measure save/restore of a matrix of formats, memory sizes and dirtiness
+
+    :param test: test instance
+    :param params: test params
+    :param vm: vm instance
+    """
+    bench = save_format_bench.SaveFormatBench(
+        vm, params.get('save_formats', '').split(),
+        mem_sizes=params.get('save_bench_mem_sizes', '').split(),
+        dirty_ratios=params.get('save_bench_dirty_ratios', '0').split(),
+        parallel_channels=params.get(
+            'save_bench_parallel_channels', '').split(),
+        save_dir=params.get('save_bench_dir', '/var/tmp'))
+    try:
+        bench.run()
+    finally:
+        bench.save(test.outputdir)
+    if bench.errors:
+        test.fail('Save/restore failed:\n%s' % '\n'.join(bench.errors))
+
+
 def run(test, params, env):
     """
     Test virsh save with different formats and compare duration and image size
@@ -85,7 +116,9 @@ def run(test, params, env):
 
     try:
         vm.start()
-        if not status_error:
+        if "yes" == params.get('save_bench', 'no'):
+            run_save_bench(test, params, vm)
+        elif not status_error:
             save_info = {}
             for save_format in save_formats:
                 save_info[save_format] = save_with_format(save_format, test,
@@ -4,7 +4,6 @@ import time
 import errno
 import socket
 import threading
-import select
 import platform
 import subprocess
 import re
@@ -22,7 +21,7 @@ from virttest.libvirt_xml.devices.console import Console
 
 from virttest import libvirt_version
 
-from avocado.utils import astring
+from provider.chardev import console_engine
 
 
 # Using as lower capital is not the best way to do, but this is just a
@@ -37,7 +36,8 @@ class ConsoleSession(aexpect.ShellSession):
     with qemu VM in different ways.
     """
 
-    def __init__(self, console_type, address, is_server=False, pki_path='.', output_prefix=""):
+    def __init__(self, console_type, address, is_server=False, pki_path='.',
+                 output_prefix="", engine=None):
         """
         Initialize the instance and create socket/fd for connect with.
 
@@ -49,6 +49,8 @@ class ConsoleSession(aexpect.ShellSession):
                         connect with
         :param is_server: Whether this connection act as a server or a client
         :param pki_path: Where the tls pki file is located
+        :param engine: ConsoleEngine reading the console, None for the one
+                       shared by all consoles
         """
         self.exit = False
         self.address = address
@@ -64,6 +66,8 @@ class ConsoleSession(aexpect.ShellSession):
         self.status_test_command = "echo $?"
         self.process = None
         self.output_prefix = output_prefix
+        self.engine = engine or console_engine.get_engine()
+        self._connected = not is_server or console_type != 'tcp'
 
         if console_type == 'unix':
             self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
@@ -125,6 +129,7 @@ class ConsoleSession(aexpect.ShellSession):
                 os.O_RDONLY | os.O_CREAT | os.O_NONBLOCK)
         elif console_type == 'file':
             self.read_fd = open(address, 'r', errors='ignore')
+        self.engine.register(self)
 
     def _tcp_thread(self):
         """
@@ -133,6 +138,46 @@ class ConsoleSession(aexpect.ShellSession):
         socket, addr = self.socket.accept()
         logging.debug("TCP connection established from %s", addr)
         self.socket = socket
+        self._connected = True
+
+    def get_read_obj(self):
+        """
+        Get the socket or fd for the engine to wait on.
+
+        :return: socket, fd or file object, None if not connected yet
+        """
+        if not self._connected:
+            return None
+        if self.socket is not None:
+            return self.socket
+        return self.read_fd
+
+    def read_chunk(self):
+        """
+        Read available data from socket/fd without blocking.
+
+        :return: bytes or str read, None if nothing is available, empty if
+                 the peer is gone
+        """
+        try:
+            if self.console_type in ['tcp', 'unix']:
+                return self.socket.recv(console_engine.READ_SIZE,
+                                        socket.MSG_DONTWAIT)
+            elif self.console_type == 'udp':
+                data, self.peer_addr = self.socket.recvfrom(
+                    console_engine.READ_SIZE, socket.MSG_DONTWAIT)
+                return data
+            elif self.console_type == 'pipe':
+                return os.read(self.read_fd, console_engine.READ_SIZE)
+            elif self.console_type in ['file', 'tls']:
+                # Regular files return empty at the end, which only means
+                # nothing is available yet
+                return self.read_fd.read(console_engine.READ_SIZE) or None
+        except (socket.error, OSError) as detail:
+            if detail.args[0] in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                return None
+            raise
+        return None
 
     def read_nonblocking(self, internal_timeout=None, timeout=None):
         """
@@ -150,45 +195,13 @@ class ConsoleSession(aexpect.ShellSession):
             end_time = time.time() + timeout
         data = ""
         while True:
-            try:
-                if self.console_type in ['tcp', 'unix']:
-                    new_data = self.socket.recv(
-                        1024, socket.MSG_DONTWAIT)
-                    data += astring.to_text(new_data, errors='ignore')
-                    return data
-                elif self.console_type == 'udp':
-                    new_data, self.peer_addr = self.socket.recvfrom(
-                        1024, socket.MSG_DONTWAIT)
-                    data += astring.to_text(new_data, errors='ignore')
-                    return data
-                elif self.console_type in ['file', 'pipe', 'tls']:
-                    try:
-                        read_fds, _, _ = select.select(
-                            [self.read_fd], [], [], internal_timeout)
-                    except Exception:
-                        return data
-                    if self.read_fd in read_fds:
-                        if self.console_type == 'pipe':
-                            new_data = os.read(self.read_fd, 1024)
-                        else:
-                            new_data = self.read_fd.read(1024)
-                        if not new_data:
-                            return data
-                        data += new_data
-                    else:
-                        return data
-            except socket.error as detail:
-                err = detail.args[0]
-                if err in [errno.EAGAIN, errno.EWOULDBLOCK]:
-                    return data
-                else:
-                    raise detail
-            except OSError as detail:
-                err = detail.args[0]
-                if err in [errno.EAGAIN, errno.EWOULDBLOCK]:
-                    return data
-                else:
-                    raise detail
+            wait = internal_timeout
+            if end_time:
+                wait = min(wait, end_time - time.time())
+            new_data = self.engine.read(self, max(wait, 0))
+            if not new_data:
+                return data
+            data += new_data
             if end_time and time.time() > end_time:
                 return data
 
@@ -196,7 +209,10 @@ class ConsoleSession(aexpect.ShellSession):
                                   timeout=60, internal_timeout=None,
                                   print_func=None, match_func=None):
         """
-        Read from socket/fd using read_nonblocking until a pattern matches.
+        Read from socket/fd until a pattern matches.
+
+        Reading blocks in the engine until data arrives, and only the new
+        data plus a bounded look-behind window is searched every time.
 
         :param patterns: List of strings (regular expression patterns)
         :param filter_func: Function to apply to the data read from the child
@@ -204,32 +220,30 @@ class ConsoleSession(aexpect.ShellSession):
                 and return a string)
         :param timeout: The duration (in seconds) to wait until a match is
                 found
-        :param internal_timeout: The timeout to pass to read_nonblocking
+        :param internal_timeout: Not used, kept for compatibility
         :param print_func: A function to be used to print the data being read
                 (should take a string parameter)
         :param match_func: Function to compare the output and patterns.
         :return: Tuple containing the match index and the data read so far
         :raise ExpectTimeoutError: Raised if timeout expires
-        :raise ExpectProcessTerminatedError: Raised if the child process
-                terminates while waiting for output
-        :raise ExpectError: Raised if an unknown error occurs
         """
         if not match_func:
             match_func = self.match_patterns
-        output = ""
+        matcher = console_engine.IncrementalMatcher(patterns, filter_func,
+                                                    match_func)
         end_time = time.time() + timeout
         while True:
-            data = self.read_nonblocking(internal_timeout,
-                                         end_time - time.time())
+            data = self.engine.read(self, max(end_time - time.time(), 0))
             # Print it if necessary
             if print_func:
                 for line in data.splitlines():
                     print_func(line)
             # Look for patterns
-            output += data
-            match = match_func(filter_func(output), patterns)
+            match = matcher.feed(data)
             if match is not None:
-                return match, output
+                return match, matcher.output
+            if time.time() >= end_time:
+                raise aexpect.ExpectTimeoutError(patterns, matcher.output)
 
     def wait_for_login(self, username, password,
                        timeout=240, internal_timeout=10):
@@ -246,8 +260,10 @@ class ConsoleSession(aexpect.ShellSession):
                 remote.handle_prompts(self, username, password,
                                       self.prompt, internal_timeout)
                 return
-            except aexpect.ExpectTimeoutError as detail:
-                raise remote.LoginTimeoutError(detail.output)
+            except (aexpect.ExpectTimeoutError,
+                    remote.LoginTimeoutError) as detail:
+                # The guest may still be booting, retry until timeout
+                logging.debug("No login prompt yet, retrying: %s", detail)
             except aexpect.ExpectProcessTerminatedError as detail:
                 raise remote.LoginProcessTerminatedError(
                     detail.status, detail.output)
@@ -279,6 +295,7 @@ class ConsoleSession(aexpect.ShellSession):
 
     def __del__(self):
         self.exit = True
+        self.engine.unregister(self)
         if self._poll_thread:
             self._poll_thread.join()
         if self.socket is not None:
@@ -1,36 +1,35 @@
 import logging as log
+import re
 
 from virttest import libvirt_xml
 from virttest import utils_config
 from virttest import utils_libvirtd
-from virttest import utils_misc
 from virttest import virsh
 
 from virttest.utils_test import libvirt
 from virttest.libvirt_xml.devices.serial import Serial
 
+from provider import log_watcher
+
 
 # Using as lower capital is not the best way to do, but this is just a
 # workaround to avoid changing the entire file.
 logging = log.getLogger('avocado.' + __name__)
 
 
-def check_pty_log_file(file_path, boot_prompt):
+def check_pty_log_file(file_path, boot_prompt, timeout=6):
     """
     Check if pty log file has vm boot up logs
 
     :param file_path: the pty log file path
     :param boot_prompt: the expected login prompt
+    :param timeout: seconds to wait for the prompt
     :return: True or False according the result of finding
     """
-
-    with open(file_path, errors='ignore') as fp:
-        contents = fp.read()
-    logging.debug("The contents of log file are : %s" % contents)
-    ret = contents.find(boot_prompt)
-    if ret == -1:
-        return False
-    return True
+    found = log_watcher.LogWatcher().wait_for(
+        file_path, re.escape(boot_prompt), timeout=timeout)
+    logging.debug("Found in log file: %s", found)
+    return bool(found)
 
 
 def run(test, params, env):
@@ -96,8 +95,7 @@ def run(test, params, env):
         vm.wait_for_login().close()
 
         # Need to wait for a while to get login prompt
-        if not utils_misc.wait_for(
-                lambda: check_pty_log_file(log_file, boot_prompt), 6):
+        if not check_pty_log_file(log_file, boot_prompt):
             test.fail("Failed to find the vm login prompt from %s" % log_file)
 
     except Exception as e:
@@ -80,7 +80,7 @@ def run(test, params, env):
         libvirt_vmxml.remove_vm_devices_by_type(vm, 'interface')
 
         test.log.info("TEST_SETUP: Cold plug 64 interfaces to VM.")
-        opts = "network %s --config" % list(net_info.values())[0]
+        iface_dicts = []
         for i in range(vf_no):
             iface_dict = {
                 'address': {'type_name': 'pci',
@@ -93,8 +93,9 @@ def run(test, params, env):
                 'type_name': 'network'}
             if i % 8 == 0:
                 iface_dict['address']['attrs'].update({'multifunction': 'on'})
-            iface_dev = interface_base.create_iface("network", iface_dict)
-            virsh.attach_device(vm.name, iface_dev.xml, flagstr="--config", debug=True, ignore_status=False)
+            iface_dicts.append(iface_dict)
+        iface_devs = interface_base.create_iface_devs("network", iface_dicts)
+        interface_base.attach_devices_config(vm.name, iface_devs)
         net_name_2 = list(net_info.values())[1]
         opts = "network %s --config" % net_name_2
         virsh.attach_interface(vm_name, opts, debug=True, ignore_status=False)
@@ -13,19 +13,18 @@ from virttest import ssh_key
 from virttest import migration
 from virttest.libvirt_xml import vm_xml
 
+from provider.migration import downtime_probe
+from provider.migration import multi_vm_migration
+
 
 # To get result in thread, using global parameters
-# Result of virsh migrate command
-global ret_migration
 # Result of virsh domjobabort
 global ret_jobabort
 # If downtime is tolerable
 global ret_downtime_tolerable
 # True means command executed successfully
-ret_migration = True
 ret_jobabort = True
 ret_downtime_tolerable = True
-flag_migration = True
 
 
 # Using as lower capital is not the best way to do, but this is just a
@@ -75,34 +74,6 @@ def make_migration_options(method, optionstr="", timeout=60):
     return options + migrate_exec
 
 
-def thread_func_ping(lrunner, rrunner, vm_ip, tolerable=5):
-    """
-    Check connectivity during migration: Ping vm every second, check whether
-    the paused state is intolerable.
-    """
-    cmd = "ping -c 1 %s" % vm_ip
-    time1 = None    # Flag the time local vm is down
-    time2 = None    # Flag the time remote vm is up
-    timeout = 360   # In case thread is not killed at the end of test
-    global ret_downtime_tolerable
-    while timeout:
-        ls = lrunner.run(cmd, ignore_status=True).exit_status
-        rs = rrunner.run(cmd, ignore_status=True).exit_status
-        if ls and time1 is None:   # The first time local vm is not connective
-            time1 = int(time.time())
-        if not rs and time2 is None:  # The first time remote vm is connective
-            time2 = int(time.time())
-        if time1 is None or time2 is None:
-            time.sleep(1)
-            timeout -= 1
-        else:
-            if int(time2 - time1) > int(tolerable):
-                logging.debug("The time local vm is down: %s", time1)
-                logging.debug("The time remote vm is up: %s", time2)
-                ret_downtime_tolerable = False
-            break   # Got enough information, leaving thread anyway
-
-
 def thread_func_jobabort(vm):
     global ret_jobabort
     if not vm.domjobabort():
@@ -111,7 +82,9 @@ def thread_func_jobabort(vm):
 
 def multi_migration(vm, src_uri, dest_uri, options, migrate_type,
                     migrate_thread_timeout, jobabort=False,
-                    lrunner=None, rrunner=None, status_error=None):
+                    lrunner=None, rrunner=None, status_error=None,
+                    downtime_tolerable=5, probe_interval=0.01,
+                    concurrency=0, stagger=0, result_dir=None):
     """
     Migrate multiple vms simultaneously or not.
 
@@ -119,7 +92,7 @@ def multi_migration(vm, src_uri, dest_uri, options, migrate_type,
     :param src_uri: source ip address for migration
     :param dest_uri: destination ipaddress for migration
     :param options: options to be passed in migration command
-    :param migrate_type: orderly or simultaneous migration type
+    :param migrate_type: orderly, simultaneous or concurrent migration type
     :param migrate_thread_timeout: thread timeout for migrating vms
     :param jobabort: If jobabort is True, run "virsh domjobabort vm_name"
                during migration.
@@ -127,7 +100,17 @@ def multi_migration(vm, src_uri, dest_uri, options, migrate_type,
     :param lrunner: local session instance
     :param rrunner: remote session instance
     :param status_error: Whether expect error status
+    :param downtime_tolerable: tolerable downtime in seconds for orderly
+                               migration
+    :param probe_interval: interval in seconds of the downtime probe
+    :param concurrency: max migrations in flight for concurrent migration,
+                        0 means all vms
+    :param stagger: seconds between two migration starts for concurrent
+                    migration
+    :param result_dir: directory to save the concurrent migration report
+    :return: True if migration succeed
     """
+    global ret_downtime_tolerable
 
     obj_migration = migration.MigrationTest()
     if migrate_type.lower() == "simultaneous":
@@ -153,13 +136,22 @@ def multi_migration(vm, src_uri, dest_uri, options, migrate_type,
                     jobabort_thread.start()
                 for jobabort_thread in jobabort_threads:
                     jobabort_thread.join(migrate_thread_timeout)
-            ret_migration = True
 
         except Exception as info:
             raise exceptions.TestFail(info)
 
     elif migrate_type.lower() == "orderly":
         logging.info("Migrate vms orderly.")
+        # Measure downtime from both hosts while migration is in flight
+        probes = []
+        for each_vm in vm:
+            probe = downtime_probe.DowntimeProbe(
+                each_vm.get_address(),
+                runners={'local': lrunner, 'remote': rrunner},
+                interval=probe_interval,
+                deadline=migrate_thread_timeout * len(vm))
+            probe.start()
+            probes.append(probe)
         try:
             obj_migration.do_migration(vms=vm, srcuri=src_uri,
                                        desturi=dest_uri,
@@ -168,19 +160,31 @@ def multi_migration(vm, src_uri, dest_uri, options, migrate_type,
                                        thread_timeout=migrate_thread_timeout,
                                        ignore_status=False,
                                        status_error=status_error)
-            for each_vm in vm:
-                ping_thread = threading.Thread(target=thread_func_ping,
-                                               args=(lrunner, rrunner,
-                                                     each_vm.get_address()))
-                ping_thread.start()
-
         except Exception as info:
             raise exceptions.TestFail(info)
+        finally:
+            for probe in probes:
+                probe.stop()
+        for probe in probes:
+            if not probe.check_downtime_tolerable(downtime_tolerable):
+                ret_downtime_tolerable = False
 
-    if obj_migration.RET_MIGRATION:
-        ret_migration = True
-    else:
-        ret_migration = False
+    elif migrate_type.lower() == "concurrent":
+        logging.info("Migrate vms concurrently.")
+        orchestrator = multi_vm_migration.MultiVMMigration(
+            vm, src_uri, dest_uri, options, concurrency=concurrency,
+            stagger=stagger, timeout=migrate_thread_timeout)
+        try:
+            orchestrator.run()
+        finally:
+            if result_dir:
+                orchestrator.save_report(result_dir)
+        failed = orchestrator.get_failed()
+        if failed and not status_error:
+            raise exceptions.TestFail("Migration of %s failed" % failed)
+        return not failed
+
+    return bool(obj_migration.RET_MIGRATION)
 
 
 def run(test, params, env):
@@ -204,6 +208,12 @@ def run(test, params, env):
     migration_type = params.get("virsh_migration_type", "simultaneous")
     migrate_timeout = int(params.get("virsh_migrate_thread_timeout", 900))
     migration_time = int(params.get("virsh_migrate_timeout", 60))
+    downtime_tolerable = float(params.get("downtime_tolerable", 5))
+    probe_interval = float(params.get("downtime_probe_interval", 0.01))
+    concurrency = int(params.get("migrate_concurrency", 0))
+    stagger = float(params.get("migrate_stagger", 0))
+    ret_migration = True
+    flag_migration = True
 
     # Params for NFS and SSH setup
     params["server_ip"] = params.get("migrate_dest_host")
@@ -230,7 +240,7 @@ def run(test, params, env):
                                  public_key="rsa")
 
     # Prepare local session and remote session
-    localrunner = remote.RemoteRunner(host=remote_host, username=host_user,
+    localrunner = remote.RemoteRunner(host=local_host, username=host_user,
                                       password=host_passwd)
     remoterunner = remote.RemoteRunner(host=remote_host, username=host_user,
                                        password=host_passwd)
@@ -284,9 +294,12 @@ def run(test, params, env):
             if vm.is_dead():
                 vm.start()
                 vm.wait_for_login()
-        multi_migration(vms, srcuri, desturi, option, migration_type,
-                        migrate_timeout, jobabort, lrunner=localrunner,
-                        rrunner=remoterunner, status_error=status_error)
+        ret_migration = multi_migration(
+            vms, srcuri, desturi, option, migration_type, migrate_timeout,
+            jobabort, lrunner=localrunner, rrunner=remoterunner,
+            status_error=status_error, downtime_tolerable=downtime_tolerable,
+            probe_interval=probe_interval, concurrency=concurrency,
+            stagger=stagger, result_dir=test.outputdir)
     except Exception as info:
         logging.error("Test failed: %s" % info)
         flag_migration = False
@@ -299,7 +312,7 @@ def run(test, params, env):
     localrunner.session.close()
     remoterunner.session.close()
 
-    if not (ret_migration or flag_migration):
+    if not (ret_migration and flag_migration):
         if not status_error:
             raise exceptions.TestFail("Migration test failed")
     if not ret_jobabort:
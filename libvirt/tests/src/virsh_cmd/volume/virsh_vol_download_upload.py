@@ -1,7 +1,6 @@
 import os
 import logging as log
 import string
-import hashlib
 import locale
 import aexpect
 
@@ -23,6 +22,8 @@ from virttest.utils_test import libvirt as utlv
 
 from virttest import libvirt_version
 
+from provider.virtual_disk import integrity
+
 
 # Using as lower capital is not the best way to do, but this is just a
 # workaround to avoid changing the entire file.
@@ -39,22 +40,7 @@ def digest(path, offset, length):
     :param length: length will read
     :return: md5 result in hex
     """
-    with open(path, 'rb') as read_fd:
-        read_fd.seek(offset)
-        hash_md = hashlib.md5()
-        done = 0
-        while True:
-            want = 1024
-            if length and length - done < want:
-                want = length - done
-            outstr = read_fd.read(want)
-            got = len(outstr)
-            if got == 0:
-                break
-            done += got
-            hash_md.update(outstr)
-
-    return hash_md.hexdigest()
+    return integrity.file_digest(path, offset, length, algorithm='md5')
 
 
 def write_file(path):
@@ -14,6 +14,9 @@ from virttest import data_dir
 from virttest import libvirt_storage
 from virttest.utils_test import libvirt as utlv
 
+from provider.libvirt_bench import bench_utils
+from provider.libvirt_bench import vol_churn
+
 
 q = Queue.Queue()
 
@@ -78,6 +81,38 @@ def check_cmd_output(cmd_result, expect_error, test):
     logging.debug("Cmd output as expected:\n%s" % cmd_output)
 
 
+def run_churn_bench(test, params, pool_name):
+    """
+    Run the volume churn benchmark on a pool and save its report
+
+    :param test: test object
+    :param params: the parameters dict
+    :param pool_name: name of the pool to run on
+    """
+    bench = vol_churn.VolChurnBench(
+        pool_name,
+        vol_count=params.get("vol_bench_count", "1000"),
+        workers=params.get("vol_bench_workers", "8"),
+        step=params.get("vol_bench_step", "100"),
+        capacity=params.get("vol_bench_capacity", "1M"),
+        allocation=params.get("vol_bench_allocation", "1M"),
+        vol_format=params.get("volume_format"),
+        clone="yes" == params.get("vol_bench_clone", "yes"))
+    try:
+        bench.run()
+    finally:
+        bench_utils.save_json(bench.get_report(), test.outputdir,
+                              "vol_churn_%s.json" % pool_name)
+        bench.cleanup()
+    max_growth = params.get("vol_bench_max_refresh_growth")
+    growth = bench.get_refresh_growth()
+    logging.info("Per volume pool-refresh cost grows %s times", growth)
+    if max_growth and growth and growth > float(max_growth):
+        test.fail("Per volume pool-refresh cost grows %.2f times from %d "
+                  "to %d volumes, more than %s" % (
+                      growth, bench.step, bench.vol_count, max_growth))
+
+
 def run(test, params, env):
     """
     Test simultaneous volume operations
@@ -93,6 +128,9 @@ def run(test, params, env):
        vol-wipe
        vol-resize
     4. Check if success or error throw as expected
+
+    With vol_bench = yes, run the volume churn benchmark on the pool
+    instead of steps 2-4.
     """
 
     src_pool_name = params.get("pool_name")
@@ -101,8 +139,6 @@ def run(test, params, env):
     pool_target = os.path.join(data_dir.get_tmp_dir(), pool_target)
     vol_format = params.get("volume_format")
     vol_size = params.get("volume_size", "262144")
-    volume_count = int(params.get("volume_number"))
-    new_capacity = params.get("new_capacity")
     emulated_image = params.get("emulated_image", "emulated-image")
     emulated_image_size = params.get("emulated_image_size")
     status_error = ("yes" == params.get("status_error", "no"))
@@ -125,6 +161,13 @@ def run(test, params, env):
         logging.debug("Current pools:%s",
                       libvirt_storage.StoragePool().list_pools())
 
+        if "yes" == params.get("vol_bench", "no"):
+            run_churn_bench(test, params, src_pool_name)
+            return
+
+        volume_count = int(params.get("volume_number"))
+        new_capacity = params.get("new_capacity")
+
         # Create the src vol
         src_vol_name = params.get("volume_name")
         pv = libvirt_storage.PoolVolume(src_pool_name)
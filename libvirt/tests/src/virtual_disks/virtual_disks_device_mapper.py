@@ -4,13 +4,15 @@ import os
 from avocado.utils import process
 
 from virttest import libvirt_version
-from virttest import virt_vm, utils_misc
+from virttest import virt_vm
 
 from virttest.libvirt_xml import vm_xml, xcepts
 
 from virttest.utils_test import libvirt
 from virttest.utils_libvirt import libvirt_disk
 
+from provider import log_watcher
+
 LOG = logging.getLogger('avocado.' + __name__)
 cleanup_files = []
 
@@ -80,11 +82,11 @@ def check_multiple_file_source_disks(params, log_config_path, test):
     """
     msg1 = params.get('message_1', 'Setting up disks')
     msg2 = params.get('message_2', 'Setup all disks')
-    for message in [msg1, msg2]:
-        result = utils_misc.wait_for(lambda: libvirt.check_logfile(message, log_config_path), timeout=20)
-        if not result:
-            test.fail("Failed to get expected messages: %s from log file: %s."
-                      % (message, log_config_path))
+    found = log_watcher.LogWatcher().wait_for(log_config_path, [msg1, msg2],
+                                              timeout=20)
+    if not found:
+        test.fail("Failed to get expected messages: %s from log file: %s."
+                  % ([msg1, msg2], log_config_path))
 
 
 def run(test, params, env):
@@ -67,9 +67,9 @@ def run(test, params, env):
                                            ip_ver='ipv6')
         ips_v4['outside_ip'] = outside_ip
         network_base.ping_check(params, ips_v4, session,
-                                force_ipv4=True)
+                                force_ipv4=True, vm=vm)
         network_base.ping_check(params, ips_v6, session,
-                                force_ipv4=False)
+                                force_ipv4=False, vm=vm)
     finally:
         [backup_xml.sync() for backup_xml in bkxmls]
         libvirt_network.create_or_del_network(network_attrs, is_del=True)
@@ -14,6 +14,10 @@ from virttest.libvirt_xml import vm_xml
 from virttest.libvirt_xml.devices.disk import Disk
 from virttest.utils_libvirt import libvirt_secret
 
+from provider import virsh_pool
+from provider.backingchain.chain_builder import ChainBuilder
+from provider.backingchain.chain_builder import get_disk_source
+
 LOG = logging.getLogger('avocado.' + __name__)
 
 
@@ -93,6 +97,11 @@ class BlockCommand(object):
         :params extra: extra option to create snap
         :params clean_snap_file: Clean snap file before create snap if True.
         """
+        if (self.params.get("prebuilt_snapshot_chain", "no") == "yes" and
+                option == '--disk-only' and not snap_name and
+                not snap_path and clean_snap_file):
+            if self.prepare_snapshot_chain(start_num, snap_num, extra):
+                return
         # Create backing chain
         for i in range(start_num, snap_num):
             if not snap_path:
@@ -109,15 +118,53 @@ class BlockCommand(object):
             snap_option = "%s %s --diskspec %s,file=%s%s" % \
                           (name, option, self.new_dev, path, extra)
 
-            virsh.snapshot_create_as(self.vm.name, snap_option,
-                                     ignore_status=False,
-                                     debug=True)
+            virsh_pool.run("snapshot_create_as", self.vm.name, snap_option,
+                           ignore_status=False,
+                           debug=True)
             self.snap_path_list.append(path)
             self.snap_name_list.append(name)
 
-            if not utils_misc.wait_for(lambda: os.path.exists(path), 10, first=2):
+            # The file is there once snapshot-create-as returns, so poll
+            # with a short step instead of sleeping first
+            if not utils_misc.wait_for(lambda: os.path.exists(path), 10,
+                                       step=0.1):
                 self.test.error("%s should be in snapshot list" % snap_name)
 
+    def prepare_snapshot_chain(self, start_num=0, snap_num=3, extra=''):
+        """
+        Prepare disk only snapshots from overlays created offline
+
+        Used by prepare_snapshot when prebuilt_snapshot_chain is yes, paths
+        and names are the same as prepare_snapshot uses.
+
+        :params start_num: snap path start index
+        :params snap_num: snapshot number
+        :params extra: extra option to create snap
+        :return: False if the disk source is not a local file or block
+                 device, so the chain has to be created by libvirt
+        """
+        vmxml = vm_xml.VMXML.new_from_dumpxml(self.vm.name)
+        base_image, base_format = get_disk_source(vmxml, self.new_dev)
+        if not base_image:
+            LOG.debug("Can not prebuild snapshot chain on %s", self.new_dev)
+            return False
+        paths = [self.tmp_dir + '%d' % i for i in range(start_num, snap_num)]
+        names = ['snap%d' % i for i in range(start_num, snap_num)]
+        for path in paths:
+            if os.path.exists(path):
+                libvirt.delete_local_disk('file', path)
+        # Record them first, so teardown cleans a partly applied chain
+        self.snap_path_list.extend(paths)
+        self.snap_name_list.extend(names)
+        budget = int(float(utils_misc.normalize_data_size(
+            self.params.get("chain_template_budget", "1G"),
+            order_magnitude="B")))
+        ChainBuilder(budget=budget).create_overlays(base_image, base_format,
+                                                    paths)
+        ChainBuilder.apply_overlays(self.vm.name, self.new_dev, paths, names,
+                                    extra)
+        return True
+
     def convert_expected_chain(self, expected_chain_index):
         """
         Convert expected chain from "4>1>base" to "[/*snap4, /*snap1, /base.image]"
@@ -203,7 +250,8 @@ class BlockCommand(object):
         Clean all new created snap
         """
         for ss in self.snap_name_list:
-            virsh.snapshot_delete(self.vm.name, '%s --metadata' % ss, debug=True)
+            virsh_pool.run("snapshot_delete", self.vm.name,
+                           '%s --metadata' % ss, debug=True)
         for sp in self.snap_path_list:
             process.run('rm -f %s' % sp)
         # clean left first disk snap file that created along with new disk
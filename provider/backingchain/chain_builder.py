@@ -0,0 +1,207 @@
+"""
+Build snapshot chains from overlays created offline
+
+Instead of letting every "snapshot-create-as" create its overlay and then
+waiting for the file, all overlays of a chain are created in one batch by
+"qemu-img create -b" and each layer is applied by a snapshot with
+"--reuse-external". Overlays only depend on their backing file name,
+format and size, so the overlays of a chain shape are kept as templates
+in the avocado-vt data dir and copied on the next use, by any test
+process. Templates are evicted least recently used first when they
+exceed the disk budget, set with "chain_template_budget" in the cfg file.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+from avocado.utils import process
+
+from virttest import data_dir
+
+from provider import virsh_pool
+from provider.backingchain.image_chain import ImageChain
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+# Default max disk usage of the templates in bytes
+DEFAULT_BUDGET = 1024 ** 3
+
+
+def get_disk_source(vmxml, target_dev):
+    """
+    Get the source and format of a local file or block disk
+
+    :param vmxml: VMXML object of the vm
+    :param target_dev: target dev of the disk
+    :return: tuple, (source path, format), (None, None) if the disk source
+             is not a local file or block device
+    """
+    disk = vmxml.get_disk_all().get(target_dev)
+    if disk is None or disk.get('type') not in ['file', 'block']:
+        return None, None
+    source = disk.find('source')
+    driver = disk.find('driver')
+    if source is None:
+        return None, None
+    path = source.get('file') or source.get('dev')
+    disk_format = driver.get('type') if driver is not None else 'raw'
+    return path, disk_format
+
+
+class ChainBuilder(object):
+    """
+    Create overlay files of a chain offline and reuse them as templates
+
+    :param template_dir: dir to keep the templates of chain shapes
+    :param budget: int, max disk usage of the templates in bytes
+    """
+
+    def __init__(self, template_dir=None, budget=DEFAULT_BUDGET):
+        self.template_dir = template_dir or os.path.join(
+            data_dir.get_data_dir(), "backingchain_templates")
+        self.budget = budget
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Hold the template dir lock, shared by all test processes
+        """
+        if not os.path.isdir(self.template_dir):
+            os.makedirs(self.template_dir, exist_ok=True)
+        with open(os.path.join(self.template_dir, ".lock"), 'w') as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def get_shape_key(base_image, base_format, size, paths):
+        """
+        Get the key of a chain shape
+
+        :param base_image: path of the image under the first overlay
+        :param base_format: format of base_image
+        :param size: int, virtual size of base_image in bytes
+        :param paths: list of overlay paths from bottom to top
+        :return: str, hex digest of the shape
+        """
+        key_str = json.dumps([base_image, base_format, size, paths])
+        return hashlib.sha256(key_str.encode()).hexdigest()[:32]
+
+    def _copy_template(self, template, paths):
+        """
+        Copy cached overlays of a template to paths
+
+        :return: True if the template exists and is copied
+        """
+        template_files = [os.path.join(template, str(index))
+                          for index in range(len(paths))]
+        if not all(os.path.exists(tfile) for tfile in template_files):
+            return False
+        for tfile, path in zip(template_files, paths):
+            process.run("cp --sparse=always %s %s" % (tfile, path),
+                        shell=True)
+        LOG.debug("Copied chain overlays from template %s", template)
+        return True
+
+    def _save_template(self, template, paths):
+        """
+        Save overlays at paths as a template
+        """
+        tmp_template = "%s.%d.tmp" % (template, os.getpid())
+        os.makedirs(tmp_template)
+        for index, path in enumerate(paths):
+            shutil.copyfile(path, os.path.join(tmp_template, str(index)))
+        try:
+            os.rename(tmp_template, template)
+        except OSError:
+            # Another process saved the same shape first
+            shutil.rmtree(tmp_template, ignore_errors=True)
+
+    def _usage(self):
+        """
+        Get templates with their disk usage and last use time
+
+        :return: list of (last use time, allocated bytes, template dir)
+        """
+        entries = []
+        for name in os.listdir(self.template_dir):
+            template = os.path.join(self.template_dir, name)
+            if name.endswith(".tmp") or not os.path.isdir(template):
+                continue
+            size = 0
+            for tfile in os.listdir(template):
+                size += os.stat(os.path.join(template, tfile)).st_blocks * 512
+            entries.append((os.path.getmtime(template), size, template))
+        return entries
+
+    def _evict(self, keep):
+        """
+        Remove least recently used templates until within budget
+
+        :param keep: template dir which must not be evicted
+        """
+        entries = sorted(self._usage())
+        total = sum(size for _, size, _ in entries)
+        for _, size, template in entries:
+            if total <= self.budget:
+                break
+            if template == keep:
+                continue
+            LOG.debug("Evict chain template %s", template)
+            shutil.rmtree(template, ignore_errors=True)
+            total -= size
+
+    def create_overlays(self, base_image, base_format, paths):
+        """
+        Create qcow2 overlays, paths[0] on base_image and paths[i] on
+        paths[i - 1]
+
+        :param base_image: path of the image under the first overlay
+        :param base_format: format of base_image
+        :param paths: list of overlay paths from bottom to top
+        """
+        # Give the size, so qemu-img does not open the in use backing file
+        size = ImageChain.from_image(
+            base_image, backing_chain=False).layers[0].get_item('vsize')
+        template = os.path.join(
+            self.template_dir,
+            self.get_shape_key(base_image, base_format, size, paths))
+        # Copy under the lock, so no other process evicts it meanwhile
+        with self._locked():
+            if self._copy_template(template, paths):
+                # Record the use for LRU eviction
+                os.utime(template)
+                return
+        backing, backing_format = base_image, base_format
+        for path in paths:
+            process.run("qemu-img create -f qcow2 -F %s -b %s %s %d"
+                        % (backing_format, backing, path, size), shell=True)
+            backing, backing_format = path, 'qcow2'
+        with self._locked():
+            self._save_template(template, paths)
+            self._evict(template)
+
+    @staticmethod
+    def apply_overlays(vm_name, target_dev, paths, names, extra=''):
+        """
+        Apply created overlays as external disk only snapshots
+
+        :param vm_name: name of the vm
+        :param target_dev: target dev of the disk
+        :param paths: list of overlay paths from bottom to top
+        :param names: list of snapshot names of the overlays
+        :param extra: extra option of snapshot-create-as
+        """
+        for name, path in zip(names, paths):
+            snap_option = ("%s --disk-only --reuse-external --diskspec "
+                           "%s,snapshot=external,file=%s%s"
+                           % (name, target_dev, path, extra))
+            virsh_pool.run("snapshot_create_as", vm_name, snap_option,
+                           ignore_status=False, debug=True)
@@ -1,11 +1,9 @@
 import logging
-import re
 
-from avocado.utils import process
-
-from virttest import libvirt_storage
-from virttest import utils_misc
 from virttest.libvirt_xml import vm_xml
+from provider.backingchain.image_chain import ImageChain
+from provider.backingchain.image_chain import size_to_bytes
+from provider.virtual_disk import integrity
 from provider.virtual_disk.disk_base import DiskBase
 
 LOG = logging.getLogger('avocado.' + __name__)
@@ -68,34 +66,36 @@ class Checkfunction(object):
 
         :param expected_value: image size that setting in cfg file.
         """
-        expected_number = int(re.findall(r'\d+', expected_value)[0])
-        expected_unit = re.findall(r"\D+", expected_value)[0]
-
-        if expected_unit == "kib":
-            expected_value = expected_number * 1024
-        elif expected_unit in ["b", "k", "m", "g"]:
-            expected_value = expected_number * 1024 ** ["b", "k", "m", "g"]. \
-                index(expected_unit)
-        else:
-            self.test.error("Unknown scale value:%s", expected_unit)
-        return int(expected_value)
+        try:
+            return size_to_bytes(expected_value)
+        except ValueError as detail:
+            self.test.error(str(detail))
 
-    def check_image_info(self, image_path, check_item, expected_value):
+    def check_image_info(self, image_path, check_item, expected_value,
+                         chain=None):
         """
         Check value is expected in image info
 
         :param image_path: image path
         :param check_item: The item you want to check.
         :param expected_value: expected item value
-        """
-        image_info = utils_misc.get_image_info(image_path)
-
-        if image_info.get(check_item) is None:
+        :param chain: ImageChain including image_path, e.g. the one returned
+            by check_backingchain or a former check_image_info, to check
+            without running qemu-img again
+        :return: ImageChain the value is read from, to pass to the next
+                 check of the same image
+        """
+        layer = chain.get_layer(image_path) if chain else None
+        if layer is None:
+            chain = ImageChain.from_image(image_path, backing_chain=False)
+            layer = chain.layers[0]
+        actual_value = layer.get_item(check_item)
+
+        if actual_value is None:
             self.test.fail("The {} value:{} you checked is"
                            " not returned in image_info:{}".
-                           format(check_item, expected_value, image_info))
+                           format(check_item, expected_value, layer.info))
         else:
-            actual_value = image_info[check_item]
             # Get actual value
             if check_item == 'vsize':
                 expected_value = self._get_image_size_with_bytes(expected_value)
@@ -103,6 +103,7 @@ class Checkfunction(object):
             if actual_value != expected_value:
                 self.test.fail('The value :{} is not expected value:'
                                '{}'.format(actual_value, expected_value))
+        return chain
 
     def check_bc_base_top(self, command, vmxml, dev, bc_chain):
         """
@@ -156,29 +157,15 @@ class Checkfunction(object):
         Check backing chain info through qemu-img info
 
         :param img_list: expected backingchain list
-        :return: bool, meets expectation or not
-        """
-        # Get actual backingchain list
-        qemu_img_cmd = 'qemu-img info --backing-chain %s' % img_list[0]
-        if libvirt_storage.check_qemu_image_lock_support():
-            qemu_img_cmd += " -U"
-        img_info = process.run(qemu_img_cmd, verbose=True, shell=True).stdout_text
-        # Set check pattern
-        pattern = ''
-        chain_length = len(img_list)
-        for i in range(chain_length):
-            pattern += 'image: ' + img_list[i]
-            if i + 1 < chain_length:
-                pattern += '.*backing file: ' + img_list[i + 1]
-            pattern += '.*'
-        LOG.debug('The pattern to match the current backing chain is:%s'
-                  % pattern)
-        # compare list
-        exist = re.search(pattern, img_info, re.DOTALL)
-        if not exist:
+        :return: ImageChain of img_list[0], meets expectation
+        """
+        chain = ImageChain.from_image(img_list[0])
+        LOG.debug('The current backing chain is: %s', chain.get_filenames())
+        diffs = chain.diff(img_list)
+        if diffs:
             self.test.fail('qemu-img info output of backing chain '
-                           'is not correct: %s' % img_info)
-        return exist
+                           'is not correct:\n%s' % '\n'.join(diffs))
+        return chain
 
     def check_hash_list(self, item_list, hash_list, session=None):
         """
@@ -186,14 +173,17 @@ class Checkfunction(object):
 
         :param item_list: file or dev need to check
         :param hash_list: hash value list
-        :param session: The session object to the host
+        :param session: The session object to the guest, the items are
+                        hashed on the host in parallel if it is None
         """
+        if not session:
+            host_hashes = integrity.hash_files(item_list, algorithm='sha256')
 
         for index, item in enumerate(item_list):
             if session:
                 ret, current_hash = session.cmd_status_output("sha256sum %s" % item)
             else:
-                current_hash = process.run("sha256sum %s" % item).stdout_text.strip().split()[0]
+                current_hash = host_hashes[item]
 
             if current_hash != hash_list[index]:
                 self.test.fail("File:%s hash :%s is different from hash before "
@@ -0,0 +1,173 @@
+"""
+Backing chain model built from qemu-img info json output
+
+One "qemu-img info --backing-chain --output=json" call gives the info of
+every layer, so the chain can be compared with an expected list of
+images and image properties can be checked without running qemu-img
+again per item.
+"""
+
+import json
+import logging
+import os
+import re
+
+from avocado.utils import process
+
+from virttest import libvirt_storage
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+# Items of utils_misc.get_image_info() -> (json key, format specific key)
+INFO_ITEMS = {'format': ('format', None),
+              'vsize': ('virtual-size', None),
+              'dsize': ('actual-size', None),
+              'csize': ('cluster-size', None),
+              'compat': (None, 'compat'),
+              'lcounts': (None, 'lazy-refcounts'),
+              'extended l2': (None, 'extended-l2'),
+              'data file': (None, 'data-file')}
+SIZE_UNITS = ["b", "k", "m", "g"]
+
+
+def size_to_bytes(size):
+    """
+    Convert size like '10g' or '512kib' set in cfg file to bytes
+
+    :param size: str, size with unit b/k/m/g/kib
+    :return: int, size in bytes
+    :raise: ValueError if the unit is unknown
+    """
+    number = int(re.findall(r'\d+', size)[0])
+    unit = re.findall(r"\D+", size)[0]
+    if unit == "kib":
+        return number * 1024
+    if unit in SIZE_UNITS:
+        return number * 1024 ** SIZE_UNITS.index(unit)
+    raise ValueError("Unknown scale value:%s" % unit)
+
+
+def _normalize(path):
+    """
+    Normalize local paths so '/a/b/../c' equals '/a/c', keep others
+    """
+    if path and path.startswith('/'):
+        return os.path.normpath(path)
+    return path
+
+
+class ImageLayer(object):
+    """
+    One image in a backing chain
+
+    :param info: dict, one item of qemu-img info json output
+    """
+
+    def __init__(self, info):
+        self.info = info
+        self.filename = info.get('filename')
+        self.format = info.get('format')
+        self.backing_filename = info.get('backing-filename')
+        self.full_backing_filename = info.get('full-backing-filename',
+                                              self.backing_filename)
+        self.format_specific = info.get('format-specific', {}).get('data', {})
+
+    def get_item(self, item):
+        """
+        Get an image info item by the name used in utils_misc.get_image_info
+
+        :param item: str, like 'vsize', 'csize' or 'extended l2'
+        :return: value of the item, None if it is not in the info
+        """
+        key, specific_key = INFO_ITEMS.get(item, (item, None))
+        if specific_key:
+            value = self.format_specific.get(specific_key)
+        else:
+            value = self.info.get(key)
+        # Text output shows booleans as lower case strings
+        if isinstance(value, bool):
+            value = str(value).lower()
+        return value
+
+    def __repr__(self):
+        return "%s(%s)" % (self.filename, self.format)
+
+
+class ImageChain(object):
+    """
+    Backing chain of an image, the top image is the first layer
+
+    :param layers: list of ImageLayer
+    """
+
+    def __init__(self, layers):
+        self.layers = layers
+
+    @classmethod
+    def from_image(cls, image_path, backing_chain=True):
+        """
+        Get the backing chain of an image by one qemu-img call
+
+        :param image_path: path of the top image
+        :param backing_chain: False to only get the info of the top image,
+                              without opening its backing files
+        :return: ImageChain object
+        """
+        cmd = 'qemu-img info%s --output=json %s' % (
+            ' --backing-chain' if backing_chain else '', image_path)
+        if libvirt_storage.check_qemu_image_lock_support():
+            cmd += " -U"
+        output = process.run(cmd, verbose=True, shell=True).stdout_text
+        info = json.loads(output)
+        # Without a backing file, some qemu-img versions give a dict
+        if isinstance(info, dict):
+            info = [info]
+        return cls([ImageLayer(layer) for layer in info])
+
+    def get_filenames(self):
+        """
+        :return: list of image file names from top to base
+        """
+        return [layer.filename for layer in self.layers]
+
+    def get_layer(self, image_path):
+        """
+        Get the layer of an image in the chain
+
+        :param image_path: path of the image
+        :return: ImageLayer, None if the image is not in the chain
+        """
+        for layer in self.layers:
+            if _normalize(layer.filename) == _normalize(image_path):
+                return layer
+        return None
+
+    def diff(self, expected_chain):
+        """
+        Compare the chain with the expected images from top to base
+
+        Layers under the last expected image are not compared, so the
+        expected chain may leave out the base images.
+
+        :param expected_chain: list of image paths, like the result of
+                               BlockCommand.convert_expected_chain
+        :return: list of str, one message per layer which differs
+        """
+        diffs = []
+        for index, expected in enumerate(expected_chain):
+            if index >= len(self.layers):
+                diffs.append("layer %d: expect %s, but the chain ends at %s"
+                             % (index, expected, self.layers[-1].filename))
+                continue
+            layer = self.layers[index]
+            if _normalize(layer.filename) != _normalize(expected):
+                diffs.append("layer %d: expect %s, but got %s"
+                             % (index, expected, layer.filename))
+            if index + 1 < len(expected_chain):
+                backing = expected_chain[index + 1]
+                if (_normalize(layer.full_backing_filename) !=
+                        _normalize(backing)):
+                    diffs.append("layer %d: expect backing file %s of %s, "
+                                 "but got %s" % (index, backing, expected,
+                                                 layer.full_backing_filename))
+        return diffs
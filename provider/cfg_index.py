@@ -0,0 +1,515 @@
+"""
+Precompiled index of the variants of cfg trees
+
+Expanding the cfg files with the cartesian parser takes long, and it is
+done again before every listing or run. This module expands every cfg
+file once and saves its variants (name, shortname, flattened params and
+the source file) to a sqlite index. A file is parsed again only when its
+mtime and sha256 changed, and variants are selected with only/no
+filters on the index without parsing anything:
+
+    python -m provider.cfg_index build libvirt/tests/cfg v2v/tests/cfg
+    python -m provider.cfg_index list --only 'virsh.dumpxml' --no 'domuuid'
+    python -m provider.cfg_index show \
+        'virsh.dumpxml.normal_test.non_acl.vm_shutoff.with_default.domname'
+
+Every cfg file is expanded alone, wrapped in 'variants subtest:' the same
+way avocado-vt writes subtests.cfg, so the params are the ones the file
+defines, without the ones of base.cfg and the guest os cfgs.
+
+Filters on names the file does not define, like 'only x86_64' or
+'no s390-virtio', would drop variants only because the variants of the
+base, guest os and machine cfgs are missing. They are not applied, but
+recorded in the cfg_index_unresolved param of the variants they cover,
+and applied by 'list --context' to the names the real job would add:
+
+    python -m provider.cfg_index list --only 'virsh.dumpxml' \
+        --context x86_64 --context q35 --context Linux
+
+'verify' compares the count of the variants of files selected from the
+index with a real parse of them where the context names are defined and
+the filters are applied:
+
+    python -m provider.cfg_index verify --context x86_64 --context q35 \
+        --only 'virsh.dumpxml' --no 'domuuid' \
+        libvirt/tests/cfg/virsh_cmd/domain/virsh_dumpxml.cfg
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+INDEX_FILE = '.cfg_index.sqlite'
+# Bumped when the tables change, an older index is built again
+SCHEMA_VERSION = 3
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, mtime REAL, sha256 TEXT);
+CREATE TABLE IF NOT EXISTS variants (
+    id INTEGER PRIMARY KEY, path TEXT, name TEXT, shortname TEXT,
+    params TEXT, unresolved TEXT);
+CREATE INDEX IF NOT EXISTS variants_path ON variants (path);
+CREATE INDEX IF NOT EXISTS variants_name ON variants (name);
+"""
+# Param recording the filters not applied, separated by UNRESOLVED_SEP
+UNRESOLVED_KEY = 'cfg_index_unresolved'
+UNRESOLVED_SEP = '|'
+
+FILTER_LINE = re.compile(r'^(\s*)(only|no)\s+([^=:#]+?)\s*(#.*)?$')
+VARIANT_LINE = re.compile(r'^\s*-\s*@?([^\s:@]+)\s*:')
+COND_LINE = re.compile(r'^(\s*)(!?\w[\w.,\s-]*?)\s*:\s*$')
+COND_SEP = ':'
+NAMED_VARIANT = re.compile(r'^\(\w+=(.*)\)$')
+
+
+def _get_filter_names(text):
+    """
+    Get the variant names a filter refers to
+
+    :return: set of names, None if the filter uses a (key=value) match
+    """
+    if '(' in text:
+        return None
+    return set(name for name in re.split(r'[,\s.]+', text) if name)
+
+
+def _get_cfg_text(path):
+    """
+    Wrap a cfg file like avocado-vt writes subtests.cfg, with the filters
+    on names not defined in the file turned into UNRESOLVED_KEY params
+
+    Conditional blocks on names not defined in the file never apply, the
+    filters in them are recorded after the block with their conditions.
+
+    :param path: str, path of the cfg file
+    :return: str, the text to parse
+    """
+    with open(path) as fd:
+        lines = fd.read().splitlines()
+    defined = set()
+    for line in lines:
+        mobj = VARIANT_LINE.match(line)
+        if mobj:
+            defined.update(mobj.group(1).split('.'))
+    text = ["variants subtest:"]
+    # (indent, condition) of the conditional blocks which never apply
+    conditions = []
+    pending = []
+    for line in lines:
+        stripped = line.strip()
+        if stripped and not stripped.startswith('#'):
+            indent = len(line) - len(line.lstrip())
+            while conditions and conditions[-1][0] >= indent:
+                outer_indent = conditions.pop()[0]
+                if not conditions:
+                    text.extend("    %s%s" % (' ' * outer_indent, item)
+                                for item in pending)
+                    pending = []
+        mobj = FILTER_LINE.match(line)
+        if mobj:
+            names = _get_filter_names(mobj.group(3))
+            item = "%s += %s%s%s %s" % (
+                UNRESOLVED_KEY, UNRESOLVED_SEP,
+                ''.join("%s%s " % (condition, COND_SEP)
+                        for _, condition in conditions),
+                mobj.group(2), mobj.group(3))
+            if conditions:
+                if names is not None:
+                    pending.append(item)
+            elif names is not None and not names <= defined:
+                line = mobj.group(1) + item
+        mobj = COND_LINE.match(line)
+        if mobj and not stripped.startswith('variants'):
+            names = _get_filter_names(mobj.group(2).replace('!', ''))
+            if conditions or (names is not None and not names <= defined):
+                conditions.append((len(mobj.group(1)), mobj.group(2)))
+        text.append("    " + line)
+    if conditions:
+        text.extend("    %s%s" % (' ' * conditions[0][0], item)
+                    for item in pending)
+    return "\n".join(text)
+
+
+def expand_cfg_file(path):
+    """
+    Expand the variants of one cfg file with the cartesian parser
+
+    :param path: str, path of the cfg file
+    :return: generator of the variant dicts
+    """
+    from virttest import cartesian_config
+
+    parser = cartesian_config.Parser()
+    parser.parse_string(_get_cfg_text(path))
+    return parser.get_dicts()
+
+
+def get_unresolved(params):
+    """
+    Get the filters of a variant which were not applied
+
+    :param params: dict, params of the variant
+    :return: list of (conditions, type, filter text), conditions is the
+             list of the conditional blocks the filter is in, like
+             ['q35', '!s390-virtio'], type is 'only' or 'no'
+    """
+    unresolved = []
+    for item in params.get(UNRESOLVED_KEY, '').split(UNRESOLVED_SEP):
+        if item.strip():
+            parts = [part.strip() for part in item.split(COND_SEP)]
+            filter_type, text = parts[-1].split(None, 1)
+            unresolved.append((parts[:-1], filter_type, text))
+    return unresolved
+
+
+def _match_condition(name, condition):
+    if condition.startswith('!'):
+        return not match_filter(name, parse_filter(condition[1:]))
+    return match_filter(name, parse_filter(condition))
+
+
+def match_context(name, unresolved, context):
+    """
+    Check whether a variant passes its unresolved filters in a context
+
+    :param name: str, dotted variant name
+    :param unresolved: list returned by get_unresolved()
+    :param context: list of names the base cfgs add, outermost last,
+                    like ['x86_64', 'q35']
+    :return: True if the variant is kept
+    """
+    full_name = '.'.join(list(reversed(context)) + [name])
+    for conditions, filter_type, text in unresolved:
+        if not all(_match_condition(full_name, condition)
+                   for condition in conditions):
+            continue
+        matched = match_filter(full_name, parse_filter(text))
+        if matched != (filter_type == 'only'):
+            return False
+    return True
+
+
+def verify_file(path, context, only=None, no=None):
+    """
+    Compare the variants of a cfg file selected like CfgIndex.select()
+    does with a real parse of the file where the context names are defined
+    and the filters are applied
+
+    :param path: str, path of the cfg file
+    :param context: list of names, see match_context()
+    :param only: list of filters, see CfgIndex.select()
+    :param no: list of filters, see CfgIndex.select()
+    :return: tuple of (indexed count, parsed count)
+    """
+    from virttest import cartesian_config
+
+    only = only or []
+    no = no or []
+    parsed_only = [parse_filter(text) for text in only]
+    parsed_no = [parse_filter(text) for text in no]
+    indexed = 0
+    for params in expand_cfg_file(path):
+        name = params['name']
+        if (match_context(name, get_unresolved(params), context) and
+                all(match_filter(name, parsed) for parsed in parsed_only) and
+                not any(match_filter(name, parsed) for parsed in parsed_no)):
+            indexed += 1
+    with open(path) as fd:
+        lines = fd.read().splitlines()
+    text = ["variants subtest:"] + ["    " + line for line in lines]
+    for name in context:
+        text.extend(["variants:", "    - %s:" % name])
+    text.extend("only %s" % text_filter for text_filter in only)
+    text.extend("no %s" % text_filter for text_filter in no)
+    parser = cartesian_config.Parser()
+    parser.parse_string("\n".join(text))
+    return indexed, sum(1 for _ in parser.get_dicts())
+
+
+def find_cfg_files(cfg_dirs):
+    """
+    Find the cfg files in cfg dirs
+
+    :param cfg_dirs: list of directories
+    :return: list of absolute file paths
+    """
+    paths = []
+    for cfg_dir in cfg_dirs:
+        for root, _, files in os.walk(cfg_dir):
+            paths.extend(os.path.abspath(os.path.join(root, name))
+                         for name in files if name.endswith('.cfg'))
+    return sorted(paths)
+
+
+def _get_sha256(path):
+    with open(path, 'rb') as fd:
+        return hashlib.sha256(fd.read()).hexdigest()
+
+
+def parse_filter(text):
+    """
+    Parse an only/no filter of the cartesian config syntax
+
+    Words split by ',' or spaces are alternatives, '.' means immediately
+    followed by and '..' means followed by somewhere later.
+
+    :param text: str, like 'virsh.dumpxml..vm_id, virsh.domname'
+    :return: list of alternatives, each a tuple of the blocks of names
+             and the blocks as strings for a quick substring check
+    """
+    words = []
+    for word in re.split(r'[,\s]+', text.strip()):
+        if word:
+            blocks = word.split('..')
+            words.append(([block.split('.') for block in blocks], blocks))
+    return words
+
+
+def _match_word(components, blocks):
+    position = 0
+    for block in blocks:
+        size = len(block)
+        for index in range(position, len(components) - size + 1):
+            if components[index:index + size] == block:
+                position = index + size
+                break
+        else:
+            return False
+    return True
+
+
+def normalize_name(name):
+    """
+    Turn the named variants of a variant name into plain names
+
+    :param name: str, like '(subtest=virsh).(subtest=dumpxml).normal_test'
+    :return: str, like 'virsh.dumpxml.normal_test'
+    """
+    if '(' not in name:
+        return name
+    return '.'.join(NAMED_VARIANT.sub(r'\1', component)
+                    for component in name.split('.'))
+
+
+def match_filter(name, parsed_filter):
+    """
+    Check whether a variant name matches a parsed filter
+
+    Named variants like (subtest=virsh) match the filter virsh, the same
+    as in the cartesian parser.
+
+    :param name: str, dotted variant name
+    :param parsed_filter: returned by parse_filter()
+    :return: True if any alternative matches
+    """
+    name = normalize_name(name)
+    components = None
+    for blocks, needles in parsed_filter:
+        # Most names do not even contain the text of the blocks
+        if not all(needle in name for needle in needles):
+            continue
+        if components is None:
+            components = name.split('.')
+        if _match_word(components, blocks):
+            return True
+    return False
+
+
+class CfgIndex(object):
+    """
+    Sqlite index of the variants of cfg files
+
+    :param index_file: str, path of the sqlite file
+    :param expand_func: function(path) returning the variant dicts of a
+                        cfg file
+    """
+
+    def __init__(self, index_file, expand_func=expand_cfg_file):
+        self.index_file = index_file
+        self.expand_func = expand_func
+        self.conn = sqlite3.connect(index_file)
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.conn.executescript("DROP TABLE IF EXISTS files; "
+                                    "DROP TABLE IF EXISTS variants;")
+            self.conn.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def get_stale_files(self, paths):
+        """
+        Get the files whose content is not the indexed one
+
+        :param paths: list of cfg file paths
+        :return: tuple of (stale paths, indexed paths not in paths)
+        """
+        indexed = dict((path, (mtime, sha256)) for path, mtime, sha256 in
+                       self.conn.execute("SELECT * FROM files"))
+        stale = []
+        for path in paths:
+            mtime = os.path.getmtime(path)
+            if path not in indexed:
+                stale.append(path)
+            elif indexed[path][0] != mtime:
+                # Touched but maybe not changed, compare the content
+                if indexed[path][1] != _get_sha256(path):
+                    stale.append(path)
+                else:
+                    self.conn.execute("UPDATE files SET mtime = ? WHERE "
+                                      "path = ?", (mtime, path))
+        removed = sorted(set(indexed) - set(paths))
+        return stale, removed
+
+    def update(self, cfg_dirs):
+        """
+        Parse the new and changed cfg files of cfg dirs into the index
+
+        :param cfg_dirs: list of directories
+        :return: tuple of (number of parsed files, number of variants)
+        """
+        paths = find_cfg_files(cfg_dirs)
+        cfg_dirs = [os.path.abspath(cfg_dir) for cfg_dir in cfg_dirs]
+        stale, removed = self.get_stale_files(paths)
+        # Only drop the files of the dirs being updated
+        removed = [path for path in removed if any(
+            path.startswith(cfg_dir + os.sep) for cfg_dir in cfg_dirs)]
+        count = 0
+        with self.conn:
+            for path in removed + stale:
+                self.conn.execute("DELETE FROM variants WHERE path = ?",
+                                  (path,))
+                self.conn.execute("DELETE FROM files WHERE path = ?",
+                                  (path,))
+            for path in stale:
+                sha256 = _get_sha256(path)
+                mtime = os.path.getmtime(path)
+                try:
+                    rows = [(path, normalize_name(params['name']),
+                             params.get('shortname'),
+                             json.dumps(dict(params), sort_keys=True),
+                             json.dumps(get_unresolved(params)))
+                            for params in self.expand_func(path)]
+                except Exception as detail:
+                    LOG.warning("Failed to parse %s: %s", path, detail)
+                    continue
+                self.conn.executemany(
+                    "INSERT INTO variants (path, name, shortname, params, "
+                    "unresolved) VALUES (?, ?, ?, ?, ?)", rows)
+                self.conn.execute("INSERT INTO files VALUES (?, ?, ?)",
+                                  (path, mtime, sha256))
+                count += len(rows)
+        LOG.info("Parsed %d of %d cfg files into %d variants", len(stale),
+                 len(paths), count)
+        return len(stale), count
+
+    def select(self, only=None, no=None, context=None):
+        """
+        Select variant names with only/no filters
+
+        :param only: list of filters, a variant has to match all of them
+        :param no: list of filters, a variant must not match any of them
+        :param context: list of names the base cfgs add, see
+                        match_context(), None to keep the variants whatever
+                        their unresolved filters are
+        :return: list of variant names
+        """
+        only = [parse_filter(text) for text in only or []]
+        no = [parse_filter(text) for text in no or []]
+        names = []
+        for name, unresolved in self.conn.execute(
+                "SELECT name, unresolved FROM variants ORDER BY id"):
+            if (context is not None and unresolved != '[]' and
+                    not match_context(name, json.loads(unresolved),
+                                      context)):
+                continue
+            if (all(match_filter(name, parsed) for parsed in only) and
+                    not any(match_filter(name, parsed) for parsed in no)):
+                names.append(name)
+        return names
+
+    def get_variant(self, name):
+        """
+        Get the flattened params and the source file of a variant
+
+        :param name: str, the full variant name, named variants like
+                     (subtest=virsh) may be given as plain names
+        :return: tuple of (params dict, source file), (None, None) if the
+                 variant is not indexed
+        """
+        row = self.conn.execute("SELECT params, path FROM variants WHERE "
+                                "name = ?",
+                                (normalize_name(name),)).fetchone()
+        if row is None:
+            return None, None
+        return json.loads(row[0]), row[1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build and query the variant index of cfg trees")
+    parser.add_argument('--index', default=INDEX_FILE,
+                        help="path of the index file, default: %(default)s")
+    subparsers = parser.add_subparsers(dest='command')
+    build = subparsers.add_parser('build', help="parse changed cfg files")
+    build.add_argument('cfg_dirs', nargs='+')
+    listing = subparsers.add_parser('list', help="list variant names")
+    listing.add_argument('--only', action='append', default=[])
+    listing.add_argument('--no', action='append', default=[])
+    listing.add_argument('--context', action='append', default=None,
+                         help="name added by the base cfgs, like x86_64")
+    show = subparsers.add_parser('show', help="show params of a variant")
+    show.add_argument('name')
+    verify = subparsers.add_parser(
+        'verify', help="compare variant counts with a real parse")
+    verify.add_argument('--context', action='append', default=[],
+                        help="name added by the base cfgs, like x86_64")
+    verify.add_argument('--only', action='append', default=[])
+    verify.add_argument('--no', action='append', default=[])
+    verify.add_argument('cfg_files', nargs='+')
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.error("a command is required")
+    if args.command == 'verify':
+        failed = 0
+        for path in args.cfg_files:
+            indexed, parsed = verify_file(path, args.context, args.only,
+                                          args.no)
+            status = "ok" if indexed == parsed else "MISMATCH"
+            print("%s: %d indexed, %d parsed, %s" % (
+                path, indexed, parsed, status))
+            failed += indexed != parsed
+        return 1 if failed else 0
+
+    index = CfgIndex(args.index)
+    try:
+        if args.command == 'build':
+            logging.basicConfig(level=logging.INFO)
+            index.update(args.cfg_dirs)
+        elif args.command == 'list':
+            for name in index.select(args.only, args.no, args.context):
+                print(name)
+        else:
+            params, path = index.get_variant(args.name)
+            if params is None:
+                print("Variant %s is not indexed" % args.name,
+                      file=sys.stderr)
+                return 1
+            print("# %s" % path)
+            for key, value in sorted(params.items()):
+                print("%s = %s" % (key, value))
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,292 @@
+"""
+Event driven reading and incremental pattern matching of consoles
+
+One ConsoleEngine waits on the sockets and fds of many consoles with a
+selector, so reading blocks until data arrives instead of spinning on
+non-blocking reads, and one thread can watch all guest consoles of a
+test. Regular files (and pipes without a writer) are always readable,
+they are read every FILE_POLL_INTERVAL seconds instead.
+
+IncrementalMatcher only searches the newly read data plus a bounded
+look-behind window, so matching costs the same however long the console
+output grows.
+
+A console registered to the engine implements:
+
+    get_read_obj(): socket or fd to wait on, None if not connected yet
+    read_chunk(): bytes or str read without blocking, None if nothing
+                  is available, empty if the peer is gone
+"""
+
+import codecs
+import logging
+import re
+import selectors
+import threading
+import time
+import weakref
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+READ_SIZE = 65536
+# Chars before new data searched again, should cover the longest match
+SEARCH_LOOKBEHIND = 4096
+FILE_POLL_INTERVAL = 0.1
+
+
+def match_patterns(text, patterns):
+    """
+    Get the index of the first pattern found in text
+
+    :param text: str, text to search
+    :param patterns: list of regular expressions
+    :return: int, index of the pattern, None if none matches
+    """
+    for index, pattern in enumerate(patterns):
+        if re.search(pattern, text):
+            return index
+    return None
+
+
+class IncrementalMatcher(object):
+    """
+    Match patterns against console output as it is read
+
+    :param patterns: list of regular expressions
+    :param filter_func: function applied to the searched text, like
+                        aexpect.get_last_line
+    :param match_func: function(text, patterns) returning the index of
+                       the matched pattern or None
+    :param lookbehind: int, chars before new data to search again
+    """
+
+    def __init__(self, patterns, filter_func=None, match_func=None,
+                 lookbehind=SEARCH_LOOKBEHIND):
+        self.patterns = patterns
+        self.filter_func = filter_func or (lambda text: text)
+        self.match_func = match_func or match_patterns
+        self.lookbehind = lookbehind
+        self.match = None
+        self._chunks = []
+        self._tail = ""
+
+    def feed(self, data):
+        """
+        Search patterns in the data read and the look-behind window
+
+        :param data: str, new console output
+        :return: index of the matched pattern, None if none matches
+        """
+        if not data or self.match is not None:
+            return self.match
+        self._chunks.append(data)
+        window = self._tail + data
+        self.match = self.match_func(self.filter_func(window), self.patterns)
+        self._tail = window[-self.lookbehind:]
+        return self.match
+
+    @property
+    def output(self):
+        """
+        All output fed so far
+        """
+        return "".join(self._chunks)
+
+
+class ConsoleEngine(object):
+    """
+    Wait for and read the output of many consoles in one thread
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.RLock()
+        # console ref -> read object registered in the selector
+        self._registered = {}
+        # consoles read every FILE_POLL_INTERVAL
+        self._polled = set()
+        # consoles not connected yet
+        self._waiting = set()
+        # console ref -> output read but not taken yet
+        self._pending = {}
+        self._decoders = {}
+
+    def register(self, console):
+        """
+        Start watching a console
+
+        :param console: object implementing get_read_obj and read_chunk
+        """
+        ref = weakref.ref(console)
+        with self._lock:
+            self._pending[ref] = []
+            self._decoders[ref] = codecs.getincrementaldecoder('utf-8')(
+                errors='ignore')
+            self._waiting.add(ref)
+            self._register_waiting()
+
+    def unregister(self, console):
+        """
+        Stop watching a console, called before closing its socket or fd
+
+        :param console: a registered console
+        """
+        self._forget(weakref.ref(console))
+
+    def _forget(self, ref):
+        with self._lock:
+            read_obj = self._registered.pop(ref, None)
+            if read_obj is not None:
+                try:
+                    self._selector.unregister(read_obj)
+                except (KeyError, ValueError, OSError):
+                    pass
+            self._polled.discard(ref)
+            self._waiting.discard(ref)
+            self._pending.pop(ref, None)
+            self._decoders.pop(ref, None)
+
+    def _register_waiting(self):
+        """
+        Add the consoles connected since last time to the selector
+        """
+        for ref in list(self._waiting):
+            console = ref()
+            if console is None:
+                self._forget(ref)
+                continue
+            read_obj = console.get_read_obj()
+            if read_obj is None:
+                continue
+            self._waiting.discard(ref)
+            try:
+                self._selector.register(read_obj, selectors.EVENT_READ, ref)
+                self._registered[ref] = read_obj
+            except (PermissionError, ValueError):
+                # Regular files can not be waited on
+                self._polled.add(ref)
+
+    def _fill(self, ref):
+        """
+        Read all available output of a console into its pending buffer
+
+        :return: False if the console reached end of file
+        """
+        console = ref()
+        if console is None:
+            self._forget(ref)
+            return True
+        while True:
+            chunk = console.read_chunk()
+            if chunk is None:
+                return True
+            if not chunk:
+                return False
+            if isinstance(chunk, bytes):
+                chunk = self._decoders[ref].decode(chunk)
+            self._pending[ref].append(chunk)
+
+    def poll(self, timeout=None):
+        """
+        Wait up to timeout for output of any console and read it
+
+        The lock is not held while waiting, so other threads can register,
+        unregister and take output meanwhile.
+
+        :param timeout: float, seconds to wait, None to wait forever
+        """
+        with self._lock:
+            self._register_waiting()
+            if self._polled or self._waiting:
+                timeout = (FILE_POLL_INTERVAL if timeout is None else
+                           min(timeout, FILE_POLL_INTERVAL))
+            selecting = bool(self._registered)
+        if selecting:
+            events = self._selector.select(timeout)
+        else:
+            time.sleep(timeout if timeout is not None
+                       else FILE_POLL_INTERVAL)
+            events = []
+        with self._lock:
+            for key, _ in events:
+                if key.data not in self._pending:
+                    # Unregistered while waiting
+                    continue
+                if not self._fill(key.data) and key.data in self._registered:
+                    # Peer is gone, e.g. a fifo without writer, keep it
+                    # from waking up the selector
+                    self._selector.unregister(self._registered.pop(key.data))
+                    self._polled.add(key.data)
+            for ref in list(self._polled):
+                self._fill(ref)
+
+    def take(self, console):
+        """
+        Take the output read of a console
+
+        :param console: a registered console
+        :return: str, output read since last take
+        """
+        ref = weakref.ref(console)
+        with self._lock:
+            chunks = self._pending.get(ref)
+            if not chunks:
+                return ""
+            self._pending[ref] = []
+        return "".join(chunks)
+
+    def read(self, console, timeout=0):
+        """
+        Wait up to timeout for output of a console
+
+        Output of other consoles read meanwhile is kept for them.
+
+        :param console: a registered console
+        :param timeout: float, seconds to wait
+        :return: str, output read, empty if timeout
+        """
+        end_time = time.time() + timeout
+        while True:
+            data = self.take(console)
+            if data:
+                return data
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                return ""
+            self.poll(remaining)
+
+    def expect(self, matchers, timeout=60):
+        """
+        Wait until every console matches its patterns
+
+        :param matchers: dict, console -> IncrementalMatcher
+        :param timeout: float, seconds to wait
+        :return: list of consoles not matched before timeout
+        """
+        end_time = time.time() + timeout
+        while True:
+            for console, matcher in matchers.items():
+                matcher.feed(self.take(console))
+            waiting = [console for console, matcher in matchers.items()
+                       if matcher.match is None]
+            remaining = end_time - time.time()
+            if not waiting or remaining <= 0:
+                return waiting
+            self.poll(remaining)
+
+
+_ENGINE = None
+_ENGINE_LOCK = threading.Lock()
+
+
+def get_engine():
+    """
+    Get the engine shared by all consoles of the process
+
+    :return: ConsoleEngine
+    """
+    global _ENGINE
+    with _ENGINE_LOCK:
+        if _ENGINE is None:
+            _ENGINE = ConsoleEngine()
+        return _ENGINE
@@ -0,0 +1,225 @@
+"""
+Domain state table kept up to date by 'virsh event --loop --all'
+
+Checking a state with virsh.domstate forks a virsh process each time and
+polling loops add their sleep interval to every wait. This module keeps
+one 'virsh event' subscription per connection uri, updates an in-memory
+state table from its lifecycle events and wakes up waiters as soon as an
+event arrives, e.g.:
+
+    domain_events.await_state(vm.name, 'running', timeout=60)
+    domain_events.await_state(vm.name, ['shut off', 'crashed'])
+
+If the subscription can not be used, waiting falls back to polling
+virsh.domstate, so results are the same as with the polling loops.
+"""
+
+import atexit
+import logging
+import re
+import threading
+import time
+
+import aexpect
+
+from virttest import utils_misc
+from virttest import virsh
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+LIFECYCLE_EVENT = re.compile(r"event 'lifecycle' for domain '?([^':]+)'?: "
+                             r"(\w+)")
+# Lifecycle event -> state shown by virsh domstate
+EVENT_STATES = {'Started': 'running',
+                'Resumed': 'running',
+                'Suspended': 'paused',
+                'Stopped': 'shut off',
+                'Shutdown': 'in shutdown',
+                'PMSuspended': 'pmsuspended',
+                'Crashed': 'crashed'}
+
+
+class DomainStateWatcher(object):
+    """
+    States of all domains of a connection, updated by lifecycle events
+
+    :param uri: connection uri, None for the default one
+    """
+
+    def __init__(self, uri=None):
+        self.uri = uri
+        self.states = {}
+        self.event_count = 0
+        self._cond = threading.Condition()
+        self._tail = None
+        # Domains changed by events while loading the states
+        self._changed = set()
+
+    def _on_line(self, line):
+        """
+        Update the state table from one line of 'virsh event' output
+        """
+        match = LIFECYCLE_EVENT.search(line)
+        if not match:
+            return
+        name, event = match.groups()
+        with self._cond:
+            self.event_count += 1
+            self._changed.add(name)
+            if event == 'Undefined':
+                self.states.pop(name, None)
+            elif event in EVENT_STATES:
+                self.states[name] = EVENT_STATES[event]
+            elif event == 'Defined':
+                self.states.setdefault(name, 'shut off')
+            self._cond.notify_all()
+
+    def _load_states(self):
+        """
+        Load the states of all domains with one 'virsh list --all'
+        """
+        with self._cond:
+            self._changed = set()
+        result = virsh.dom_list("--all", uri=self.uri, ignore_status=True)
+        states = {}
+        for line in result.stdout_text.splitlines()[2:]:
+            items = line.split(None, 2)
+            if len(items) == 3:
+                states[items[1]] = items[2].strip()
+        with self._cond:
+            # Events which arrived while listing may be newer than the list
+            for name in self._changed:
+                if name in self.states:
+                    states[name] = self.states[name]
+                else:
+                    states.pop(name, None)
+            self.states = states
+            self._cond.notify_all()
+
+    def start(self):
+        """
+        Start the event subscription and load the current states
+        """
+        cmd = virsh.VIRSH_EXEC
+        if self.uri:
+            cmd += " -c '%s'" % self.uri
+        cmd += " event --loop --all"
+        self._tail = aexpect.Tail(cmd, auto_close=True,
+                                  output_func=self._on_line)
+        self._load_states()
+        LOG.debug("Watching domain events of %s, states: %s",
+                  self.uri or 'default uri', self.states)
+
+    def is_alive(self):
+        """
+        Check whether the event subscription is running
+        """
+        return self._tail is not None and self._tail.is_alive()
+
+    def get_state(self, name):
+        """
+        Get the state of a domain from the table
+
+        :param name: str, domain name
+        :return: str, like 'running', None if the domain is unknown
+        """
+        with self._cond:
+            return self.states.get(name)
+
+    def await_state(self, name, states, timeout=60):
+        """
+        Wait until a domain is in one of states
+
+        :param name: str, domain name
+        :param states: str or list of str, like 'running' or
+                       ['running', 'in shutdown']
+        :param timeout: float, seconds to wait
+        :return: True if the domain is in one of states before timeout
+        """
+        if isinstance(states, str):
+            states = [states]
+        end_time = time.time() + timeout
+        with self._cond:
+            while self.states.get(name) not in states:
+                remaining = end_time - time.time()
+                if remaining <= 0 or not self.is_alive():
+                    return False
+                self._cond.wait(min(remaining, 1))
+        return True
+
+    def stop(self):
+        """
+        Stop the event subscription
+        """
+        if self._tail is not None:
+            self._tail.close()
+            self._tail = None
+
+
+_WATCHERS = {}
+_LOCK = threading.Lock()
+
+
+def get_watcher(uri=None):
+    """
+    Get the shared watcher of a connection, start it if needed
+
+    :param uri: connection uri, None for the default one
+    :return: DomainStateWatcher, None if it can not be started
+    """
+    with _LOCK:
+        watcher = _WATCHERS.get(uri)
+        if watcher is not None and watcher.is_alive():
+            return watcher
+        watcher = DomainStateWatcher(uri)
+        try:
+            watcher.start()
+        except Exception as detail:
+            LOG.debug("Failed to watch domain events of %s: %s", uri, detail)
+            watcher.stop()
+            return None
+        _WATCHERS[uri] = watcher
+        return watcher
+
+
+def await_state(name, states, timeout=60, uri=None, step=0.5):
+    """
+    Wait until a domain is in one of states
+
+    :param name: str, domain name
+    :param states: str or list of str, state(s) shown by virsh domstate
+    :param timeout: float, seconds to wait
+    :param uri: connection uri, None for the default one
+    :param step: float, polling interval if events can not be used
+    :return: True if the domain is in one of states before timeout
+    """
+    if isinstance(states, str):
+        states = [states]
+    start_time = time.time()
+    watcher = get_watcher(uri)
+    if watcher is not None:
+        if watcher.await_state(name, states, timeout):
+            return True
+        if watcher.is_alive():
+            return False
+    remaining = max(timeout - (time.time() - start_time), 0)
+
+    def _in_states():
+        result = virsh.domstate(name, uri=uri, ignore_status=True)
+        return result.stdout_text.strip() in states
+    return bool(utils_misc.wait_for(_in_states, remaining or step,
+                                    step=step))
+
+
+def stop_all():
+    """
+    Stop all event subscriptions
+    """
+    with _LOCK:
+        watchers = list(_WATCHERS.values())
+        _WATCHERS.clear()
+    for watcher in watchers:
+        watcher.stop()
+
+
+atexit.register(stop_all)
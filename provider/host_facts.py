@@ -0,0 +1,188 @@
+"""
+Host facts cached across test processes
+
+The libvirt version and capabilities of the host do not change during a
+job, but every test process queried them again by running virsh. The
+facts are saved to a json file in the avocado-vt data dir shared by all
+test processes, keyed on a host fingerprint made of the boot id, the
+package database and the daemon and qemu binaries, so they are queried
+again automatically after a reboot, a package update, a daemon switch or
+a qemu.conf change. Only static facts are cached, values changing at run
+time like free hugepages must still be queried. The osinfo database is
+cached by v2v_osinfo.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import re
+
+from virttest import data_dir
+from virttest import virsh
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+BOOT_ID_FILE = '/proc/sys/kernel/random/boot_id'
+# The first existing one is used, its mtime changes with any package
+PACKAGE_DBS = ['/usr/lib/sysimage/rpm/rpmdb.sqlite',
+               '/var/lib/rpm/rpmdb.sqlite',
+               '/var/lib/rpm/Packages',
+               '/var/lib/dpkg/status']
+BINARIES = ['/usr/sbin/libvirtd', '/usr/sbin/virtqemud',
+            '/usr/libexec/qemu-kvm', '/usr/bin/qemu-kvm',
+            '/usr/bin/qemu-system-x86_64', '/usr/bin/qemu-system-aarch64',
+            '/usr/bin/qemu-system-ppc64', '/usr/bin/qemu-system-s390x',
+            '/etc/libvirt/qemu.conf']
+# Which daemon is running decides where virsh connects to
+DAEMON_PID_FILES = ['/run/libvirtd.pid', '/run/virtqemud.pid']
+
+# In memory facts: {'fingerprint': dict, 'facts': dict}
+_CACHE = {}
+
+
+def get_fingerprint():
+    """
+    Get the fingerprint of the host the facts are valid for
+
+    :return: dict, json serializable
+    """
+    fingerprint = {}
+    if os.path.exists(BOOT_ID_FILE):
+        with open(BOOT_ID_FILE) as fd:
+            fingerprint['boot_id'] = fd.read().strip()
+    for path in PACKAGE_DBS:
+        if os.path.exists(path):
+            fingerprint['packages'] = '%s:%s' % (path,
+                                                 os.path.getmtime(path))
+            break
+    binaries = {}
+    for path in BINARIES:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        binaries[path] = '%s:%s:%s' % (stat.st_ino, stat.st_size,
+                                       stat.st_mtime)
+    fingerprint['binaries'] = binaries
+    fingerprint['daemons'] = [path for path in DAEMON_PID_FILES
+                              if os.path.exists(path)]
+    return fingerprint
+
+
+def _get_cache_file():
+    return os.path.join(data_dir.get_data_dir(), 'host_facts.json')
+
+
+def _load_facts(cache_file, fingerprint):
+    """
+    Load the facts from cache_file if they match fingerprint
+
+    :return: dict of facts, empty if the file is missing or stale
+    """
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file) as fd:
+            cache = json.load(fd)
+    except ValueError:
+        return {}
+    if cache.get('fingerprint') != fingerprint:
+        LOG.debug("Host facts in %s are stale", cache_file)
+        return {}
+    return cache.get('facts', {})
+
+
+def get_fact(name, query_func):
+    """
+    Get a host fact, query and save it if it is not cached
+
+    :param name: str, unique name of the fact
+    :param query_func: function returning the fact, json serializable,
+                       None if it can not be queried and is not cached
+    :return: the fact
+    """
+    fingerprint = get_fingerprint()
+    if _CACHE.get('fingerprint') != fingerprint:
+        _CACHE.update({'fingerprint': fingerprint,
+                       'facts': _load_facts(_get_cache_file(), fingerprint)})
+    facts = _CACHE['facts']
+    if name in facts:
+        return facts[name]
+    value = query_func()
+    if value is None:
+        return None
+    cache_file = _get_cache_file()
+    with open(cache_file + '.lock', 'w') as lock_fd:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        try:
+            # Keep the facts saved by other processes meanwhile
+            facts.update(_load_facts(cache_file, fingerprint))
+            facts[name] = value
+            tmp_file = '%s.%d.tmp' % (cache_file, os.getpid())
+            with open(tmp_file, 'w') as fd:
+                json.dump({'fingerprint': fingerprint, 'facts': facts}, fd)
+            os.rename(tmp_file, cache_file)
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+    return value
+
+
+def invalidate():
+    """
+    Drop all cached facts
+    """
+    _CACHE.clear()
+    cache_file = _get_cache_file()
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
+
+
+def _query_virsh_version():
+    result = virsh.version(ignore_status=True)
+    if result.exit_status:
+        return None
+    return result.stdout_text
+
+
+def _parse_version(regex):
+    """
+    Parse a version from virsh version output
+
+    :return: int, like 9003000 for 9.3.0, 0 if not found
+    """
+    output = get_fact('virsh_version', _query_virsh_version) or ''
+    mobj = re.search(regex + r'(\d+)\.(\d+)\.(\d+)', output)
+    if not mobj:
+        return 0
+    return (int(mobj.group(1)) * 1000000 + int(mobj.group(2)) * 1000 +
+            int(mobj.group(3)))
+
+
+def get_libvirt_version():
+    """
+    Get the libvirt library version
+
+    :return: int, major * 1000000 + minor * 1000 + update, 0 if unknown
+    """
+    return _parse_version(r'[Uu]sing\s*[Ll]ibrary:\s*[Ll]ibvirt\s*')
+
+
+def get_capabilities():
+    """
+    Get the output of virsh capabilities
+
+    The hugepage counts of the numa cells change at run time, they are
+    left out, like <pages unit='KiB' size='2048'/>.
+
+    :return: str, the capabilities xml
+    """
+    def _query():
+        try:
+            output = virsh.capabilities(ignore_status=False)
+        except Exception as detail:
+            LOG.debug("Failed to get capabilities: %s", detail)
+            return None
+        return re.sub(r'<pages([^>]*[^/])>\s*\d+\s*</pages>', r'<pages\1/>',
+                      output)
+    return get_fact('capabilities', _query)
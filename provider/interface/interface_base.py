@@ -181,3 +181,86 @@ def update_iface_device(vm, params):
     libvirt.check_exit_status(result, status_error)
     if error_msg:
         libvirt.check_result(result, error_msg)
+
+
+def _get_pci_addr(addr_elem):
+    """
+    Get the pci address key of an address element
+
+    :param addr_elem: address element of a device
+    :return: Tuple, (domain, bus, slot, function) as int
+    """
+    return tuple(int(addr_elem.get(key, '0'), 0)
+                 for key in ('domain', 'bus', 'slot', 'function'))
+
+
+def check_pci_addresses(vmxml, devices):
+    """
+    Check pci addresses of devices to add to a VM before defining it
+
+    Duplicate addresses with the existing devices or each other, slots or
+    functions out of range and functions on a slot whose function 0 is not
+    multifunction are reported.
+
+    :param vmxml: VMXML object to add the devices to
+    :param devices: List of interface or hostdev device objects
+    :raise: TestError if there is an invalid address
+    """
+    used = {}
+    for addr_elem in vmxml.xmltreefile.findall('devices/*/address'):
+        if addr_elem.get('type') == 'pci':
+            used[_get_pci_addr(addr_elem)] = addr_elem.get('multifunction')
+    errors = []
+    new_addrs = []
+    for dev in devices:
+        addr_elem = dev.xmltreefile.find('address')
+        if addr_elem is None or addr_elem.get('type') != 'pci':
+            continue
+        addr = _get_pci_addr(addr_elem)
+        if addr in used:
+            errors.append("%s is already used" % str(addr))
+        if addr[2] > 0x1f or addr[3] > 7:
+            errors.append("%s is out of range" % str(addr))
+        used[addr] = addr_elem.get('multifunction')
+        new_addrs.append(addr)
+    for addr in new_addrs:
+        if addr[3] and used.get(addr[:3] + (0,)) != 'on':
+            errors.append("%s needs function 0 with multifunction='on'"
+                          % str(addr))
+    if errors:
+        raise exceptions.TestError("Invalid pci addresses (domain, bus, "
+                                   "slot, function): %s" % errors)
+
+
+def create_iface_devs(dev_type, iface_dicts):
+    """
+    Create interface or hostdev devices
+
+    :param dev_type: Device type, hostdev_device or an interface type
+    :param iface_dicts: List of attrs dicts of the devices
+    :return: List of device objects
+    """
+    if dev_type == 'hostdev_device':
+        return [create_hostdev(iface_dict) for iface_dict in iface_dicts]
+    return [create_iface(dev_type, iface_dict) for iface_dict in iface_dicts]
+
+
+def attach_devices_config(vm_name, devices):
+    """
+    Cold plug devices to a VM with one inactive XML edit and one define
+
+    It works like 'virsh attach-device --config' per device, but costs one
+    dumpxml and one define however many devices there are.
+
+    :param vm_name: VM's name
+    :param devices: List of interface or hostdev device objects
+    :return: The updated VMXML object
+    """
+    vmxml = vm_xml.VMXML.new_from_inactive_dumpxml(vm_name)
+    check_pci_addresses(vmxml, devices)
+    vm_devices = vmxml.devices
+    vm_devices.extend(devices)
+    vmxml.devices = vm_devices
+    logging.debug("Cold plug %d devices to %s.", len(devices), vm_name)
+    virsh.define(vmxml.xml, debug=True, ignore_status=False)
+    return vmxml
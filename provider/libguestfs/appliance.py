@@ -0,0 +1,245 @@
+"""
+Reuse launched guestfish appliances between test steps
+
+Booting the libguestfs appliance is the dominant cost of guestfish tests.
+With "gf_appliance_reuse = yes" in the cfg, a handle is not closed by
+close_session() but reset (file systems unmounted and synced) and kept,
+keyed by the drives it was launched with, every drive by its real path,
+read-only flag and format. The next handle adding the same drives adopts
+it in run() instead of launching a new appliance, e.g. the test step
+adopts the appliance create_fs() formatted the image with. Appliances of
+an image are closed when the image is re-created, see forget().
+
+Only opt in for read-only or resettable variants: the kept appliance must
+not race with other writers of the image, e.g. a running vm.
+"""
+
+import logging
+import os
+
+import aexpect
+
+from avocado.utils import process
+
+from virttest import utils_libguestfs
+from virttest import utils_test
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+
+class ApplianceCache(object):
+    """
+    Launched guestfish sessions keyed by their drives
+    """
+
+    def __init__(self):
+        # drives key -> list of session ids
+        self.sessions = {}
+        self.launches = 0
+        self.saved = 0
+
+    @staticmethod
+    def _is_alive(session_id):
+        """
+        Check whether the launched session still responds
+
+        :param session_id: id of a GuestfishSession
+        :return: True if the appliance responds
+        """
+        try:
+            session = utils_libguestfs.GuestfishSession(a_id=session_id)
+            return (session.is_alive() and
+                    session.cmd_status("ping-daemon", timeout=60) == 0)
+        except aexpect.ShellError:
+            return False
+
+    def take(self, key):
+        """
+        Take a healthy launched session for drives key
+
+        :param key: tuple, drives key
+        :return: session id, or None if there is none
+        """
+        while self.sessions.get(key):
+            session_id = self.sessions[key].pop()
+            if self._is_alive(session_id):
+                self.saved += 1
+                return session_id
+            self._close(session_id)
+        return None
+
+    def put(self, key, session_id):
+        """
+        Keep a launched session for later use
+
+        :param key: tuple, drives key
+        :param session_id: id of a GuestfishSession
+        """
+        self.sessions.setdefault(key, []).append(session_id)
+
+    @staticmethod
+    def _close(session_id):
+        """
+        Quit a guestfish session
+
+        :param session_id: id of a GuestfishSession
+        """
+        try:
+            session = utils_libguestfs.GuestfishSession(a_id=session_id)
+            if session.is_alive():
+                session.sendline("quit")
+                session.close()
+        except aexpect.ShellError:
+            pass
+
+    def forget(self, path):
+        """
+        Quit the kept sessions using a file, e.g. it is re-created
+
+        :param path: str, path of the image
+        """
+        path = os.path.realpath(path)
+        for key in list(self.sessions):
+            if any(drive[0] == path for drive in key):
+                for session_id in self.sessions.pop(key):
+                    self._close(session_id)
+
+    def close_all(self):
+        """
+        Quit all kept sessions and log how many launches were saved
+        """
+        for session_ids in self.sessions.values():
+            for session_id in session_ids:
+                self._close(session_id)
+        self.sessions = {}
+        LOG.info("Guestfish appliance launches: %d, saved by reuse: %d",
+                 self.launches, self.saved)
+
+
+APPLIANCES = ApplianceCache()
+
+
+class ReusableGuestfishTools(utils_test.libguestfs.GuestfishTools):
+    """
+    GuestfishTools which adopts a kept appliance with the same drives
+    """
+
+    __slots__ = ("drives", "launched")
+
+    def __init__(self, params):
+        super(ReusableGuestfishTools, self).__init__(params)
+        self.drives = []
+        self.launched = False
+
+    def _record_drive(self, name, readonly=False, image_format=None):
+        """
+        Record a drive added before launch as part of the key
+
+        :param name: str, path of the image or 'domain:<name>'
+        :param readonly: bool, whether the drive is read-only
+        :param image_format: str, format of the image, None if probed
+        """
+        if not self.launched:
+            if not name.startswith('domain:'):
+                name = os.path.realpath(name)
+            self.drives.append((name, bool(readonly), image_format))
+
+    def get_key(self):
+        """
+        Get the key of the drives added so far
+
+        :return: tuple
+        """
+        return tuple(self.drives)
+
+    def add_drive(self, filename):
+        self._record_drive(filename)
+        return super(ReusableGuestfishTools, self).add_drive(filename)
+
+    def add_drive_ro(self, filename):
+        self._record_drive(filename, True)
+        return super(ReusableGuestfishTools, self).add_drive_ro(filename)
+
+    def add_drive_opts(self, filename, readonly=False, **dargs):
+        self._record_drive(filename, readonly, dargs.get('format'))
+        return super(ReusableGuestfishTools, self).add_drive_opts(
+            filename, readonly=readonly, **dargs)
+
+    def add_domain(self, domain, **dargs):
+        self._record_drive('domain:%s' % domain, dargs.get('readonly'))
+        return super(ReusableGuestfishTools, self).add_domain(domain, **dargs)
+
+    def run(self):
+        """
+        Adopt a kept appliance with the same drives, or launch a new one
+        """
+        if self.launched:
+            return super(ReusableGuestfishTools, self).run()
+        self.launched = True
+        session_id = APPLIANCES.take(self.get_key())
+        if session_id is None:
+            APPLIANCES.launches += 1
+            return super(ReusableGuestfishTools, self).run()
+        LOG.debug("Reuse launched guestfish appliance for %s",
+                  self.get_key())
+        # Drop the not launched session and use the kept one
+        super(ReusableGuestfishTools, self).close_session()
+        self.__dict_set__("session_id", session_id)
+        return process.CmdResult(command="launch", exit_status=0)
+
+    launch = run
+
+    def close_session(self):
+        """
+        Reset and keep a launched appliance instead of closing it
+        """
+        if not self.launched or not self.drives:
+            return super(ReusableGuestfishTools, self).close_session()
+        try:
+            session = self.open_session()
+            if (session.cmd_status("umount-all", timeout=60) or
+                    session.cmd_status("sync", timeout=60)):
+                return super(ReusableGuestfishTools, self).close_session()
+        except (utils_libguestfs.LibguestfsCmdError, aexpect.ShellError):
+            return super(ReusableGuestfishTools, self).close_session()
+        APPLIANCES.put(self.get_key(), self.__dict_get__("session_id"))
+        self.__dict_del__("session_id")
+        self.launched = False
+
+
+def new_guestfish(params):
+    """
+    Get a guestfish handle, reusable if gf_appliance_reuse is yes
+
+    :param params: dict, test params
+    :return: GuestfishTools or ReusableGuestfishTools object
+    """
+    if (params.get("gf_appliance_reuse", "no") == "yes" and
+            params.get("gf_run_mode", "interactive") == "interactive"):
+        return ReusableGuestfishTools(params)
+    return utils_test.libguestfs.GuestfishTools(params)
+
+
+def forget(path):
+    """
+    Quit the kept appliances using an image which is re-created
+
+    :param path: str, path of the image
+    """
+    APPLIANCES.forget(path)
+
+
+def get_stats():
+    """
+    Get how many appliances were launched and how many launches reuse saved
+
+    :return: tuple of (launches, saved)
+    """
+    return APPLIANCES.launches, APPLIANCES.saved
+
+
+def close_all():
+    """
+    Quit all kept appliances, e.g. before their images are re-created
+    """
+    APPLIANCES.close_all()
@@ -0,0 +1,309 @@
+"""
+Golden image cache for libguestfs tests
+
+Images with the same format, size, partition type, file system and lvm
+layout are created once as templates in the cache dir, and each test gets
+a qcow2 overlay (for qcow2 images) or a reflink/sparse copy of the cached
+template instead of creating and formatting the image again. Templates are
+evicted least recently used first when the cache exceeds its disk budget.
+The cache dir is under the avocado-vt data dir, so it is shared by the
+test processes and kept between jobs.
+
+A test process holds a shared flock on the lease file of every template
+its images are cloned from, as qcow2 overlays keep reading the template.
+Templates leased by any process are never evicted.
+
+Enable it with "gf_image_cache = yes" in the cfg file.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+
+from avocado.utils import process
+
+from virttest import data_dir
+from virttest import storage
+from virttest import utils_misc
+from virttest import utils_test
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+# image path -> (template key, fd holding the shared lease)
+_LEASES = {}
+
+# Params which change the content of the image created by create_fs()
+KEY_PARAMS = ['image_format', 'image_size', 'partition_type', 'fs_type',
+              'with_blocksize', 'blocksize', 'pv_name', 'vg_name', 'lv_name',
+              'tarball_path', 'image_cluster_size', 'preallocated']
+# Params set by create_fs() that tests read afterwards
+RESULT_PARAMS = ['mount_point']
+
+
+def is_enabled(params):
+    """
+    Check whether the image cache is enabled
+
+    :param params: dict, test params
+    :return: True if gf_image_cache is yes
+    """
+    return params.get("gf_image_cache", "no") == "yes"
+
+
+def get_cache_key(params):
+    """
+    Get the content address of the image described by params
+
+    :param params: dict, test params
+    :return: str, sha256 hex digest of the image shaping params
+    """
+    key_dict = dict((key, params.get(key)) for key in KEY_PARAMS)
+    tarball_path = params.get("tarball_path")
+    if tarball_path and os.path.exists(tarball_path):
+        key_dict['tarball_mtime'] = os.path.getmtime(tarball_path)
+    key_str = json.dumps(key_dict, sort_keys=True)
+    return hashlib.sha256(key_str.encode()).hexdigest()[:32]
+
+
+class ImageCache(object):
+    """
+    Content addressed cache of images prepared by create_fs()
+
+    :param cache_dir: directory of the cached templates
+    :param budget: int, max disk usage of the cache in bytes
+    """
+
+    def __init__(self, cache_dir, budget):
+        self.cache_dir = cache_dir
+        self.budget = budget
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.lock_file = os.path.join(cache_dir, ".lock")
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Hold the cache lock, shared by all test processes
+        """
+        with open(self.lock_file, 'w') as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _meta_path(self, key):
+        return os.path.join(self.cache_dir, "%s.json" % key)
+
+    def _lease_path(self, key):
+        return os.path.join(self.cache_dir, "%s.lease" % key)
+
+    def _is_leased(self, key):
+        """
+        Check whether any process holds a lease on a template
+
+        :param key: cache key
+        :return: True if the template is in use
+        """
+        lease_path = self._lease_path(key)
+        if not os.path.exists(lease_path):
+            return False
+        with open(lease_path, 'a') as fd:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                return True
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        return False
+
+    def lease(self, key, image_path):
+        """
+        Hold a shared lease on a template while image_path uses it
+
+        The lease of the template image_path was cloned from before is
+        given up.
+
+        :param key: cache key
+        :param image_path: path of the image cloned from the template
+        """
+        fd = open(self._lease_path(key), 'a')
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        release(image_path)
+        _LEASES[image_path] = (key, fd)
+
+    def _load_meta(self, key):
+        """
+        Get the metadata of a cached template
+
+        :param key: cache key
+        :return: dict, or None if the template is not cached
+        """
+        meta_path = self._meta_path(key)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as fd:
+            meta = json.load(fd)
+        if not os.path.exists(meta['template']):
+            return None
+        return meta
+
+    def _build(self, key, params):
+        """
+        Create and format a template image in the cache dir
+
+        :param key: cache key
+        :param params: dict, test params
+        :return: dict, metadata of the template
+        """
+        build_params = params.copy()
+        build_params["img_dir"] = self.cache_dir
+        build_params["image_name"] = "%s-template" % key
+        image_path = utils_test.libguestfs.preprocess_image(build_params)
+        build_params["image_path"] = image_path
+        gf = utils_test.libguestfs.GuestfishTools(build_params)
+        try:
+            status, output = gf.create_fs()
+        finally:
+            gf.close_session()
+        if status is False:
+            os.remove(image_path)
+            raise RuntimeError(output)
+        meta = {'template': image_path,
+                'image_format': params.get("image_format", "qcow2"),
+                'params': dict((k, build_params.get(k)) for k in
+                               RESULT_PARAMS + KEY_PARAMS)}
+        tmp_meta = self._meta_path(key) + ".tmp"
+        with open(tmp_meta, 'w') as fd:
+            json.dump(meta, fd)
+        os.rename(tmp_meta, self._meta_path(key))
+        LOG.info("Cached image template %s", image_path)
+        return meta
+
+    def _usage(self):
+        """
+        Get templates with their disk usage and last use time
+
+        :return: list of (last use time, allocated bytes, key)
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-len(".json")]
+            meta = self._load_meta(key)
+            if not meta:
+                continue
+            stat = os.stat(meta['template'])
+            entries.append((stat.st_atime, stat.st_blocks * 512, key))
+        return entries
+
+    def _evict(self, keep_key):
+        """
+        Remove least recently used templates until within budget
+
+        :param keep_key: key which must not be evicted
+        """
+        entries = sorted(self._usage())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.budget:
+                break
+            if key == keep_key or self._is_leased(key):
+                continue
+            meta = self._load_meta(key)
+            LOG.debug("Evict image template %s", meta['template'])
+            os.remove(self._meta_path(key))
+            os.remove(meta['template'])
+            lease_path = self._lease_path(key)
+            if os.path.exists(lease_path):
+                os.remove(lease_path)
+            total -= size
+
+    def get_template(self, params, image_path):
+        """
+        Get the cached template of params, create it if not cached
+
+        :param params: dict, test params
+        :param image_path: path of the image to be cloned from it, which
+                           holds a lease on the template
+        :return: dict, metadata of the template
+        """
+        key = get_cache_key(params)
+        with self._locked():
+            meta = self._load_meta(key)
+            if meta:
+                LOG.debug("Image cache hit: %s", meta['template'])
+            else:
+                meta = self._build(key, params)
+            # Lease it before evicting, so other processes can not evict it
+            # between the lock and the clone either
+            self.lease(key, image_path)
+            self._evict(key)
+            # Record the use for LRU eviction
+            os.utime(meta['template'])
+        return meta
+
+    def clone(self, meta, image_path):
+        """
+        Make a cheap copy of the template at image_path
+
+        :param meta: dict, metadata of the template
+        :param image_path: path of the image for the test
+        """
+        if os.path.exists(image_path):
+            os.remove(image_path)
+        if meta['image_format'] == "qcow2":
+            cmd = ("qemu-img create -f qcow2 -F qcow2 -b %s %s"
+                   % (meta['template'], image_path))
+        else:
+            cmd = ("cp --reflink=auto --sparse=always %s %s"
+                   % (meta['template'], image_path))
+        process.run(cmd, shell=True, verbose=True)
+
+
+def release(image_path):
+    """
+    Give up the lease an image holds on its template
+
+    :param image_path: path of an image cloned by prepare_image()
+    """
+    lease = _LEASES.pop(image_path, None)
+    if lease:
+        lease[1].close()
+
+
+def prepare_image(params):
+    """
+    Prepare the image of a test from the cache, like preprocess_image()
+    and GuestfishTools.create_fs() do
+
+    :param params: dict, test params, image_path and mount_point are set
+    :return: tuple, (status, output) like create_fs()
+    """
+    cache_dir = params.get("gf_image_cache_dir",
+                           os.path.join(data_dir.get_data_dir(),
+                                        "guestfs_image_cache"))
+    budget = int(float(utils_misc.normalize_data_size(
+        params.get("gf_image_cache_budget", "20G"), order_magnitude="B")))
+    cache = ImageCache(cache_dir, budget)
+    image_dir = params.get("img_dir", data_dir.get_tmp_dir())
+    image_params = params.copy()
+    image_params.setdefault("image_name", "gs_common")
+    image_path = storage.get_image_filename(image_params, image_dir)
+    try:
+        meta = cache.get_template(params, image_path)
+    except RuntimeError as detail:
+        return (False, str(detail))
+
+    cache.clone(meta, image_path)
+    if meta['image_format'] != "qcow2":
+        # A copy does not read the template anymore
+        release(image_path)
+    params["image_path"] = image_path
+    for key in RESULT_PARAMS:
+        if meta['params'].get(key) is not None:
+            params[key] = meta['params'][key]
+    return (True, "Got image %s from cache" % image_path)
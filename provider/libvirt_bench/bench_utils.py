@@ -0,0 +1,102 @@
+"""
+Common helpers to summarize and save libvirt_bench results
+"""
+
+import json
+import logging
+import math
+import os
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+
+def get_percentile(samples, percent):
+    """
+    Get percentile of samples with the nearest-rank method
+
+    :param samples: list of numbers
+    :param percent: float, 0 < percent <= 100
+    :return: the percentile, None if samples is empty
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = int(math.ceil(percent / 100.0 * len(ordered)))
+    return ordered[max(rank, 1) - 1]
+
+
+def summarize(samples, percents=(50, 90, 99)):
+    """
+    Summarize samples with count, min, max, mean and percentiles
+
+    :param samples: list of numbers
+    :param percents: percentiles to calculate
+    :return: dict, like {'count': 3, 'min': 1, 'max': 3, 'mean': 2,
+             'p50': 2, 'p90': 3, 'p99': 3}
+    """
+    summary = {'count': len(samples)}
+    if not samples:
+        return summary
+    summary.update({'min': min(samples),
+                    'max': max(samples),
+                    'mean': sum(samples) / float(len(samples))})
+    for percent in percents:
+        summary['p%s' % percent] = get_percentile(samples, percent)
+    return summary
+
+
+def get_histogram(samples, bounds):
+    """
+    Count samples into buckets split by bounds
+
+    :param samples: list of numbers
+    :param bounds: sorted list of bucket upper bounds
+    :return: dict, like {'<=0.1': 3, '<=1': 5, '>1': 0}
+    """
+    buckets = dict(('<=%s' % bound, 0) for bound in bounds)
+    buckets['>%s' % bounds[-1]] = 0
+    for sample in samples:
+        for bound in bounds:
+            if sample <= bound:
+                buckets['<=%s' % bound] += 1
+                break
+        else:
+            buckets['>%s' % bounds[-1]] += 1
+    return buckets
+
+
+def format_summary_table(summaries, unit='s'):
+    """
+    Format summaries as a text table for logging
+
+    :param summaries: dict, name -> result of summarize()
+    :param unit: unit of the samples
+    :return: str, the table
+    """
+    header = "%-20s %8s %10s %10s %10s %10s %10s" % (
+        'name', 'count', 'mean', 'p50', 'p90', 'p99', 'max')
+    lines = [header + "  (%s)" % unit]
+    for name, summary in sorted(summaries.items()):
+        if not summary.get('count'):
+            lines.append("%-20s %8d" % (name, 0))
+            continue
+        lines.append("%-20s %8d %10.3f %10.3f %10.3f %10.3f %10.3f" % (
+            name, summary['count'], summary['mean'], summary['p50'],
+            summary['p90'], summary['p99'], summary['max']))
+    return "\n".join(lines)
+
+
+def save_json(result, result_dir, file_name):
+    """
+    Save result to a json file in result dir
+
+    :param result: json serializable object
+    :param result_dir: directory to save the file, like test.outputdir
+    :param file_name: name of the file
+    :return: path of the file
+    """
+    path = os.path.join(result_dir, file_name)
+    with open(path, 'w') as fd:
+        json.dump(result, fd, indent=2, sort_keys=True)
+    LOG.info("Saved bench result to %s", path)
+    return path
@@ -0,0 +1,237 @@
+"""
+Run domain state switching on groups of vms concurrently
+
+The vms are split into N groups, every group runs the operation loop in
+its own thread, and a semaphore limits how many libvirt operations are in
+flight at the same time. The latency of every operation is recorded so
+the percentiles can be reported per operation.
+"""
+
+import logging
+import threading
+import time
+
+from avocado.core import exceptions
+
+from virttest import virsh
+
+from provider import domain_events
+from provider.libvirt_bench import bench_utils
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+# Operations in the order they run in one loop
+OPERATIONS = ['shutdown', 'destroy', 'start', 'suspend', 'resume']
+DEFAULT_POST_STATES = {'start': 'running',
+                       'shutdown': 'running,in shutdown',
+                       'destroy': 'shut off',
+                       'suspend': 'paused',
+                       'resume': 'running'}
+
+
+def split_vms(vms, group_num):
+    """
+    Split vms into groups by index, vm[i] goes to group i % group_num
+
+    :param vms: list of vm objects
+    :param group_num: int, number of groups, 0 means one group per vm
+    :return: list of vm lists
+    """
+    if group_num <= 0 or group_num > len(vms):
+        group_num = len(vms)
+    groups = [[] for _ in range(group_num)]
+    for index, vm in enumerate(vms):
+        groups[index % group_num].append(vm)
+    return groups
+
+
+def get_operations(params):
+    """
+    Get enabled operations and their expected states from params
+
+    :param params: dict, test params with LB_domstate_switch_<op>
+                   and LB_domstate_switch_<op>_post_state
+    :return: dict, operation -> list of expected states
+    """
+    operations = {}
+    for operation in OPERATIONS:
+        enabled = params.get("LB_domstate_switch_%s" % operation)
+        post_state = params.get("LB_domstate_switch_%s_post_state" %
+                                operation)
+        # cfg files name suspend as pause
+        if operation == 'suspend' and enabled is None:
+            enabled = params.get("LB_domstate_switch_pause")
+            post_state = params.get("LB_domstate_switch_pause_post_state")
+        if enabled != "yes":
+            continue
+        operations[operation] = (post_state or
+                                 DEFAULT_POST_STATES[operation]).split(',')
+    return operations
+
+
+class DomstateSwitchScheduler(object):
+    """
+    Switch domain states of groups of vms in loops
+
+    :param vms: list of vm objects
+    :param operations: dict, operation -> list of expected states,
+                       see get_operations()
+    :param group_num: int, number of groups, 0 means one group per vm
+    :param concurrency: int, max libvirt operations in flight,
+                        0 means no limit
+    :param loop_time: int, seconds to run the loop for
+    :param state_timeout: int, seconds to wait for the domain event of the
+                          expected state after an operation
+    """
+
+    def __init__(self, vms, operations, group_num=1, concurrency=0,
+                 loop_time=600, state_timeout=10):
+        self.groups = split_vms(vms, group_num)
+        self.operations = operations
+        self.loop_time = int(loop_time)
+        self.state_timeout = int(state_timeout)
+        self.concurrency = int(concurrency)
+        self._semaphore = None
+        if self.concurrency > 0:
+            self._semaphore = threading.BoundedSemaphore(self.concurrency)
+        self._lock = threading.Lock()
+        self.latencies = dict((op, []) for op in operations)
+        self.loop_counters = [0] * len(self.groups)
+        self.errors = {}
+
+    def _do_operation(self, vm, operation):
+        """
+        Run one virsh operation on vm and record its latency
+
+        :param vm: vm object
+        :param operation: str, one of OPERATIONS
+        :raise: exceptions.TestFail if operation fails or the state after
+                it is not expected
+        """
+        virsh_func = getattr(virsh, operation)
+        if self._semaphore:
+            self._semaphore.acquire()
+        try:
+            start_time = time.time()
+            cmd_result = virsh_func(vm.name)
+            latency = time.time() - start_time
+        finally:
+            if self._semaphore:
+                self._semaphore.release()
+        if cmd_result.exit_status:
+            raise exceptions.TestFail(cmd_result)
+        with self._lock:
+            self.latencies[operation].append(latency)
+
+        state_list = self.operations[operation]
+        if domain_events.await_state(vm.name, state_list,
+                                     timeout=self.state_timeout):
+            return
+        actual_state = virsh.domstate(vm.name).stdout.strip()
+        if actual_state not in state_list:
+            raise exceptions.TestFail("Command %s succeed, but the state "
+                                      "of %s is %s, but not %s." %
+                                      (operation, vm.name, actual_state,
+                                       state_list))
+
+    def _run_one_loop(self, vms):
+        """
+        Run all enabled operations once on vms of a group
+
+        :param vms: list of vm objects in the group
+        """
+        for operation in OPERATIONS:
+            if operation not in self.operations:
+                continue
+            for vm in vms:
+                self._do_operation(vm, operation)
+            if operation == 'shutdown':
+                for vm in vms:
+                    if not domain_events.await_state(vm.name, 'shut off',
+                                                     timeout=240):
+                        raise exceptions.TestFail("Command shutdown succeed, "
+                                                  "but failed to wait for "
+                                                  "shutdown of %s." % vm.name)
+            elif operation == 'start':
+                for vm in vms:
+                    vm.wait_for_login().close()
+            LOG.debug("Operation %s on %s succeed.", operation,
+                      [vm.name for vm in vms])
+
+    def _run_group(self, index, end_time):
+        """
+        Loop operations on one group until end_time
+
+        :param index: int, index of the group
+        :param end_time: float, time to stop the loop
+        """
+        vms = self.groups[index]
+        try:
+            while time.time() < end_time:
+                self._run_one_loop(vms)
+                self.loop_counters[index] += 1
+                LOG.debug("Group %d finished %d loop(s).", index,
+                          self.loop_counters[index])
+        except Exception as detail:
+            self.errors[index] = ("Succeed for %s loop, and got an error.\n"
+                                  "Detail: %s." %
+                                  (self.loop_counters[index], detail))
+
+    def run(self):
+        """
+        Run all groups concurrently and wait for them
+
+        :raise: exceptions.TestFail if any group fails
+        """
+        for group in self.groups:
+            for vm in group:
+                vm.wait_for_login().close()
+        end_time = time.time() + self.loop_time
+        threads = []
+        for index in range(len(self.groups)):
+            thread = threading.Thread(target=self._run_group,
+                                      args=(index, end_time))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        LOG.info("Latency of domain state operations:\n%s",
+                 bench_utils.format_summary_table(self.get_summary()))
+        if self.errors:
+            raise exceptions.TestFail("\n".join(
+                "Group %d failed: %s" % (index, error)
+                for index, error in sorted(self.errors.items())))
+
+    def get_summary(self):
+        """
+        Get latency summary per operation
+
+        :return: dict, operation -> result of bench_utils.summarize()
+        """
+        return dict((op, bench_utils.summarize(latencies))
+                    for op, latencies in self.latencies.items())
+
+    def get_report(self):
+        """
+        Get the whole report
+
+        :return: dict, with group sizes, concurrency, loop counters,
+                 latency summary and raw latencies
+        """
+        return {'groups': [[vm.name for vm in group]
+                           for group in self.groups],
+                'concurrency': self.concurrency,
+                'loop_time': self.loop_time,
+                'loops': self.loop_counters,
+                'summary': self.get_summary(),
+                'latencies': self.latencies}
+
+    def cleanup(self):
+        """
+        Resume paused vms and destroy all vms
+        """
+        for group in self.groups:
+            for vm in group:
+                if vm.is_paused():
+                    vm.resume()
+                vm.destroy()
@@ -0,0 +1,201 @@
+"""
+Volume create/clone/delete churn benchmark on a storage pool
+
+Volumes are created with vol-create-as, so libvirt builds the volume XML
+from the arguments and no XML file is written per volume. Operations run
+on a bounded thread pool through the pooled virsh sessions. The pool is
+filled in steps, and pool-refresh and vol-list are timed after each step,
+so their cost can be compared as the volume count grows: a per volume
+cost which keeps growing points to O(n^2) behavior in the storage driver.
+"""
+
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from avocado.core import exceptions
+
+from provider import virsh_pool
+from provider.libvirt_bench import bench_utils
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+# Upper bounds of the latency histogram buckets in seconds
+HISTOGRAM_BOUNDS = [0.01, 0.05, 0.1, 0.5, 1, 5, 10]
+
+
+class VolChurnBench(object):
+    """
+    Create, clone and delete many volumes in a pool
+
+    :param pool_name: str, name of an active pool
+    :param vol_count: int, number of volumes to create
+    :param workers: int, max operations in flight
+    :param step: int, volumes created between two pool-refresh timings
+    :param capacity: str, capacity of every volume, like '1M'
+    :param allocation: str, allocation of every volume
+    :param vol_format: str, format of the volumes, None for the default
+    :param clone: bool, whether to clone every volume
+    """
+
+    def __init__(self, pool_name, vol_count=1000, workers=8, step=100,
+                 capacity='1M', allocation='1M', vol_format=None,
+                 clone=True):
+        self.pool_name = pool_name
+        self.vol_count = int(vol_count)
+        self.workers = int(workers)
+        self.step = max(int(step), 1)
+        self.capacity = capacity
+        self.allocation = allocation
+        self.vol_format = vol_format
+        self.clone = clone
+        self.latencies = {'create': [], 'clone': [], 'delete': []}
+        self.refresh_costs = []
+        self.errors = []
+        self.volumes = []
+
+    def _do_operation(self, operation, func_name, *args):
+        """
+        Run one virsh volume operation and record its latency
+
+        :param operation: str, key of self.latencies
+        :param func_name: str, virsh function name
+        :param args: arguments of the virsh function
+        :return: True if the operation succeed
+        """
+        start_time = time.time()
+        cmd_result = virsh_pool.run(func_name, *args, ignore_status=True)
+        latency = time.time() - start_time
+        # list.append is atomic, no lock is needed between workers
+        self.latencies[operation].append(latency)
+        if cmd_result.exit_status:
+            self.errors.append("%s %s failed: %s" % (
+                operation, args[0], cmd_result.stderr_text.strip()))
+            return False
+        return True
+
+    def _create(self, vol_name):
+        return self._do_operation('create', 'vol_create_as', vol_name,
+                                  self.pool_name, self.capacity,
+                                  self.allocation, self.vol_format)
+
+    def _clone(self, vol_name):
+        return self._do_operation('clone', 'vol_clone', vol_name,
+                                  '%s-clone' % vol_name, self.pool_name)
+
+    def _delete(self, vol_name):
+        return self._do_operation('delete', 'vol_delete', vol_name,
+                                  self.pool_name)
+
+    def _time_refresh(self):
+        """
+        Time pool-refresh and vol-list with the current volume count
+        """
+        start_time = time.time()
+        virsh_pool.run('pool_refresh', self.pool_name, ignore_status=True)
+        refresh_time = time.time() - start_time
+        start_time = time.time()
+        virsh_pool.run('vol_list', self.pool_name, ignore_status=True)
+        list_time = time.time() - start_time
+        cost = {'volumes': len(self.volumes), 'refresh': refresh_time,
+                'list': list_time}
+        LOG.debug("Pool %s with %d volumes: refresh %.3fs, list %.3fs",
+                  self.pool_name, cost['volumes'], refresh_time, list_time)
+        self.refresh_costs.append(cost)
+
+    def _run_batch(self, executor, func, vol_names):
+        """
+        Run func on vol_names in executor and get the succeeded ones
+
+        :return: list of volume names func succeed on
+        """
+        results = executor.map(func, vol_names)
+        return [name for name, ok in zip(vol_names, results) if ok]
+
+    def run(self):
+        """
+        Create volumes step by step, clone them and delete all of them
+
+        :raise: exceptions.TestFail if any operation fails
+        """
+        self._time_refresh()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for start in range(0, self.vol_count, self.step):
+                end = min(start + self.step, self.vol_count)
+                names = ['churn-vol%d' % index for index in range(start, end)]
+                self.volumes.extend(self._run_batch(executor, self._create,
+                                                    names))
+                self._time_refresh()
+            if self.clone:
+                clones = self._run_batch(executor, self._clone,
+                                         list(self.volumes))
+                self.volumes.extend('%s-clone' % name for name in clones)
+                self._time_refresh()
+            deleted = self._run_batch(executor, self._delete,
+                                      list(self.volumes))
+            deleted = set(deleted)
+            self.volumes = [name for name in self.volumes
+                            if name not in deleted]
+        self._time_refresh()
+        LOG.info("Latency of volume operations:\n%s",
+                 bench_utils.format_summary_table(self.get_summary()))
+        if self.errors:
+            raise exceptions.TestFail("%d volume operations failed, the "
+                                      "first ones:\n%s" % (
+                                          len(self.errors),
+                                          "\n".join(self.errors[:10])))
+
+    def get_refresh_growth(self):
+        """
+        Get how much the per volume pool-refresh cost grows
+
+        :return: float, per volume refresh cost with the most volumes
+                 divided by the one at the first step, None if there are
+                 not enough timings
+        """
+        costs = [cost for cost in self.refresh_costs if cost['volumes']]
+        if len(costs) < 2:
+            return None
+        first = costs[0]['refresh'] / costs[0]['volumes']
+        last = max(costs, key=lambda cost: cost['volumes'])
+        if not first:
+            return None
+        return (last['refresh'] / last['volumes']) / first
+
+    def get_summary(self):
+        """
+        Get latency summary per operation
+
+        :return: dict, operation -> result of bench_utils.summarize()
+        """
+        return dict((op, bench_utils.summarize(latencies))
+                    for op, latencies in self.latencies.items())
+
+    def get_report(self):
+        """
+        Get the whole report
+
+        :return: dict, with latency summary and histograms per operation
+                 and pool-refresh timings per volume count
+        """
+        return {'pool': self.pool_name,
+                'vol_count': self.vol_count,
+                'workers': self.workers,
+                'summary': self.get_summary(),
+                'histogram': dict(
+                    (op, bench_utils.get_histogram(latencies,
+                                                   HISTOGRAM_BOUNDS))
+                    for op, latencies in self.latencies.items()),
+                'refresh_costs': self.refresh_costs,
+                'refresh_growth': self.get_refresh_growth(),
+                'errors': self.errors}
+
+    def cleanup(self):
+        """
+        Delete the volumes left by a failed run
+        """
+        for vol_name in self.volumes:
+            virsh_pool.run('vol_delete', vol_name, self.pool_name,
+                           ignore_status=True)
+        self.volumes = []
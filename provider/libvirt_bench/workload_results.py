@@ -0,0 +1,305 @@
+"""
+Collect guest workload scores while libvirt operations run
+
+The workload log in the guest is read incrementally, the netperf,
+unixbench or iozone results found in the new lines are parsed into
+metrics, and every metric is tagged with the libvirt operations which
+were in progress since the previous read, or 'idle' if there was none.
+Comparing the metrics of an operation with the idle ones shows how much
+the operation degrades the guest throughput.
+"""
+
+import contextlib
+import logging
+import re
+import threading
+import time
+
+from provider.libvirt_bench import bench_utils
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+IDLE = 'idle'
+# Log of the autotest client running the workload in the guest
+AUTOTEST_LOG = '/usr/local/autotest/results/default/debug/client.DEBUG'
+# Autotest prefixes the output of the test with like '... [stdout] '
+STD_PREFIX = re.compile(r'^.*?\[std(?:out|err)\] ?')
+# Netperf TCP_STREAM result: recv sock, send sock, msg size, time, Mbps
+NETPERF_STREAM = re.compile(r'^\s*(\d+)\s+(\d+)\s+(\d+)\s+([\d.]+)\s+'
+                            r'([\d.]+)\s*$')
+# Netperf TCP_RR/TCP_CRR result: send, recv, req size, resp size, time,
+# transactions per second
+NETPERF_RR = re.compile(r'^\s*(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+([\d.]+)\s+'
+                        r'([\d.]+)\s*$')
+UNIXBENCH_TEST = re.compile(r'^(\S.*?)\s{2,}([\d.]+) (lps|lpm|KBps|MWIPS)'
+                            r'\s+\(')
+UNIXBENCH_INDEX = re.compile(r'System Benchmarks Index Score\s+([\d.]+)')
+IOZONE_HEADER = re.compile(r'^\s*kB\s+reclen\s+')
+# Columns of the iozone auto mode table after kB and reclen
+IOZONE_COLUMNS = ['write', 'rewrite', 'read', 'reread', 'random_read',
+                  'random_write', 'bkwd_read', 'record_rewrite',
+                  'stride_read', 'fwrite', 'frewrite', 'fread', 'freread']
+
+
+class Metric(object):
+    """
+    One workload score
+
+    :param workload: str, netperf, unixbench or iozone
+    :param name: str, metric name, like 'tcp_stream' or 'write'
+    :param value: float, the score
+    :param unit: str, unit of the score
+    :param labels: dict, extra labels like the iozone record size
+    """
+
+    def __init__(self, workload, name, value, unit, labels=None):
+        self.workload = workload
+        self.name = name
+        self.value = float(value)
+        self.unit = unit
+        self.labels = labels or {}
+        self.vm_name = None
+        self.operations = [IDLE]
+        self.timestamp = None
+
+    def to_dict(self):
+        return {'workload': self.workload, 'name': self.name,
+                'value': self.value, 'unit': self.unit,
+                'labels': self.labels, 'vm': self.vm_name,
+                'operations': self.operations,
+                'timestamp': self.timestamp}
+
+
+def _strip_prefix(lines):
+    return [STD_PREFIX.sub('', line) for line in lines]
+
+
+def parse_netperf(lines):
+    """
+    Parse netperf result lines
+
+    :param lines: list of output lines
+    :return: list of Metric
+    """
+    metrics = []
+    for line in _strip_prefix(lines):
+        match = NETPERF_RR.match(line)
+        if match:
+            metrics.append(Metric('netperf', 'tcp_rr', match.group(6),
+                                  'trans/s',
+                                  {'request': int(match.group(3)),
+                                   'response': int(match.group(4))}))
+            continue
+        match = NETPERF_STREAM.match(line)
+        if match:
+            metrics.append(Metric('netperf', 'tcp_stream', match.group(5),
+                                  'Mbps', {'msg_size': int(match.group(3))}))
+    return metrics
+
+
+def parse_unixbench(lines):
+    """
+    Parse unixbench result lines
+
+    :param lines: list of output lines
+    :return: list of Metric
+    """
+    metrics = []
+    for line in _strip_prefix(lines):
+        match = UNIXBENCH_INDEX.search(line)
+        if match:
+            metrics.append(Metric('unixbench', 'index_score', match.group(1),
+                                  'score'))
+            continue
+        match = UNIXBENCH_TEST.match(line)
+        if match:
+            metrics.append(Metric('unixbench', match.group(1).strip(),
+                                  match.group(2), match.group(3)))
+    return metrics
+
+
+def parse_iozone(lines):
+    """
+    Parse iozone auto mode result table
+
+    :param lines: list of output lines
+    :return: list of Metric, one per column of every row in KB/s
+    """
+    metrics = []
+    columns = None
+    for line in _strip_prefix(lines):
+        if IOZONE_HEADER.match(line):
+            columns = IOZONE_COLUMNS
+            continue
+        values = line.split()
+        if not columns or not values or not all(
+                value.isdigit() for value in values):
+            if values:
+                columns = None
+            continue
+        labels = {'file_kb': int(values[0]), 'reclen_kb': int(values[1])}
+        for name, value in zip(columns, values[2:]):
+            metrics.append(Metric('iozone', name, value, 'KB/s',
+                                  dict(labels)))
+    return metrics
+
+
+PARSERS = {'netperf': parse_netperf,
+           'unixbench': parse_unixbench,
+           'iozone': parse_iozone}
+
+
+class WorkloadResultCollector(object):
+    """
+    Collect workload metrics of vms tagged with libvirt operations
+
+    :param workload: str, key of PARSERS
+    :param log_path: str, path of the workload log in the guests
+    """
+
+    def __init__(self, workload, log_path):
+        self.workload = workload
+        self.parser = PARSERS[workload]
+        self.log_path = log_path
+        self.metrics = []
+        self._lock = threading.Lock()
+        # (operation, start time, end time or None if running)
+        self._operations = []
+        # vm name -> (lines read, last read time)
+        self._read_state = {}
+
+    def start_operation(self, name):
+        """
+        Mark the start of a libvirt operation
+
+        :param name: str, operation name, like 'dump'
+        :return: index to pass to end_operation()
+        """
+        with self._lock:
+            self._operations.append([name, time.time(), None])
+            return len(self._operations) - 1
+
+    def end_operation(self, index):
+        """
+        Mark the end of a libvirt operation
+
+        :param index: returned by start_operation()
+        """
+        with self._lock:
+            self._operations[index][2] = time.time()
+
+    @contextlib.contextmanager
+    def operation(self, name):
+        """
+        Context manager marking a libvirt operation in progress
+
+        :param name: str, operation name, like 'dump'
+        """
+        index = self.start_operation(name)
+        try:
+            yield
+        finally:
+            self.end_operation(index)
+
+    def _get_operations(self, since, until):
+        """
+        Get operations in progress at any time between since and until
+        """
+        with self._lock:
+            names = set(name for name, start, end in self._operations
+                        if start <= until and (end is None or end >= since))
+        return sorted(names) or [IDLE]
+
+    def poll(self, vm_name, session, timeout=60):
+        """
+        Read new lines of the workload log of a vm and parse them
+
+        :param vm_name: str, name of the vm
+        :param session: session to the vm
+        :param timeout: int, timeout of reading the log
+        :return: list of new Metric
+        """
+        read_lines, last_time = self._read_state.get(vm_name, (0, None))
+        now = time.time()
+        try:
+            status, output = session.cmd_status_output(
+                "tail -n +%d %s" % (read_lines + 1, self.log_path),
+                timeout=timeout)
+        except Exception as detail:
+            LOG.debug("Failed to read %s of %s: %s", self.log_path,
+                      vm_name, detail)
+            return []
+        if status:
+            return []
+        lines = output.splitlines()
+        # Keep the last line for the next read if it is not complete
+        if lines and not output.endswith('\n'):
+            lines = lines[:-1]
+        self._read_state[vm_name] = (read_lines + len(lines), now)
+        operations = self._get_operations(last_time or now, now)
+        metrics = self.parser(lines)
+        for metric in metrics:
+            metric.vm_name = vm_name
+            metric.operations = operations
+            metric.timestamp = now
+        with self._lock:
+            self.metrics.extend(metrics)
+        if metrics:
+            LOG.debug("Got %d %s metrics of %s during %s", len(metrics),
+                      self.workload, vm_name, operations)
+        return metrics
+
+    def poll_all(self, sessions, timeout=60):
+        """
+        Poll the workload logs of vms
+
+        :param sessions: dict, vm name -> session to the vm
+        :param timeout: int, timeout of reading each log
+        :return: list of new Metric
+        """
+        metrics = []
+        for vm_name, session in sessions.items():
+            metrics.extend(self.poll(vm_name, session, timeout))
+        return metrics
+
+    def get_summary(self):
+        """
+        Summarize metric values per metric name and operations
+
+        :return: dict, metric name -> operations -> summary, with
+                 'ratio_to_idle' of the mean when there are idle values
+        """
+        values = {}
+        for metric in self.metrics:
+            tag = ','.join(metric.operations)
+            values.setdefault(metric.name, {}).setdefault(tag, []).append(
+                metric.value)
+        summary = {}
+        for name, tags in values.items():
+            summary[name] = dict((tag, bench_utils.summarize(samples))
+                                 for tag, samples in tags.items())
+            idle_mean = summary[name].get(IDLE, {}).get('mean')
+            for tag, tag_summary in summary[name].items():
+                if idle_mean and tag != IDLE:
+                    tag_summary['ratio_to_idle'] = (tag_summary['mean'] /
+                                                    idle_mean)
+        return summary
+
+    def save(self, result_dir, file_name=None):
+        """
+        Save all metrics and the summary to one json file
+
+        :param result_dir: directory to save the file, like test.outputdir
+        :param file_name: name of the file, default is
+                          <workload>_results.json
+        :return: path of the file
+        """
+        with self._lock:
+            operations = [{'name': name, 'start': start, 'end': end}
+                          for name, start, end in self._operations]
+        result = {'workload': self.workload,
+                  'operations': operations,
+                  'summary': self.get_summary(),
+                  'metrics': [metric.to_dict() for metric in self.metrics]}
+        return bench_utils.save_json(
+            result, result_dir, file_name or "%s_results.json" % self.workload)
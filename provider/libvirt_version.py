@@ -2,10 +2,9 @@
 Shared code for tests that need to get the libvirt version
 """
 
-import re
 import logging
 
-from virttest import virsh
+from provider import host_facts
 
 LIBVIRT_LIB_VERSION = 0
 
@@ -30,18 +29,9 @@ def version_compare(major, minor, update):
     global LIBVIRT_LIB_VERSION
 
     if LIBVIRT_LIB_VERSION == 0:
-        try:
-            regex = r'[Uu]sing\s*[Ll]ibrary:\s*[Ll]ibvirt\s*'
-            regex += r'(\d+)\.(\d+)\.(\d+)'
-            lines = virsh.version().stdout.splitlines()
-            for line in lines:
-                mobj = re.search(regex, line)
-                if bool(mobj):
-                    LIBVIRT_LIB_VERSION = int(mobj.group(1)) * 1000000 + \
-                        int(mobj.group(2)) * 1000 + \
-                        int(mobj.group(3))
-                    break
-        except (ValueError, TypeError, AttributeError):
+        # Cached across test processes until libvirt is updated
+        LIBVIRT_LIB_VERSION = host_facts.get_libvirt_version()
+        if not LIBVIRT_LIB_VERSION:
             logging.warning("Error determining libvirt version")
             return False
 
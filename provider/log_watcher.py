@@ -0,0 +1,221 @@
+"""
+Scan only the newly appended part of log files
+
+Checking a log with grep reads the whole file every time, and a libvirtd
+debug log of a long run has hundreds of MB. LogWatcher remembers the
+offset scanned up to per file and test step, so every check only reads
+the bytes appended since, e.g.:
+
+    watcher = log_watcher.LogWatcher()
+    watcher.mark(log_file, 'save')
+    virsh.save(...)
+    if not watcher.wait_for(log_file, ['gzip -c'], step='save', timeout=20):
+        test.fail(...)
+
+Large spans are searched through mmap without copying. A file replaced
+by rotation or truncated is scanned again from the start. Waiting wakes
+up on inotify events of the log directory, or polls if inotify can not
+be used.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import mmap
+import os
+import re
+import select
+import time
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+# Spans larger than this are searched with mmap instead of read
+MMAP_THRESHOLD = 8 * 1024 * 1024
+POLL_INTERVAL = 0.5
+# IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+INOTIFY_MASK = 0x00000002 | 0x00000008 | 0x00000080 | 0x00000100
+
+
+class _Inotify(object):
+    """
+    Wake up on changes in a directory with inotify through libc
+
+    :param directory: str, directory to watch
+    :raise: OSError if inotify is not available
+    """
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, directory.encode(),
+                                  INOTIFY_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed")
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout for a change and drain the events
+        """
+        readable, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if readable:
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _FileState(object):
+    """
+    Scan position of one file in one step
+    """
+
+    def __init__(self, offset=0, inode=None):
+        self.offset = offset
+        self.inode = inode
+
+
+class LogWatcher(object):
+    """
+    Scan appended lines of log files for patterns
+    """
+
+    def __init__(self):
+        # (path, step) -> _FileState
+        self._states = {}
+
+    @staticmethod
+    def _stat(path):
+        try:
+            return os.stat(path)
+        except FileNotFoundError:
+            return None
+
+    def mark(self, path, step=None):
+        """
+        Only scan the data appended from now on in the step
+
+        :param path: str, path of the log file
+        :param step: hashable, test step name, None for the default one
+        """
+        stat = self._stat(path)
+        self._states[(path, step)] = _FileState(
+            stat.st_size if stat else 0, stat.st_ino if stat else None)
+
+    def _get_span(self, path, step):
+        """
+        Get the state and the range of new data to scan
+
+        :return: tuple of (state, start, end), end is None if no file
+        """
+        state = self._states.setdefault((path, step), _FileState())
+        stat = self._stat(path)
+        if stat is None:
+            return state, state.offset, None
+        if state.inode is not None and stat.st_ino != state.inode:
+            LOG.debug("%s is rotated, scanning it from the start", path)
+            state.offset = 0
+        elif stat.st_size < state.offset:
+            LOG.debug("%s is truncated, scanning it from the start", path)
+            state.offset = 0
+        state.inode = stat.st_ino
+        return state, state.offset, stat.st_size
+
+    @staticmethod
+    def _search(buf, start, end, regexes, found):
+        """
+        Search regexes not found yet in buf[start:end]
+
+        The last line may be incomplete, like a login prompt, it is
+        searched but scanned again next time.
+
+        :return: offset after the last complete line
+        """
+        for pattern, regex in regexes.items():
+            if pattern in found:
+                continue
+            match = regex.search(buf, start, end)
+            if match:
+                line_start = buf.rfind(b'\n', start, match.start()) + 1
+                line_end = buf.find(b'\n', match.start(), end)
+                if line_end < 0:
+                    line_end = end
+                found[pattern] = buf[line_start:line_end].decode(
+                    errors='ignore')
+        return buf.rfind(b'\n', start, end) + 1 or start
+
+    def scan(self, path, patterns, step=None, found=None):
+        """
+        Search patterns in the data appended since last scan
+
+        :param path: str, path of the log file
+        :param patterns: list of regular expressions
+        :param step: hashable, test step name, None for the default one
+        :param found: dict of patterns found before, updated in place
+        :return: dict, pattern -> first line matching it
+        """
+        found = {} if found is None else found
+        state, start, end = self._get_span(path, step)
+        if end is None or end <= start:
+            return found
+        regexes = dict((pattern, re.compile(pattern.encode(), re.M))
+                       for pattern in patterns)
+        with open(path, 'rb') as fd:
+            if end - start > MMAP_THRESHOLD:
+                with mmap.mmap(fd.fileno(), end,
+                               access=mmap.ACCESS_READ) as buf:
+                    scanned = self._search(buf, start, end, regexes, found)
+                state.offset = scanned
+            else:
+                fd.seek(start)
+                buf = fd.read(end - start)
+                state.offset = start + self._search(buf, 0, len(buf),
+                                                    regexes, found)
+        return found
+
+    def wait_for(self, path, patterns, timeout=60, step=None,
+                 match_all=True):
+        """
+        Wait until patterns appear in the data appended to a log file
+
+        :param path: str, path of the log file
+        :param patterns: str or list of regular expressions
+        :param timeout: float, seconds to wait
+        :param step: hashable, test step name, None for the default one
+        :param match_all: True to wait for all patterns, False for any
+        :return: dict, pattern -> first line matching it, empty if the
+                 expected patterns are not found before timeout
+        """
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        end_time = time.time() + timeout
+        found = {}
+        notifier = None
+        try:
+            notifier = _Inotify(os.path.dirname(os.path.abspath(path)))
+        except (OSError, AttributeError) as detail:
+            LOG.debug("Polling %s, inotify is not usable: %s", path, detail)
+        try:
+            while True:
+                self.scan(path, patterns, step, found)
+                if found and (not match_all or len(found) == len(patterns)):
+                    return found
+                remaining = end_time - time.time()
+                if remaining <= 0:
+                    LOG.debug("Not found %s in %s", [
+                        pattern for pattern in patterns
+                        if pattern not in found], path)
+                    return {}
+                if notifier:
+                    notifier.wait(min(remaining, POLL_INTERVAL * 10))
+                else:
+                    time.sleep(min(remaining, POLL_INTERVAL))
+        finally:
+            if notifier:
+                notifier.close()
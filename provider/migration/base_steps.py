@@ -13,6 +13,7 @@ from virttest import utils_iptables
 from virttest.utils_test import libvirt
 from virttest.libvirt_xml import vm_xml
 
+from provider.migration import domjobinfo_sampler
 from provider.migration import migration_base
 
 
@@ -27,6 +28,8 @@ class MigrationBase(object):
     :param src_uri: source uri
     :param conn_list: connection object list
     :param remote_libvirtd_log: remote.RemoteFile object
+    :param jobinfo_sampler: DomjobinfoSampler object of last migration
+    :param dirtyrate_profiler: DirtyRateProfiler object of last migration
     """
 
     def __init__(self, test, vm, params):
@@ -42,6 +45,8 @@ class MigrationBase(object):
                         self.params.get("migrate_source_host"))
         self.conn_list = []
         self.remote_libvirtd_log = None
+        self.jobinfo_sampler = None
+        self.dirtyrate_profiler = None
 
         migration_test = migration.MigrationTest()
         migration_test.check_parameters(params)
@@ -88,6 +93,8 @@ class MigrationBase(object):
         do_migration_during_mig = "yes" == self.params.get("do_migration_during_mig", "no")
         initiating_bandwidth = self.params.get("initiating_bandwidth")
         second_bandwidth = self.params.get("second_bandwidth")
+        domjobinfo_sample_interval = self.params.get("domjobinfo_sample_interval")
+        dirtyrate_profile_interval = self.params.get("dirtyrate_profile_interval")
 
         if postcopy_options:
             extra = "%s %s" % (extra, postcopy_options)
@@ -141,12 +148,67 @@ class MigrationBase(object):
             self.migration_test.control_migrate_speed(vm_name, int(migrate_speed), mode)
         if stress_package:
             self.migration_test.run_stress_in_vm(self.vm, self.params)
+        if dirtyrate_profile_interval:
+            self.profile_dirtyrate(mode)
 
         # Execute migration process
         do_mig_param = {"vm": self.vm, "mig_test": self.migration_test, "src_uri": None,
                         "dest_uri": dest_uri, "options": options, "virsh_options": virsh_options,
                         "extra": extra, "action_during_mig": action_during_mig, "extra_args": extra_args}
-        migration_base.do_migration(do_mig_param)
+        if domjobinfo_sample_interval:
+            self.start_jobinfo_sampler(float(domjobinfo_sample_interval))
+        if dirtyrate_profile_interval:
+            self.dirtyrate_profiler.start()
+        try:
+            migration_base.do_migration(do_mig_param)
+        finally:
+            if domjobinfo_sample_interval:
+                self.stop_jobinfo_sampler()
+            if dirtyrate_profile_interval:
+                self.dirtyrate_profiler.stop()
+                self.dirtyrate_profiler.save_report(self.test.outputdir)
+
+    def start_jobinfo_sampler(self, interval):
+        """
+        Start sampling domjobinfo of the migrating vm in background
+
+        :param interval: float, seconds between two samples
+        """
+        self.jobinfo_sampler = domjobinfo_sampler.DomjobinfoSampler(
+            self.vm.name, interval=interval, uri=self.src_uri,
+            dest_uri=self.params.get("virsh_migrate_desturi"))
+        self.jobinfo_sampler.start()
+
+    def profile_dirtyrate(self, mode):
+        """
+        Profile the dirty rate of the vm before migration
+
+        If migrate_speed_auto is yes, the migrate speed is set to the
+        lowest bandwidth which is predicted to converge.
+
+        :param mode: str, mode of migrate speed, 'precopy' or 'both'
+        """
+        self.dirtyrate_profiler = migration_base.DirtyRateProfiler(
+            self.vm.name,
+            interval=float(self.params.get("dirtyrate_profile_interval")),
+            calc_seconds=int(self.params.get("dirtyrate_calc_seconds", 1)),
+            mode=self.params.get("dirtyrate_calc_mode"), uri=self.src_uri,
+            dest_uri=self.params.get("virsh_migrate_desturi"))
+        prediction = self.dirtyrate_profiler.profile_before()
+        if prediction and "yes" == self.params.get("migrate_speed_auto", "no"):
+            self.test.log.info("Set migrate speed to %s MiB/s by dirty rate",
+                               prediction['bandwidth'])
+            self.migration_test.control_migrate_speed(
+                self.vm.name, prediction['bandwidth'], mode)
+            self.dirtyrate_profiler.predict()
+
+    def stop_jobinfo_sampler(self):
+        """
+        Stop sampling domjobinfo and save the report to test output dir
+
+        """
+        self.jobinfo_sampler.stop()
+        self.jobinfo_sampler.save_report(self.test.outputdir)
 
     def run_migration_again(self):
         """
@@ -0,0 +1,168 @@
+"""
+Sample domjobinfo periodically during migration and save the time series
+"""
+
+import csv
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from virttest import virsh
+
+from provider import virsh_pool
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+SIZE_UNITS = {'b': 1, 'bytes': 1, 'kib': 1024, 'mib': 1024 ** 2,
+              'gib': 1024 ** 3, 'tib': 1024 ** 4}
+
+# Columns of the csv report, keys are the ones returned by parse_domjobinfo
+SAMPLE_FIELDS = ['timestamp', 'job_type', 'time_elapsed', 'memory_processed',
+                 'memory_remaining', 'memory_total', 'memory_bandwidth',
+                 'dirty_rate', 'iteration', 'expected_downtime',
+                 'total_downtime']
+
+
+def parse_domjobinfo(output):
+    """
+    Parse the output of virsh domjobinfo into a dict
+
+    Keys are lower case item names with '_' instead of spaces, sizes are
+    converted to bytes, bandwidth to bytes/s, times stay in ms and dirty
+    rate in pages/s. Non numeric values like 'Job type' are kept as str.
+
+    :param output: str, output of virsh domjobinfo
+    :return: dict, the parsed items
+    """
+    jobinfo = {}
+    for line in output.splitlines():
+        if ':' not in line:
+            continue
+        key, value = line.split(':', 1)
+        key = re.sub(r'\W+', '_', key.strip().lower()).strip('_')
+        value = value.strip()
+        mobj = re.match(r'^(-?\d+(?:\.\d+)?)\s*(\S*)$', value)
+        if not mobj:
+            jobinfo[key] = value
+            continue
+        number, unit = float(mobj.group(1)), mobj.group(2).lower()
+        if unit.endswith('/s') and unit[:-2] in SIZE_UNITS:
+            number *= SIZE_UNITS[unit[:-2]]
+        elif unit in SIZE_UNITS:
+            number *= SIZE_UNITS[unit]
+        jobinfo[key] = int(number) if number.is_integer() else number
+    return jobinfo
+
+
+class DomjobinfoSampler(object):
+    """
+    Poll virsh domjobinfo in a background thread during migration
+
+    :param vm_name: name of the migrating vm
+    :param interval: float, seconds between two samples
+    :param uri: uri of the source host
+    :param dest_uri: uri of the target host, used to get completed job
+                     info when the vm is gone on source
+    """
+
+    def __init__(self, vm_name, interval=1, uri=None, dest_uri=None):
+        self.vm_name = vm_name
+        self.interval = float(interval)
+        self.uri = uri
+        self.dest_uri = dest_uri
+        self.samples = []
+        self.completed = {}
+        self._start_time = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _sample_once(self):
+        """
+        Get one domjobinfo sample of an active job
+        """
+        ret = virsh_pool.run("domjobinfo", self.vm_name, uri=self.uri,
+                             ignore_status=True, debug=False)
+        if ret.exit_status:
+            return
+        jobinfo = parse_domjobinfo(ret.stdout_text)
+        if jobinfo.get('job_type', 'None') == 'None':
+            return
+        jobinfo['timestamp'] = round(time.time() - self._start_time, 3)
+        self.samples.append(jobinfo)
+
+    def _run(self):
+        """
+        Sampling loop of the background thread
+        """
+        while not self._stop_event.is_set():
+            self._sample_once()
+            self._stop_event.wait(self.interval)
+
+    def start(self):
+        """
+        Start sampling in background
+        """
+        self._start_time = time.time()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        LOG.debug("Started domjobinfo sampler for %s every %ss",
+                  self.vm_name, self.interval)
+
+    def stop(self):
+        """
+        Stop sampling and get the completed job info
+
+        :return: dict, completed job info
+        """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(self.interval + 60)
+            self._thread = None
+        for uri in [self.uri, self.dest_uri]:
+            ret = virsh.domjobinfo(self.vm_name, "--completed", uri=uri,
+                                   ignore_status=True, debug=True)
+            if not ret.exit_status:
+                self.completed = parse_domjobinfo(ret.stdout_text)
+                if self.completed.get('job_type', 'None') != 'None':
+                    break
+        LOG.debug("Got %d domjobinfo samples for %s", len(self.samples),
+                  self.vm_name)
+        return self.completed
+
+    def get_report(self):
+        """
+        Get the whole report
+
+        :return: dict, with vm name, sample interval, samples and the
+                 completed job info
+        """
+        return {'vm_name': self.vm_name,
+                'interval': self.interval,
+                'samples': self.samples,
+                'completed': self.completed}
+
+    def save_report(self, result_dir, prefix=None):
+        """
+        Save the report as json and the samples as csv
+
+        :param result_dir: directory to save the files, like test.outputdir
+        :param prefix: file name prefix, default is domjobinfo_<vm_name>
+        :return: tuple, paths of the json and csv file
+        """
+        prefix = prefix or "domjobinfo_%s" % self.vm_name
+        json_file = os.path.join(result_dir, "%s.json" % prefix)
+        csv_file = os.path.join(result_dir, "%s.csv" % prefix)
+        with open(json_file, 'w') as fd:
+            json.dump(self.get_report(), fd, indent=2)
+        with open(csv_file, 'w') as fd:
+            writer = csv.DictWriter(fd, fieldnames=SAMPLE_FIELDS,
+                                    extrasaction='ignore')
+            writer.writeheader()
+            for sample in self.samples:
+                writer.writerow(sample)
+        LOG.info("Saved domjobinfo report to %s and %s", json_file, csv_file)
+        return json_file, csv_file
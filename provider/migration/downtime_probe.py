@@ -0,0 +1,244 @@
+"""
+Measure guest network downtime during migration
+
+A single long-lived ping stream with microsecond timestamps (ping -D) is
+started from every given runner against the guest before migration and
+stopped once migration is done. The gaps between the received replies
+give the downtime with a resolution of the ping interval, instead of the
+one-second resolution of spawning a new "ping -c 1" every second.
+"""
+
+import logging
+import re
+
+from avocado.utils import process
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+REPLY_PATTERN = re.compile(r'^\[(\d+\.\d+)\]\s+\d+\s+bytes\s+from\s+.*'
+                           r'icmp_seq=(\d+).*time=([\d.]+)\s*ms')
+SUMMARY_PATTERN = re.compile(r'(\d+)\s+packets transmitted,\s+(\d+)\s+'
+                             r'(?:packets\s+)?received')
+
+
+def _run_cmd(runner, cmd, timeout=60):
+    """
+    Run command by runner, or on local host if runner is None
+
+    :param runner: remote.RemoteRunner object or None
+    :param cmd: command to run
+    :param timeout: timeout of the command
+    :return: CmdResult object
+    """
+    if runner is None:
+        return process.run(cmd, shell=True, timeout=timeout,
+                           ignore_status=True)
+    return runner.run(cmd, timeout=timeout, ignore_status=True)
+
+
+def parse_ping_output(output, interval, start_time=None, end_time=None):
+    """
+    Parse the output of "ping -D" into structured results
+
+    :param output: str, output of "ping -D"
+    :param interval: float, interval between two echo requests in seconds
+    :param start_time: float, timestamp when ping was started
+    :param end_time: float, timestamp when ping was stopped
+    :return: dict, with keys:
+             'sent': number of echo requests sent,
+             'received': number of unique replies,
+             'packet_loss': lost packets in percent,
+             'downtime': the longest gap without reply minus the
+                         interval in seconds, see get_max_gap,
+             'jitter': mean difference of consecutive rtt in ms,
+             'rtt_avg': average rtt in ms,
+             'replies': list of (timestamp, seq, rtt) of unique replies
+    """
+    replies = []
+    seen_seq = set()
+    sent = 0
+    for line in output.splitlines():
+        mobj = REPLY_PATTERN.search(line.strip())
+        if mobj:
+            seq = int(mobj.group(2))
+            if seq in seen_seq:
+                continue
+            seen_seq.add(seq)
+            replies.append((float(mobj.group(1)), seq, float(mobj.group(3))))
+            continue
+        mobj = SUMMARY_PATTERN.search(line)
+        if mobj:
+            sent = int(mobj.group(1))
+    replies.sort()
+    if replies:
+        sent = max(sent, max(seq for _, seq, _ in replies))
+
+    rtts = [rtt for _, _, rtt in replies]
+    jitter = 0.0
+    if len(rtts) > 1:
+        jitter = sum(abs(rtts[i] - rtts[i - 1])
+                     for i in range(1, len(rtts))) / (len(rtts) - 1)
+    result = {'sent': sent,
+              'received': len(replies),
+              'packet_loss': (100.0 * (sent - len(replies)) / sent
+                              if sent else 100.0),
+              'downtime': get_max_gap(replies, interval, start_time,
+                                      end_time),
+              'jitter': jitter,
+              'rtt_avg': sum(rtts) / len(rtts) if rtts else 0.0,
+              'replies': replies}
+    return result
+
+
+def get_max_gap(replies, interval, start_time=None, end_time=None):
+    """
+    Get the longest period without any reply
+
+    Replies which stop before ping is stopped, e.g. the guest is lost
+    after migration, count as a gap up to end_time. Without any reply
+    the whole period from start_time to end_time is a gap.
+
+    :param replies: list of (timestamp, seq, rtt) sorted by timestamp
+    :param interval: float, interval between two echo requests in seconds
+    :param start_time: float, timestamp when ping was started
+    :param end_time: float, timestamp when ping was stopped
+    :return: float, the longest gap minus the interval in seconds
+    """
+    timestamps = [reply[0] for reply in replies]
+    if not timestamps and start_time is not None:
+        timestamps.append(start_time)
+    if end_time is not None:
+        timestamps.append(end_time)
+    max_gap = 0.0
+    for i in range(1, len(timestamps)):
+        max_gap = max(max_gap, timestamps[i] - timestamps[i - 1])
+    return max(max_gap - interval, 0.0)
+
+
+class DowntimeProbe(object):
+    """
+    Ping stream from one or more hosts to a guest during migration
+
+    :param vm_ip: ip address of the guest
+    :param runners: dict, name -> remote.RemoteRunner object, a None runner
+                    means the local host
+    :param interval: float, interval between two echo requests in seconds,
+                     values below 0.2 need root privilege
+    :param deadline: int, seconds after which ping exits by itself in case
+                     the probe is never stopped
+    """
+
+    def __init__(self, vm_ip, runners=None, interval=0.01, deadline=900):
+        self.vm_ip = vm_ip
+        self.runners = runners if runners is not None else {'local': None}
+        self.interval = float(interval)
+        self.deadline = int(deadline)
+        self.pids = {}
+        self.log_files = {}
+        self.start_times = {}
+        self.results = {}
+
+    def start(self):
+        """
+        Start ping stream on all runners
+        """
+        for name, runner in self.runners.items():
+            log_file = "/tmp/downtime_probe_%s_%s.log" % (self.vm_ip, name)
+            cmd = ("date +%%s.%%N; nohup ping -D -n -i %s -W 1 -w %d %s "
+                   "> %s 2>&1 < /dev/null & echo $!"
+                   % (self.interval, self.deadline, self.vm_ip, log_file))
+            result = _run_cmd(runner, cmd)
+            start_time, pid = result.stdout_text.split()[-2:]
+            self.start_times[name] = float(start_time)
+            LOG.debug("Started downtime probe on %s to %s, pid: %s",
+                      name, self.vm_ip, pid)
+            self.pids[name] = pid
+            self.log_files[name] = log_file
+
+    def stop(self):
+        """
+        Stop ping stream on all runners and collect the results
+
+        :return: dict, runner name -> result of parse_ping_output, plus
+                 'merged' for the replies of all runners together
+        """
+        all_replies = []
+        start_times = []
+        end_times = []
+        for name, runner in self.runners.items():
+            pid = self.pids.pop(name, None)
+            if not pid:
+                continue
+            log_file = self.log_files.pop(name)
+            # SIGINT makes ping print the statistics before exiting, the
+            # time on the runner closes a gap of replies that never resumed
+            result = _run_cmd(runner, "date +%%s.%%N; kill -INT %s; while "
+                                      "kill -0 %s 2>/dev/null; do sleep 0.1; "
+                                      "done" % (pid, pid))
+            start_time = self.start_times.pop(name)
+            # ping stops sending by itself at the deadline
+            end_time = min(float(result.stdout_text.split()[0]),
+                           start_time + self.deadline)
+            start_times.append(start_time)
+            end_times.append(end_time)
+            result = _run_cmd(runner, "cat %s; rm -f %s" % (log_file, log_file))
+            self.results[name] = parse_ping_output(
+                result.stdout_text, self.interval, start_time, end_time)
+            all_replies.extend(self.results[name]['replies'])
+            LOG.debug("Downtime probe result on %s: %s", name,
+                      self.format_result(self.results[name]))
+
+        # Timestamps from different hosts are comparable as long as
+        # their clocks are synchronized
+        if len(self.results) > 1:
+            all_replies.sort()
+            sent = sum(r['sent'] for r in self.results.values())
+            received = sum(r['received'] for r in self.results.values())
+            self.results['merged'] = {
+                'sent': sent,
+                'received': received,
+                'packet_loss': (100.0 * (sent - received) / sent
+                                if sent else 100.0),
+                'downtime': get_max_gap(all_replies, self.interval,
+                                        min(start_times), max(end_times)),
+                'jitter': max(r['jitter'] for r in self.results.values())}
+        return self.results
+
+    def get_downtime(self):
+        """
+        Get measured downtime
+
+        :return: float, downtime in seconds, None if there is no result
+        """
+        if 'merged' in self.results:
+            return self.results['merged']['downtime']
+        if self.results:
+            return min(r['downtime'] for r in self.results.values())
+        return None
+
+    def check_downtime_tolerable(self, tolerable):
+        """
+        Check whether measured downtime is tolerable
+
+        :param tolerable: float, tolerable downtime in seconds
+        :return: True if downtime is not greater than tolerable
+        """
+        downtime = self.get_downtime()
+        if downtime is None:
+            LOG.error("No downtime was measured for %s", self.vm_ip)
+            return False
+        LOG.info("Downtime of %s is %.6fs, tolerable downtime is %ss",
+                 self.vm_ip, downtime, tolerable)
+        return downtime <= float(tolerable)
+
+    @staticmethod
+    def format_result(result):
+        """
+        Format one result without the raw replies for logging
+
+        :param result: dict, result of parse_ping_output
+        :return: str, formatted result
+        """
+        return ("sent=%(sent)s received=%(received)s "
+                "loss=%(packet_loss).2f%% downtime=%(downtime).6fs "
+                "jitter=%(jitter).3fms" % result)
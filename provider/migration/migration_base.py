@@ -1,4 +1,7 @@
+import json
 import logging as log
+import math
+import os
 import types
 import re
 import signal                                        # pylint: disable=W0611
@@ -20,12 +23,21 @@ from virttest.utils_libvirt import libvirt_service   # pylint: disable=W0611
 from virttest.utils_test import libvirt_domjobinfo   # pylint: disable=W0611
 from virttest.utils_test import libvirt
 
+from provider import virsh_pool
 from provider.migration import base_steps            # pylint: disable=W0611
+from provider.migration import domjobinfo_sampler
 
 # Using as lower capital is not the best way to do, but this is just a
 # workaround to avoid changing the entire file.
 logging = log.getLogger('avocado.' + __name__)
 
+# dirtyrate.calc_status of a finished domdirtyrate-calc
+DIRTYRATE_MEASURED = "2"
+# Default max downtime of qemu in ms
+DEFAULT_MAXDOWNTIME = 300
+# Page size in bytes when domjobinfo does not report it
+DEFAULT_PAGE_SIZE = 4096
+
 
 def parse_funcs(action_during_mig, test, params):
     """
@@ -350,7 +362,8 @@ def check_auto_converge_during_mig(params):
     jobtype = "None"
 
     while throttle < max_converge:
-        cmd_result = virsh.domjobinfo(vm_name, debug=True, ignore_status=True)
+        cmd_result = virsh_pool.run("domjobinfo", vm_name, debug=True,
+                                    ignore_status=True)
         if cmd_result.exit_status:
             # Check if migration is completed
             if "domain is not running" in cmd_result.stderr:
@@ -629,3 +642,306 @@ def destroy_dest_vm(params):
     dest_uri = params.get("virsh_migrate_desturi")
     vm_name = params.get("main_vm")
     virsh.destroy(vm_name, ignore_status=False, debug=True, uri=dest_uri)
+
+
+def parse_dirtyrate(output):
+    """
+    Parse the output of virsh domstats --dirtyrate
+
+    :param output: str, output of virsh domstats --dirtyrate
+    :return: dict, with 'calc_status', 'calc_period', 'calc_mode',
+             'megabytes_per_second' and 'vcpu', the list of per vcpu dirty
+             rates in MiB/s, empty if not calculated in dirty-ring mode
+    """
+    stats = {}
+    vcpu = {}
+    for line in output.splitlines():
+        line = line.strip()
+        if not line.startswith("dirtyrate.") or "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        key = key[len("dirtyrate."):]
+        mobj = re.match(r'^vcpu\.(\d+)\.megabytes_per_second$', key)
+        if mobj:
+            vcpu[int(mobj.group(1))] = int(value)
+        elif key == "megabytes_per_second":
+            stats[key] = int(value)
+        else:
+            stats[key] = value
+    stats['vcpu'] = [vcpu[index] for index in sorted(vcpu)]
+    return stats
+
+
+def calc_dirtyrate(vm_name, seconds=1, mode=None, uri=None):
+    """
+    Calculate the dirty rate of a vm and get the result
+
+    :param vm_name: str, name of the vm
+    :param seconds: int, calculating period
+    :param mode: str, calculating mode, like 'dirty-ring', None for default
+    :param uri: connection uri
+    :return: dict returned by parse_dirtyrate(), None if calculating failed
+    """
+    options = "--seconds %s" % seconds
+    if mode:
+        options += " --mode %s" % mode
+    ret = virsh_pool.run("domdirtyrate_calc", vm_name, options=options,
+                         uri=uri, ignore_status=True, debug=False)
+    if ret.exit_status:
+        logging.debug("Failed to calculate dirty rate: %s", ret.stderr_text)
+        return None
+    stats = {}
+
+    def _is_measured():
+        ret = virsh_pool.run("domstats", vm_name, "--dirtyrate", uri=uri,
+                             ignore_status=True, debug=False)
+        if ret.exit_status:
+            return False
+        stats.update(parse_dirtyrate(ret.stdout_text))
+        return stats.get('calc_status') == DIRTYRATE_MEASURED
+    time.sleep(int(seconds))
+    if not utils_misc.wait_for(_is_measured, int(seconds) + 10, step=0.5):
+        return None
+    return stats
+
+
+def predict_convergence(memory, dirty_rate, bandwidth, max_downtime,
+                        max_iterations=30):
+    """
+    Predict a precopy migration with a constant dirty rate
+
+    Every iteration sends the memory dirtied during the previous one, the
+    migration converges when the rest can be sent within max downtime.
+
+    :param memory: float, guest memory in MiB
+    :param dirty_rate: float, dirty rate in MiB/s
+    :param bandwidth: float, migration bandwidth in MiB/s
+    :param max_downtime: float, max downtime in ms
+    :param max_iterations: int, iterations to give up converging after
+    :return: dict, with 'converge', 'iterations', predicted 'time' in
+             seconds (None if not converge) and the 'downtime' in ms
+    """
+    max_downtime = max_downtime / 1000.0
+    remaining = memory
+    elapsed = 0
+    for iteration in range(1, max_iterations + 1):
+        duration = remaining / bandwidth
+        elapsed += duration
+        remaining = min(dirty_rate * duration, memory)
+        downtime = remaining / bandwidth
+        if downtime <= max_downtime:
+            return {'converge': True, 'iterations': iteration,
+                    'time': elapsed + downtime, 'downtime': downtime * 1000}
+    return {'converge': False, 'iterations': max_iterations, 'time': None,
+            'downtime': remaining / bandwidth * 1000}
+
+
+def suggest_bandwidth(memory, dirty_rate, max_downtime, max_iterations=10,
+                      headroom=1.2):
+    """
+    Get the lowest bandwidth converging within max_iterations
+
+    :param memory: float, guest memory in MiB
+    :param dirty_rate: float, dirty rate in MiB/s
+    :param max_downtime: float, max downtime in ms
+    :param max_iterations: int, iterations the migration should converge in
+    :param headroom: float, factor for dirty rate changes
+    :return: int, bandwidth in MiB/s
+    """
+    def _converge(bandwidth):
+        return predict_convergence(memory, dirty_rate, bandwidth,
+                                   max_downtime, max_iterations)['converge']
+    low, high = 1, max(int(dirty_rate), 1)
+    while not _converge(high):
+        low, high = high, high * 2
+    while low < high:
+        middle = (low + high) // 2
+        if _converge(middle):
+            high = middle
+        else:
+            low = middle + 1
+    return int(math.ceil(high * headroom))
+
+
+class DirtyRateProfiler(object):
+    """
+    Profile the dirty rate of a vm before and during migration
+
+    The dirty rate is calculated with domdirtyrate-calc once before
+    migration to predict whether the migration converges with the
+    bandwidth and max downtime. domdirtyrate-calc needs a job of the vm
+    which can not run during migration, so during migration the dirty
+    rate reported by domjobinfo is sampled in background instead. The
+    prediction is compared with the completed job info.
+
+    :param vm_name: str, name of the migrating vm
+    :param interval: float, seconds between two samples during migration
+    :param calc_seconds: int, period of the calculation before migration
+    :param mode: str, calculating mode, like 'dirty-ring', None for default
+    :param uri: uri of the source host
+    :param dest_uri: uri of the target host
+    """
+
+    def __init__(self, vm_name, interval=5, calc_seconds=1, mode=None,
+                 uri=None, dest_uri=None):
+        self.vm_name = vm_name
+        self.interval = float(interval)
+        self.calc_seconds = int(calc_seconds)
+        self.mode = mode
+        self.uri = uri
+        self.dest_uri = dest_uri
+        self.memory = None
+        self.bandwidth = None
+        self.max_downtime = None
+        self.before = None
+        self.prediction = None
+        self.samples = []
+        self.completed = {}
+        self._sampler = None
+
+    def _get_migrate_settings(self):
+        """
+        Get guest memory, bandwidth and max downtime of the vm
+        """
+        vmxml = vm_xml.VMXML.new_from_dumpxml(self.vm_name)
+        self.memory = int(vmxml.current_mem) / 1024.0
+        ret = virsh.migrate_getspeed(self.vm_name, uri=self.uri,
+                                     ignore_status=True, debug=True)
+        self.bandwidth = (int(ret.stdout_text.strip())
+                          if not ret.exit_status else None)
+        ret = virsh.migrate_getmaxdowntime(self.vm_name, uri=self.uri,
+                                           ignore_status=True, debug=True)
+        self.max_downtime = (int(ret.stdout_text.strip())
+                             if not ret.exit_status else DEFAULT_MAXDOWNTIME)
+
+    def profile_before(self):
+        """
+        Calculate the dirty rate before migration and predict it
+
+        :return: dict returned by predict()
+        """
+        self.before = calc_dirtyrate(self.vm_name, self.calc_seconds,
+                                     self.mode, self.uri)
+        if not self.before:
+            logging.warning("Dirty rate of %s is not available",
+                            self.vm_name)
+        return self.predict()
+
+    def predict(self):
+        """
+        Predict the migration with the current migrate settings and the
+        dirty rate calculated before migration
+
+        :return: dict returned by predict_convergence() with the suggested
+                 'bandwidth', None if the dirty rate is not available
+        """
+        if not self.before:
+            return None
+        self._get_migrate_settings()
+        dirty_rate = self.before['megabytes_per_second']
+        self.prediction = {'bandwidth': suggest_bandwidth(
+            self.memory, dirty_rate, self.max_downtime)}
+        if self.bandwidth:
+            self.prediction.update(predict_convergence(
+                self.memory, dirty_rate, self.bandwidth, self.max_downtime))
+        logging.info("Dirty rate of %s is %s MiB/s (vcpu: %s), memory %.0f "
+                     "MiB, bandwidth %s MiB/s, max downtime %s ms, "
+                     "prediction: %s", self.vm_name, dirty_rate,
+                     self.before['vcpu'], self.memory, self.bandwidth,
+                     self.max_downtime, self.prediction)
+        return self.prediction
+
+    def _get_samples(self):
+        """
+        Get the dirty rate samples from the domjobinfo samples
+
+        :return: list of dicts with 'timestamp', 'pages_per_second' and
+                 'megabytes_per_second'
+        """
+        samples = []
+        for jobinfo in self._sampler.samples:
+            if 'dirty_rate' not in jobinfo:
+                continue
+            page_size = jobinfo.get('page_size') or DEFAULT_PAGE_SIZE
+            samples.append({'timestamp': jobinfo['timestamp'],
+                            'pages_per_second': jobinfo['dirty_rate'],
+                            'megabytes_per_second': round(
+                                jobinfo['dirty_rate'] * page_size /
+                                1024.0 ** 2, 2)})
+        return samples
+
+    def start(self):
+        """
+        Start sampling the dirty rate of the migration job in background
+        """
+        self._sampler = domjobinfo_sampler.DomjobinfoSampler(
+            self.vm_name, interval=self.interval, uri=self.uri,
+            dest_uri=self.dest_uri)
+        self._sampler.start()
+        logging.debug("Started dirty rate profiler for %s every %ss",
+                      self.vm_name, self.interval)
+
+    def stop(self):
+        """
+        Stop sampling and get the completed job info
+
+        :return: dict, completed job info
+        """
+        if self._sampler:
+            self.completed = self._sampler.stop()
+            self.samples = self._get_samples()
+            self._sampler = None
+        return self.completed
+
+    def get_actual(self):
+        """
+        Get the actual completion from the completed job info
+
+        :return: dict, with 'time' in seconds, 'downtime' in ms and
+                 'iterations', values are None if not available
+        """
+        time_elapsed = self.completed.get('time_elapsed')
+        return {'time': (time_elapsed / 1000.0
+                         if time_elapsed is not None else None),
+                'downtime': self.completed.get('total_downtime'),
+                'iterations': self.completed.get('iteration')}
+
+    def get_report(self):
+        """
+        Get the whole report
+
+        :return: dict, with the migrate settings, dirty rate before and
+                 during migration, the prediction and the actual completion
+        """
+        actual = self.get_actual()
+        prediction = self.prediction or {}
+        error = None
+        if prediction.get('time') and actual['time']:
+            error = (actual['time'] - prediction['time']) / prediction['time']
+        rates = [sample['megabytes_per_second'] for sample in self.samples]
+        return {'vm_name': self.vm_name,
+                'memory': self.memory,
+                'bandwidth': self.bandwidth,
+                'max_downtime': self.max_downtime,
+                'before': self.before,
+                'samples': self.samples,
+                'max_dirty_rate': max(rates) if rates else None,
+                'prediction': prediction,
+                'actual': actual,
+                'time_error': error}
+
+    def save_report(self, result_dir, file_name=None):
+        """
+        Save the report as json
+
+        :param result_dir: directory to save the file, like test.outputdir
+        :param file_name: name of the file, default is
+                          dirtyrate_<vm_name>.json
+        :return: path of the file
+        """
+        path = os.path.join(result_dir,
+                            file_name or "dirtyrate_%s.json" % self.vm_name)
+        with open(path, 'w') as fd:
+            json.dump(self.get_report(), fd, indent=2)
+        logging.info("Saved dirty rate report to %s", path)
+        return path
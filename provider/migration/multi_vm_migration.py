@@ -0,0 +1,188 @@
+"""
+Migrate many vms concurrently and report the host evacuation time
+
+Every vm is migrated by virsh migrate in a worker thread of a bounded
+pool, so at most 'concurrency' migrations are in flight, and the starts
+are spread by 'stagger' seconds. A domjobinfo sampler runs per vm, which
+gives the per vm throughput, the aggregate bandwidth over time and the
+total time to move all vms off the source host.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from virttest import virsh
+
+from provider.migration import domjobinfo_sampler
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+
+class MultiVMMigration(object):
+    """
+    Concurrent migration of a list of vms
+
+    :param vms: list of vm objects
+    :param src_uri: uri of the source host
+    :param dest_uri: uri of the target host
+    :param options: str, virsh migrate options, like '--live --p2p'
+    :param extra: str, extra virsh migrate options
+    :param concurrency: int, max migrations in flight, 0 means all vms
+    :param stagger: float, seconds between the starts of two migrations
+    :param timeout: int, timeout of every virsh migrate command
+    :param sample_interval: float, seconds between domjobinfo samples
+    """
+
+    def __init__(self, vms, src_uri, dest_uri, options='', extra='',
+                 concurrency=0, stagger=0, timeout=900, sample_interval=1):
+        self.vms = vms
+        self.src_uri = src_uri
+        self.dest_uri = dest_uri
+        self.options = options
+        self.extra = extra
+        self.concurrency = int(concurrency) or len(vms)
+        self.stagger = float(stagger)
+        self.timeout = int(timeout)
+        self.sample_interval = float(sample_interval)
+        self.results = {}
+        self.samplers = {}
+        self._lock = threading.Lock()
+        self._start_time = None
+        self._end_time = None
+
+    def _migrate_one(self, index, vm):
+        """
+        Migrate one vm after its stagger delay and record the result
+
+        :param index: int, index of the vm, decides the stagger delay
+        :param vm: vm object
+        """
+        delay = self._start_time + index * self.stagger - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        sampler = domjobinfo_sampler.DomjobinfoSampler(
+            vm.name, interval=self.sample_interval, uri=self.src_uri,
+            dest_uri=self.dest_uri)
+        start = time.time()
+        sampler.start()
+        try:
+            ret = virsh.migrate(vm.name, self.dest_uri, self.options,
+                                self.extra, uri=self.src_uri,
+                                ignore_status=True, debug=True,
+                                timeout=self.timeout)
+        finally:
+            completed = sampler.stop()
+        end = time.time()
+        duration = end - start
+        data = (completed.get('data_processed') or
+                completed.get('memory_processed') or 0)
+        result = {'status': ret.exit_status,
+                  'stderr': ret.stderr_text.strip(),
+                  'start': round(start - self._start_time, 3),
+                  'end': round(end - self._start_time, 3),
+                  'duration': round(duration, 3),
+                  'data_processed': data,
+                  'throughput': data / duration if duration else 0,
+                  'total_downtime': completed.get('total_downtime')}
+        LOG.info("Migration of %s %s in %.3fs, %.1f MiB/s", vm.name,
+                 "failed" if ret.exit_status else "finished", duration,
+                 result['throughput'] / 1024 ** 2)
+        with self._lock:
+            self.results[vm.name] = result
+            self.samplers[vm.name] = sampler
+
+    def run(self):
+        """
+        Migrate all vms and wait for them
+
+        :return: dict, vm name -> result of the vm
+        """
+        LOG.info("Migrating %d vms, %d at a time, staggered by %ss",
+                 len(self.vms), self.concurrency, self.stagger)
+        self._start_time = time.time()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self._migrate_one, index, vm)
+                       for index, vm in enumerate(self.vms)]
+            for future in futures:
+                future.result()
+        self._end_time = time.time()
+        LOG.info("Evacuated %d vms in %.3fs", len(self.vms),
+                 self.get_evacuation_time())
+        return self.results
+
+    def get_failed(self):
+        """
+        Get the vms whose migration failed
+
+        :return: list of vm names
+        """
+        return [name for name, result in self.results.items()
+                if result['status']]
+
+    def get_evacuation_time(self):
+        """
+        Get the time from the first migration start to the last end
+
+        :return: float, seconds, None before run()
+        """
+        if self._end_time is None:
+            return None
+        return self._end_time - self._start_time
+
+    def get_bandwidth_timeline(self):
+        """
+        Sum the memory bandwidth samples of all vms per second
+
+        :return: list of (second since the first start, bytes/s)
+        """
+        timeline = {}
+        for name, sampler in self.samplers.items():
+            offset = self.results[name]['start']
+            for sample in sampler.samples:
+                second = int(offset + sample['timestamp'])
+                timeline[second] = (timeline.get(second, 0) +
+                                    sample.get('memory_bandwidth', 0))
+        return sorted(timeline.items())
+
+    def get_report(self):
+        """
+        Get the whole report
+
+        :return: dict, with per vm results, evacuation time, aggregate
+                 throughput and the aggregate bandwidth timeline
+        """
+        evacuation_time = self.get_evacuation_time()
+        total_data = sum(result['data_processed']
+                         for result in self.results.values())
+        timeline = self.get_bandwidth_timeline()
+        return {'concurrency': self.concurrency,
+                'stagger': self.stagger,
+                'evacuation_time': evacuation_time,
+                'total_data_processed': total_data,
+                'aggregate_throughput': (total_data / evacuation_time
+                                         if evacuation_time else 0),
+                'peak_aggregate_bandwidth': max(
+                    [bandwidth for _, bandwidth in timeline] or [0]),
+                'bandwidth_timeline': timeline,
+                'per_vm': self.results}
+
+    def save_report(self, result_dir, file_name="multi_vm_migration.json"):
+        """
+        Save the report as json, and the domjobinfo samples of every vm
+
+        :param result_dir: directory to save the files, like test.outputdir
+        :param file_name: name of the report file
+        :return: path of the report file
+        """
+        path = os.path.join(result_dir, file_name)
+        with open(path, 'w') as fd:
+            json.dump(self.get_report(), fd, indent=2)
+        for sampler in self.samplers.values():
+            sampler.save_report(result_dir)
+        LOG.info("Saved multi vm migration report to %s", path)
+        return path
@@ -0,0 +1,236 @@
+"""
+Benchmark virsh save/restore with different save image formats
+
+Every format in save_image_format of qemu.conf is measured with several
+guest memory sizes and dirtiness levels. The guest memory is dirtied
+with random data in a tmpfs once per memory size and dirtiness, so all
+formats save the same memory content. Parallel save is measured with the
+'sparse' format and --parallel-channels.
+
+Per run, the save and restore throughput of the guest memory in MiB/s,
+the compression ratio of guest memory to image size and the host cpu
+time spent during save and restore are recorded.
+"""
+
+import logging
+import os
+
+from virttest import utils_config
+from virttest import utils_libvirtd
+from virttest import utils_misc
+from virttest import virsh
+from virttest.libvirt_xml import vm_xml
+
+from provider.libvirt_bench import bench_utils
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+DIRTY_MOUNT = '/mnt/save_bench'
+# Format supporting --parallel-channels
+PARALLEL_FORMAT = 'sparse'
+TABLE_HEADER = ("%-10s %6s %-10s %9s %9s %9s %9s %9s %7s %8s %8s" % (
+    'memory', 'dirty', 'format', 'save(s)', 'MiB/s', 'rest(s)', 'MiB/s',
+    'img(MiB)', 'ratio', 'cpu_s(s)', 'cpu_r(s)'))
+
+
+def get_host_cpu_time():
+    """
+    Get cpu time spent by the host, not idle or waiting for io
+
+    :return: float, seconds of all cpus since boot
+    """
+    with open('/proc/stat') as fd:
+        values = [int(value) for value in fd.readline().split()[1:]]
+    # user nice system idle iowait irq softirq steal ...
+    busy = sum(values[:8]) - values[3] - values[4]
+    return busy / float(os.sysconf('SC_CLK_TCK'))
+
+
+class SaveFormatBench(object):
+    """
+    Save/restore a vm with a matrix of formats, memory sizes and dirtiness
+
+    :param vm: vm object, it is started with every memory size
+    :param formats: list of save_image_format values, like ['raw', 'xz']
+    :param mem_sizes: list of guest memory sizes in KiB, empty to keep the
+                      current memory of the vm
+    :param dirty_ratios: list of percent of guest memory to dirty
+    :param parallel_channels: list of --parallel-channels counts to
+                              measure with the sparse format
+    :param save_dir: directory of the save images
+    """
+
+    def __init__(self, vm, formats, mem_sizes=None, dirty_ratios=None,
+                 parallel_channels=None, save_dir='/var/tmp'):
+        self.vm = vm
+        self.formats = formats
+        self.mem_sizes = [int(size) for size in mem_sizes or []]
+        self.dirty_ratios = [int(ratio) for ratio in dirty_ratios or [0]]
+        self.parallel_channels = [int(count) for count in
+                                  parallel_channels or []]
+        self.save_dir = save_dir
+        self.results = []
+        self.errors = []
+        self._qemu_conf = None
+        self._libvirtd = utils_libvirtd.Libvirtd()
+
+    def _set_memory(self, mem_size):
+        """
+        Restart the vm with the given memory size
+
+        :param mem_size: int, memory in KiB
+        """
+        if self.vm.is_alive():
+            self.vm.destroy()
+        vmxml = vm_xml.VMXML.new_from_inactive_dumpxml(self.vm.name)
+        vmxml.memory = mem_size
+        vmxml.current_mem = mem_size
+        vmxml.sync()
+        self.vm.start()
+
+    def _dirty_memory(self, ratio):
+        """
+        Fill ratio percent of guest memory with random data
+
+        :param ratio: int, percent of guest memory
+        """
+        session = self.vm.wait_for_login()
+        try:
+            session.cmd("umount %s; mkdir -p %s" % (DIRTY_MOUNT, DIRTY_MOUNT),
+                        ignore_all_errors=True)
+            if not ratio:
+                return
+            mem_mb = int(session.cmd_output(
+                "awk '/MemTotal/{print $2}' /proc/meminfo").strip()) // 1024
+            count = mem_mb * ratio // 100
+            session.cmd("mount -t tmpfs -o size=100%% tmpfs %s" % DIRTY_MOUNT)
+            session.cmd("dd if=/dev/urandom of=%s/dirty bs=1M count=%d" % (
+                DIRTY_MOUNT, count), timeout=max(count // 10, 120))
+        finally:
+            session.close()
+
+    def _set_format(self, save_format):
+        """
+        Set save_image_format of qemu.conf and restart libvirtd
+        """
+        if self._qemu_conf is None:
+            self._qemu_conf = utils_config.LibvirtQemuConfig()
+        self._qemu_conf.save_image_format = save_format
+        self._libvirtd.restart()
+
+    def _save_restore(self, save_format, mem_size, ratio, channels=0):
+        """
+        Save and restore the vm once and record the result
+
+        :param save_format: str, save image format
+        :param mem_size: int, guest memory in KiB
+        :param ratio: int, percent of dirtied guest memory
+        :param channels: int, --parallel-channels count, 0 for no parallel
+        """
+        name = save_format if not channels else "%s-p%d" % (save_format,
+                                                            channels)
+        options = "--parallel-channels %d" % channels if channels else ""
+        save_path = os.path.join(self.save_dir, "%s_%s_%s.save" % (
+            self.vm.name, name, utils_misc.generate_random_string(3)))
+        mem_mb = mem_size / 1024.0
+        try:
+            cpu_time = get_host_cpu_time()
+            save_result = virsh.save(self.vm.name, save_path, options,
+                                     ignore_status=True, debug=True)
+            save_cpu = get_host_cpu_time() - cpu_time
+            if save_result.exit_status:
+                self.errors.append("save with %s failed: %s" % (
+                    name, save_result.stderr_text.strip()))
+                return
+            img_size = int(utils_misc.get_image_info(save_path)['dsize'])
+            cpu_time = get_host_cpu_time()
+            restore_result = virsh.restore(save_path, options,
+                                           ignore_status=True, debug=True)
+            restore_cpu = get_host_cpu_time() - cpu_time
+            if restore_result.exit_status:
+                self.errors.append("restore with %s failed: %s" % (
+                    name, restore_result.stderr_text.strip()))
+                self.vm.start()
+                return
+        finally:
+            if os.path.exists(save_path):
+                os.remove(save_path)
+        result = {'format': name,
+                  'memory': mem_size,
+                  'dirty_ratio': ratio,
+                  'save_time': save_result.duration,
+                  'save_throughput': mem_mb / save_result.duration,
+                  'restore_time': restore_result.duration,
+                  'restore_throughput': mem_mb / restore_result.duration,
+                  'image_size': img_size,
+                  'compression_ratio': mem_size * 1024.0 / img_size,
+                  'save_cpu_time': save_cpu,
+                  'restore_cpu_time': restore_cpu}
+        LOG.info("%s with %d MiB memory, %d%% dirty: save %.1f MiB/s, "
+                 "restore %.1f MiB/s, ratio %.2f", name, mem_mb, ratio,
+                 result['save_throughput'], result['restore_throughput'],
+                 result['compression_ratio'])
+        self.results.append(result)
+        self.vm.wait_for_login().close()
+
+    def run(self):
+        """
+        Run the whole matrix
+        """
+        mem_sizes = self.mem_sizes
+        if not mem_sizes:
+            vmxml = vm_xml.VMXML.new_from_inactive_dumpxml(self.vm.name)
+            mem_sizes = [int(vmxml.current_mem)]
+        try:
+            for mem_size in mem_sizes:
+                if self.mem_sizes or not self.vm.is_alive():
+                    self._set_memory(mem_size)
+                for ratio in self.dirty_ratios:
+                    self._dirty_memory(ratio)
+                    for save_format in self.formats:
+                        self._set_format(save_format)
+                        self._save_restore(save_format, mem_size, ratio)
+                    if self.parallel_channels:
+                        self._set_format(PARALLEL_FORMAT)
+                    for channels in self.parallel_channels:
+                        self._save_restore(PARALLEL_FORMAT, mem_size, ratio,
+                                           channels)
+        finally:
+            if self._qemu_conf is not None:
+                self._qemu_conf.restore()
+                self._libvirtd.restart()
+        LOG.info("Save/restore format comparison:\n%s", self.format_table())
+
+    def format_table(self):
+        """
+        Format the results as a text table
+
+        :return: str, the table
+        """
+        lines = [TABLE_HEADER]
+        for result in self.results:
+            lines.append(
+                "%-10d %5d%% %-10s %9.2f %9.1f %9.2f %9.1f %9.1f %7.2f "
+                "%8.2f %8.2f" % (
+                    result['memory'] // 1024, result['dirty_ratio'],
+                    result['format'], result['save_time'],
+                    result['save_throughput'], result['restore_time'],
+                    result['restore_throughput'],
+                    result['image_size'] / 1024.0 ** 2,
+                    result['compression_ratio'], result['save_cpu_time'],
+                    result['restore_cpu_time']))
+        return "\n".join(lines)
+
+    def save(self, result_dir, file_name='save_format_bench'):
+        """
+        Save the results as json and the table as text
+
+        :param result_dir: directory to save the files, like test.outputdir
+        :param file_name: file name without extension
+        :return: path of the json file
+        """
+        with open(os.path.join(result_dir, "%s.txt" % file_name), 'w') as fd:
+            fd.write(self.format_table() + "\n")
+        return bench_utils.save_json({'results': self.results,
+                                      'errors': self.errors},
+                                     result_dir, "%s.json" % file_name)
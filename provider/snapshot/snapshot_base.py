@@ -8,10 +8,11 @@
 #   Author: Dan Zheng <dzheng@redhat.com>
 #
 
-from virttest import virsh
 from virttest.libvirt_xml import snapshot_xml
 from virttest.utils_test import libvirt
 
+from provider import virsh_pool
+
 
 class SnapshotTest(object):
     """
@@ -32,9 +33,9 @@ class SnapshotTest(object):
         :param expect_exist: boolean, True if expect the snapshot exist,
                                       otherswise, False
         """
-        snap_names = virsh.snapshot_list(self.vm.name,
-                                         options=options,
-                                         **self.virsh_dargs)
+        snap_names = virsh_pool.run("snapshot_list", self.vm.name,
+                                    options=options,
+                                    **self.virsh_dargs)
         actual_result = snap_name in snap_names
         if expect_exist != actual_result:
             self.test.fail("The snapshot '%s' should '%s' "
@@ -59,8 +60,10 @@ class SnapshotTest(object):
         snap_obj.set_disks(snap_disks)
         snap_file = snap_obj.xml
         snap_options = " %s %s" % (snap_file, options)
-        virsh.snapshot_create(self.vm.name, snap_options, **self.virsh_dargs)
-        virsh.snapshot_dumpxml(self.vm.name, snap_dict['snap_name'], **self.virsh_dargs)
+        virsh_pool.run("snapshot_create", self.vm.name, snap_options,
+                       **self.virsh_dargs)
+        virsh_pool.run("snapshot_dumpxml", self.vm.name,
+                       snap_dict['snap_name'], **self.virsh_dargs)
 
     def delete_snapshot(self, snap_names, options=''):
         """
@@ -72,10 +75,10 @@ class SnapshotTest(object):
         if isinstance(snap_names, str):
             snap_names = [snap_names]
         for snap_name in snap_names:
-            virsh.snapshot_delete(self.vm.name,
-                                  snap_name,
-                                  options=options,
-                                  **self.virsh_dargs)
+            virsh_pool.run("snapshot_delete", self.vm.name,
+                           snap_name,
+                           options=options,
+                           **self.virsh_dargs)
 
     def teardown_test(self):
         """
@@ -0,0 +1,141 @@
+"""
+Cached libosinfo short-id to long-id index
+
+osinfo-query reads the whole osinfo database for every call. The mapping
+of short ids to long ids is queried once per database version, saved to
+a json file in the avocado-vt data dir, shared by all test processes and
+jobs, and kept in memory afterwards.
+"""
+
+import fcntl
+import json
+import logging
+import os
+
+from avocado.utils import process
+
+from virttest import data_dir
+
+LOG = logging.getLogger('avocado.v2v.' + __name__)
+
+# Default locations of the osinfo database, same as libosinfo
+OSINFO_DB_DIRS = ['/usr/share/osinfo', '/etc/osinfo',
+                  os.path.expanduser('~/.config/osinfo')]
+OSINFO_DB_ENVS = ['OSINFO_SYSTEM_DIR', 'OSINFO_LOCAL_DIR', 'OSINFO_USER_DIR']
+
+# In memory index: {'version': str, 'ids': {short_id: long_id}}
+_INDEX = {}
+
+
+def get_db_version():
+    """
+    Get the version of the osinfo database on host
+
+    The VERSION file of osinfo-db is used if it exists, the mtime of the
+    database dirs is used otherwise, so a new or updated database is
+    always detected.
+
+    :return: str, the version key of the database
+    """
+    db_dirs = [os.environ[env] for env in OSINFO_DB_ENVS if env in os.environ]
+    versions = []
+    for db_dir in db_dirs + OSINFO_DB_DIRS:
+        if not os.path.isdir(db_dir):
+            continue
+        version_file = os.path.join(db_dir, 'VERSION')
+        if os.path.isfile(version_file):
+            with open(version_file) as fd:
+                versions.append('%s:%s' % (db_dir, fd.read().strip()))
+            continue
+        mtimes = [os.path.getmtime(db_dir)]
+        os_dir = os.path.join(db_dir, 'os')
+        if os.path.isdir(os_dir):
+            mtimes.extend(os.path.getmtime(os.path.join(os_dir, name))
+                          for name in os.listdir(os_dir))
+        versions.append('%s:%s' % (db_dir, max(mtimes)))
+    return ';'.join(versions)
+
+
+def query_ids():
+    """
+    Query all short ids and long ids from osinfo database
+
+    :return: dict, short_id -> long_id, empty if the query failed
+    """
+    cmd = 'osinfo-query os --fields=short-id,id'
+    # Too much debug output if verbose is True
+    result = process.run(cmd, timeout=60, shell=True, ignore_status=True,
+                         verbose=False)
+    if result.exit_status:
+        LOG.warning("Failed to query osinfo database: %s",
+                    result.stderr_text.strip())
+        return {}
+    ids = {}
+    # Skip the header and the separator line
+    for line in result.stdout_text.splitlines()[2:]:
+        if '|' not in line:
+            continue
+        short_id, long_id = [item.strip() for item in line.split('|', 1)]
+        if short_id and long_id:
+            ids[short_id] = long_id
+    return ids
+
+
+def _load_index(index_file, version):
+    """
+    Load the index from index_file if it matches version
+
+    :return: dict of ids, or None if the file is missing, stale or empty
+    """
+    if not os.path.exists(index_file):
+        return None
+    try:
+        with open(index_file) as fd:
+            index = json.load(fd)
+    except ValueError:
+        return None
+    if index.get('version') != version or not index.get('ids'):
+        return None
+    return index['ids']
+
+
+def get_index(index_file=None):
+    """
+    Get the short id to long id index, build it if it is missing or stale
+
+    :param index_file: path of the json index file shared by processes
+    :return: dict, short_id -> long_id
+    """
+    version = get_db_version()
+    if _INDEX.get('version') == version:
+        return _INDEX['ids']
+    index_file = index_file or os.path.join(data_dir.get_data_dir(),
+                                            'osinfo_index.json')
+    with open(index_file + '.lock', 'w') as lock_fd:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        try:
+            ids = _load_index(index_file, version)
+            if ids is None:
+                LOG.info("Building osinfo index for database %s", version)
+                ids = query_ids()
+                if not ids:
+                    # Not saved, the next call queries again
+                    return ids
+                tmp_file = index_file + '.tmp'
+                with open(tmp_file, 'w') as fd:
+                    json.dump({'version': version, 'ids': ids}, fd)
+                os.rename(tmp_file, index_file)
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+    _INDEX.update({'version': version, 'ids': ids})
+    return ids
+
+
+def get_long_id(short_id):
+    """
+    Get the long id of a short id
+
+    :param short_id: short id of an OS, e.g. rhel8.6
+    :return: str, the long id, None if the short id is not in the database
+    """
+    return get_index().get(short_id)
@@ -26,6 +26,8 @@ from virttest import utils_misc
 from virttest import xml_utils
 from virttest.libvirt_xml import vm_xml
 
+from provider import v2v_osinfo
+
 LOG = logging.getLogger('avocado.v2v.' + __name__)
 
 RETRY_TIMES = 10
@@ -63,6 +65,88 @@ def compare_version(compare_version, real_version=None, cmd=None):
     return False
 
 
+class VMXMLIndex(object):
+
+    """
+    Domain XML parsed once, with devices indexed by tag
+
+    XPath results are cached, so checking many expectations on the same
+    XML does not parse it or walk the tree again.
+    """
+
+    def __init__(self, xml_str=None, xml_file=None):
+        if xml_file:
+            self.root = ET.parse(xml_file).getroot()
+        else:
+            self.root = ET.fromstring(xml_str)
+        self._xpath_cache = {}
+        self._devices = {}
+        devices = self.root.find('devices')
+        for dev in (devices if devices is not None else []):
+            self._devices.setdefault(dev.tag, []).append(dev)
+
+    def findall(self, xpath):
+        """
+        Find all elements matching xpath, results are cached
+
+        :param xpath: ElementTree XPath relative to the domain element
+        :return: list of elements
+        """
+        if xpath not in self._xpath_cache:
+            self._xpath_cache[xpath] = self.root.findall(xpath)
+        return self._xpath_cache[xpath]
+
+    def find_devices(self, tag, **attrs):
+        """
+        Find devices by tag and attribute values
+
+        :param tag: device tag, e.g. 'disk', 'graphics'
+        :param attrs: attributes the devices must have, e.g. type='vnc'
+        :return: list of device elements
+        """
+        return [dev for dev in self._devices.get(tag, [])
+                if all(dev.get(key) == value for key, value in attrs.items())]
+
+    def get_device_attr(self, tag, attr, sub_tag=None):
+        """
+        Get an attribute of the first device with tag
+
+        :param tag: device tag, e.g. 'video'
+        :param attr: attribute name
+        :param sub_tag: get the attribute of this child element instead,
+                        e.g. 'model' of video
+        :return: value of the attribute, None if not found
+        """
+        for dev in self._devices.get(tag, []):
+            elem = dev.find(sub_tag) if sub_tag else dev
+            if elem is not None:
+                return elem.get(attr)
+        return None
+
+    def check(self, expectations):
+        """
+        Evaluate a list of XPath expectations in one pass
+
+        :param expectations: list of (xpath, existence) or
+                             (xpath, existence, err_msg) tuples, existence is
+                             True if xpath must be found, False if it must not
+        :return: list of error messages of the failed expectations
+        """
+        errors = []
+        for expectation in expectations:
+            xpath, existence = expectation[:2]
+            LOG.info("Checking %s configuration in VM XML", xpath)
+            if bool(self.findall(xpath)) == bool(existence):
+                continue
+            if len(expectation) > 2:
+                errors.append(expectation[2])
+            elif existence:
+                errors.append("Not found %s" % xpath)
+            else:
+                errors.append("Found %s unexpectedly" % xpath)
+        return errors
+
+
 class VMChecker(object):
 
     """
@@ -74,6 +158,7 @@ class VMChecker(object):
         self.params = params
         self.vmxml = ''
         self.xmltree = None
+        self._xml_index = None
         self.vm_name = params.get('main_vm')
         self.v2v_cmd = params.get('v2v_command', '')
         self.original_vm_name = params.get('original_vm_name')
@@ -214,6 +299,15 @@ class VMChecker(object):
                 raise
             LOG.debug('Failed to dumpxml: %s', str(e))
 
+    @property
+    def xml_index(self):
+        """
+        VMXMLIndex of self.vmxml, parsed on first use
+        """
+        if self._xml_index is None:
+            self._xml_index = VMXMLIndex(self.vmxml)
+        return self._xml_index
+
     def run(self):
         self.init_vmxml()
         self.check_metadata_libosinfo()
@@ -411,27 +505,10 @@ class VMChecker(object):
             """
             Convert short_id to long_id
             """
-            cmd = 'osinfo-query os --fields=short-id | tail -n +3'
-            # Too much debug output if verbose is True
-            output = process.run(
-                cmd,
-                timeout=20,
-                shell=True,
-                ignore_status=True,
-                verbose=False)
-            short_id_all = output.stdout_text.splitlines()
-            if short_id not in [os_id.strip() for os_id in short_id_all]:
+            long_id = v2v_osinfo.get_long_id(short_id)
+            if not long_id:
                 LOG.info("Not found shourt_id '%s' on host", short_id)
                 long_id = _guess_long_id(short_id)
-            else:
-                cmd = "osinfo-query os --fields=id short-id='%s'| tail -n +3" % short_id
-                output = process.run(
-                    cmd,
-                    timeout=20,
-                    verbose=True,
-                    shell=True,
-                    ignore_status=True)
-                long_id = output.stdout_text.strip()
 
             return long_id
 
@@ -587,8 +664,7 @@ class VMChecker(object):
         LOG.info("Checking graphic type in VM XML")
         expect_graphic = self.get_expect_graphic_type()
         LOG.info("Expect type: %s", expect_graphic)
-        pattern = r"<graphics type='(\w+)'"
-        vmxml_graphic_type = re.search(pattern, self.vmxml).group(1)
+        vmxml_graphic_type = self.xml_index.get_device_attr('graphics', 'type')
         if vmxml_graphic_type != expect_graphic:
             err_msg = "Not find %s type graphic in VM XML" % expect_graphic
             self.log_err(err_msg)
@@ -596,8 +672,8 @@ class VMChecker(object):
         LOG.info("Checking video model type in VM XML")
         expect_video = self.get_expect_video_model()
         LOG.info("Expect driver: %s", expect_video)
-        pattern = r"<video>\s+<model type='(\w+)'"
-        vmxml_video_type = re.search(pattern, self.vmxml).group(1)
+        vmxml_video_type = self.xml_index.get_device_attr(
+            'video', 'type', sub_tag='model')
         if vmxml_video_type != expect_video:
             err_msg = "Not find %s type video in VM XML" % expect_video
             self.log_err(err_msg)
@@ -605,39 +681,41 @@ class VMChecker(object):
         LOG.info("Checking boot os info in VM XML")
         chipset, bootinfo, _ = self.get_expected_boottype(self.boottype)
 
-        chip_pattern = r"machine='pc-%s" % ('q35' if chipset ==
-                                            'q35' else 'i440fx')
+        machine = 'pc-%s' % ('q35' if chipset == 'q35' else 'i440fx')
+        boot_ok = any(os_type.get('machine', '').startswith(machine)
+                      for os_type in self.xml_index.findall('./os/type'))
         if bootinfo == 'uefi':
-            boot_pattern = r"type='pflash'"
-        else:
-            boot_pattern = None
-
-        pattern_list = [chip_pattern, boot_pattern]
-        if not all([re.search(pattern_i, self.vmxml)
-                    for pattern_i in pattern_list if pattern_i]):
+            boot_ok = boot_ok and bool(
+                self.xml_index.findall("./os/loader[@type='pflash']"))
+        if not boot_ok:
             err_msg = "Checking boot os info failed"
             self.log_err(err_msg)
 
-        root = ET.fromstring(self.vmxml)
-
+        # The left checks are XPath expectations evaluated in one batch
+        expectations = []
         LOG.info("Checking cache='none' not existing in VM XML")
         if self.target == 'libvirt' and compare_version(
                 FEATURE_SUPPORT['cache_none']):
-            err_msg = "Checking cache='none' not existing failed"
-            for disk in root.findall("./devices/disk/driver[@cache]"):
-                if disk.get('cache') == 'none':
-                    self.log_err(err_msg)
+            expectations.append(("./devices/disk/driver[@cache='none']", False,
+                                 "Checking cache='none' not existing failed"))
 
         LOG.info("Checking model='virtio-transitional' not existing in VM XML")
         if self.os_type == 'windows' and self.target == 'libvirt' and compare_version(
                 FEATURE_SUPPORT['virtio_model']):
             err_msg = "Checking model='virtio-transitional' not existing failed"
-            if root.findall(
-                    ".//*[@model='virtio-transitional']") or root.findall(".//*[@type='virtio-transitional']"):
-                self.log_err(err_msg)
+            expectations.append((".//*[@model='virtio-transitional']", False,
+                                 err_msg))
+            expectations.append((".//*[@type='virtio-transitional']", False,
+                                 err_msg))
 
         if self.vsock_check_enabled() and self.is_vsock_supported(self.os_version):
-            self.check_xml('./devices/vsock')
+            expectations.append(('./devices/vsock', True))
+
+        # Report the same error only once
+        errors = self.check_xml_batch(expectations, log_error=False)
+        for index, err_msg in enumerate(errors):
+            if err_msg not in errors[:index]:
+                self.log_err(err_msg)
 
     def check_xml(self, xpath, existence=True):
         """
@@ -646,14 +724,21 @@ class VMChecker(object):
         :param existence: By default, it checks the existence of the XPath,
             if False, it checks the non-existence of the XPath.
         """
-        root = ET.fromstring(self.vmxml)
-        LOG.info("Checking %s configuration in VM XML", xpath)
-        if existence and not root.findall(xpath):
-            err_msg = "Not found %s" % xpath
-            self.log_err(err_msg)
-        if not existence and root.findall(xpath):
-            err_msg = "Found %s unexpectedly" % xpath
-            self.log_err(err_msg)
+        self.check_xml_batch([(xpath, existence)])
+
+    def check_xml_batch(self, expectations, log_error=True):
+        """
+        Checking a list of XPath expectations on the parsed VM XML
+        :param expectations: list of (xpath, existence) or
+            (xpath, existence, err_msg) tuples, see VMXMLIndex.check.
+        :param log_error: True to record the errors by log_err.
+        :return: list of error messages of the failed expectations.
+        """
+        errors = self.xml_index.check(expectations)
+        if log_error:
+            for err_msg in errors:
+                self.log_err(err_msg)
+        return errors
 
     def check_linux_vm(self):
         """
@@ -992,11 +1077,11 @@ def check_local_output(params):
     elif compare_version(FEATURE_SUPPORT['cache_none']):
         # Check 'cache_none' in xml file
         LOG.info("Checking cache='none' not exist in %s" % xml_file)
-        root = ET.parse(xml_file).getroot()
-        for disk in root.findall("./devices/disk/driver[@cache]"):
-            if disk.get('cache') == 'none':
-                result = False
-                break
+        errors = VMXMLIndex(xml_file=xml_file).check(
+            [("./devices/disk/driver[@cache='none']", False)])
+        for err_msg in errors:
+            LOG.error(err_msg)
+            result = False
 
     return result
 
@@ -0,0 +1,250 @@
+"""
+Pool of persistent virsh sessions shared by provider helpers
+
+Every virsh.* call forks a new virsh process and connects to libvirt
+again, which dominates the cost of polling loops. This module keeps a few
+virsh.VirshPersistent sessions per connection uri and runs virsh functions
+through them, e.g.:
+
+    virsh_pool.run("domstats", vm_name, "--block", debug=True)
+    virsh_pool.run("domjobinfo", vm_name, uri=dest_uri, ignore_status=True)
+
+If no session can be used, the call falls back to the plain virsh function,
+so results are the same as calling virsh.* directly. Once a command was
+sent to a session it is never run again: a session broken meanwhile, like
+on a timeout, raises its error, since the command may have been done.
+"""
+
+import atexit
+import logging
+import threading
+import time
+
+import aexpect
+
+from virttest import virsh
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+# Max sessions per uri, more concurrent callers fall back to virsh.*
+POOL_SIZE = 3
+# Sessions idle for longer than this are checked before being reused
+HEALTH_CHECK_IDLE = 30
+# dargs that persistent sessions can not honor
+UNSUPPORTED_DARGS = ('unprivileged_user', 'readonly', 'virsh_opt',
+                     'virsh_exec', 'session_id')
+# dargs used to open a session to a remote host
+REMOTE_DARGS = ('remote_ip', 'remote_user', 'remote_pwd')
+
+SESSION_ERRORS = (aexpect.ShellError, aexpect.ExpectError)
+
+
+class VirshSessionPool(object):
+    """
+    Persistent virsh sessions keyed by connection uri
+
+    :param size: int, max sessions per uri
+    """
+
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self.enabled = True
+        self._lock = threading.Lock()
+        # uri -> list of (VirshPersistent, last used time)
+        self._idle = {}
+        # uri -> number of sessions, idle and in use
+        self._count = {}
+        self.stats = {'pooled': 0, 'fallback': 0, 'reconnect': 0}
+
+    def _add_stat(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    @staticmethod
+    def _is_healthy(virsh_instance, check_cmd=True):
+        """
+        Check whether the session is alive and responds
+
+        :param virsh_instance: VirshPersistent object
+        :param check_cmd: True to also run a command in the session
+        :return: True if the session is usable
+        """
+        try:
+            session_id = virsh_instance.session_id
+            session = virsh.VirshSession(a_id=session_id)
+            if not session.is_alive():
+                return False
+            return not check_cmd or session.cmd_status("uri",
+                                                       timeout=10) == 0
+        except (KeyError, AttributeError) + SESSION_ERRORS:
+            return False
+
+    def _connect(self, uri, remote_args):
+        """
+        Open a new persistent session
+
+        :param uri: connection uri, None for the default one
+        :param remote_args: dict, remote_ip/remote_user/remote_pwd for
+                            remote uri needing password
+        :return: VirshPersistent object
+        """
+        dargs = {'uri': uri}
+        dargs.update(remote_args)
+        LOG.debug("Open persistent virsh session to %s", uri or "default uri")
+        return virsh.VirshPersistent(**dargs)
+
+    def acquire(self, uri=None, **remote_args):
+        """
+        Get a healthy session for uri
+
+        :param uri: connection uri, None for the default one
+        :param remote_args: remote_ip/remote_user/remote_pwd
+        :return: VirshPersistent object, or None if all sessions are busy
+                 or no session can be opened
+        """
+        with self._lock:
+            idle = self._idle.setdefault(uri, [])
+            if idle:
+                virsh_instance, last_used = idle.pop()
+            elif self._count.get(uri, 0) < self.size:
+                self._count[uri] = self._count.get(uri, 0) + 1
+                virsh_instance, last_used = None, None
+            else:
+                return None
+        try:
+            if virsh_instance is None:
+                virsh_instance = self._connect(uri, remote_args)
+            elif not self._is_healthy(
+                    virsh_instance,
+                    time.time() - last_used > HEALTH_CHECK_IDLE):
+                self._add_stat('reconnect')
+                virsh_instance.new_session()
+        except Exception as detail:
+            LOG.debug("Failed to get persistent virsh session to %s: %s",
+                      uri, detail)
+            self.discard(virsh_instance, uri)
+            return None
+        return virsh_instance
+
+    def release(self, virsh_instance, uri=None):
+        """
+        Give a session back to the pool
+
+        :param virsh_instance: VirshPersistent object from acquire()
+        :param uri: the uri it was acquired for
+        """
+        with self._lock:
+            self._idle.setdefault(uri, []).append((virsh_instance,
+                                                   time.time()))
+
+    def discard(self, virsh_instance, uri=None):
+        """
+        Close a broken session and free its slot
+
+        :param virsh_instance: VirshPersistent object or None
+        :param uri: the uri it was acquired for
+        """
+        if virsh_instance is not None:
+            try:
+                virsh_instance.close_session()
+            except SESSION_ERRORS:
+                pass
+        with self._lock:
+            self._count[uri] = max(self._count.get(uri, 1) - 1, 0)
+
+    def run(self, func_name, *args, **dargs):
+        """
+        Run virsh.<func_name> through a pooled session
+
+        :param func_name: str, name of the virsh function, like 'domstats'
+        :param args: positional args of the virsh function
+        :param dargs: keyword args of the virsh function, 'uri' and
+                      remote_ip/remote_user/remote_pwd select the session
+        :return: what the virsh function returns
+        :raise: aexpect.ShellError or aexpect.ExpectError if the session
+                broke after the command was sent
+        """
+        func = getattr(virsh, func_name)
+        if not self.enabled or any(dargs.get(key) for key in
+                                   UNSUPPORTED_DARGS):
+            self._add_stat('fallback')
+            return func(*args, **dargs)
+
+        uri = dargs.pop('uri', None)
+        remote_args = dict((key, dargs.pop(key)) for key in REMOTE_DARGS
+                           if key in dargs)
+        # acquire() checks the session is alive, the command is not sent
+        # yet, so falling back is safe
+        virsh_instance = self.acquire(uri, **remote_args)
+        if virsh_instance is None:
+            self._add_stat('fallback')
+            return func(*args, uri=uri, **dict(dargs, **remote_args))
+
+        broken = False
+        try:
+            result = getattr(virsh_instance, func_name)(*args, **dargs)
+            self._add_stat('pooled')
+            return result
+        except SESSION_ERRORS as detail:
+            # The command may have been run, e.g. on a timeout, running
+            # it again is not safe for commands like snapshot-create
+            LOG.debug("Persistent virsh session to %s broken while "
+                      "running %s: %s", uri, func_name, detail)
+            broken = True
+            raise
+        finally:
+            # Other errors, like CmdError of ignore_status=False, leave
+            # the session usable
+            if broken:
+                self.discard(virsh_instance, uri)
+            else:
+                self.release(virsh_instance, uri)
+
+    def close(self):
+        """
+        Close all sessions in the pool
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+            self._count = {}
+        for sessions in idle.values():
+            for virsh_instance, _ in sessions:
+                try:
+                    virsh_instance.close_session()
+                except SESSION_ERRORS:
+                    pass
+        LOG.debug("Closed virsh session pool, stats: %s", self.stats)
+
+
+_POOL = VirshSessionPool()
+atexit.register(_POOL.close)
+
+
+def run(func_name, *args, **dargs):
+    """
+    Run virsh.<func_name> through the shared session pool
+
+    :param func_name: str, name of the virsh function, like 'domstats'
+    :param args: positional args of the virsh function
+    :param dargs: keyword args of the virsh function
+    :return: what the virsh function returns
+    """
+    return _POOL.run(func_name, *args, **dargs)
+
+
+def set_enabled(enabled):
+    """
+    Enable or disable the shared pool, disabled pool runs plain virsh.*
+
+    :param enabled: bool
+    """
+    _POOL.enabled = enabled
+    if not enabled:
+        _POOL.close()
+
+
+def close():
+    """
+    Close all sessions of the shared pool
+    """
+    _POOL.close()
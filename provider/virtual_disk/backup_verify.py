@@ -0,0 +1,267 @@
+"""
+Verify backup images against the original disk on their extents only
+
+Converting the whole original disk to a new image and comparing it with
+every backup reads and writes the full disk each round. Here the
+allocation of the images is taken from 'qemu-img map', and the guest
+data is read directly from the host files at the offsets qemu-img
+reports, so:
+
+- only the extents allocated in a backup are compared, for incremental
+  backups these are the ranges dirty in the exported bitmap, the rest
+  is skipped without reading it
+- ranges reported as zero are not read, they are compared as zeros
+- reads are done in large chunks aligned to the chunk size
+- the original disk is mapped once and the backups are verified in
+  parallel on a thread pool
+
+An image which can not be read through its host files (compressed or
+encrypted clusters, network storage) raises UnmappedExtentError, a
+local copy of an original disk like that is made with qemu-img convert.
+"""
+
+import bisect
+import json
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+from avocado.utils import process
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+CHUNK_SIZE = 4 * 1024 * 1024
+# Formats where qemu-img map offsets point to plain guest data
+MAPPABLE_FORMATS = ('qcow2', 'raw')
+ZEROS = bytes(CHUNK_SIZE)
+
+
+class UnmappedExtentError(Exception):
+    """
+    Data of an image can not be read from its host files
+    """
+    pass
+
+
+def _run_json(cmd):
+    return json.loads(process.run(cmd, shell=True, verbose=False,
+                                  ignore_status=False).stdout_text)
+
+
+class ImageMap(object):
+    """
+    Guest ranges of an image and where their data is on the host
+
+    :param extents: list of dicts of 'qemu-img map --output=json'
+    :param layers: list of dicts of 'qemu-img info --backing-chain
+                   --output=json', the image first
+    :raise: UnmappedExtentError if any data can not be read from a file
+    """
+
+    def __init__(self, extents, layers):
+        self.extents = sorted(extents, key=lambda extent: extent['start'])
+        self.files = []
+        for layer in layers:
+            filename = layer['filename']
+            if (layer.get('format') not in MAPPABLE_FORMATS or
+                    not os.path.exists(filename)):
+                raise UnmappedExtentError("%s (%s) is not a local qcow2 or "
+                                          "raw file" % (filename,
+                                                        layer.get('format')))
+            self.files.append(filename)
+        for extent in self.extents:
+            if extent['data'] and 'offset' not in extent:
+                raise UnmappedExtentError(
+                    "Data at %d of %s has no host offset, it may be "
+                    "compressed" % (extent['start'], self.files[0]))
+        self._starts = [extent['start'] for extent in self.extents]
+        self.size = (self.extents[-1]['start'] + self.extents[-1]['length']
+                     if self.extents else 0)
+
+    @classmethod
+    def from_image(cls, image, image_format=None):
+        """
+        Map an image with qemu-img
+
+        :param image: str, path of the image
+        :param image_format: str, format of the image, probed if None
+        :return: ImageMap
+        """
+        fmt = " -f %s" % image_format if image_format else ""
+        layers = _run_json("qemu-img info -U --backing-chain --output=json"
+                           "%s %s" % (fmt, image))
+        if isinstance(layers, dict):
+            layers = [layers]
+        extents = _run_json("qemu-img map -U --output=json%s %s"
+                            % (fmt, image))
+        return cls(extents, layers)
+
+    def get_allocated(self):
+        """
+        Get the ranges allocated in the image itself, not its backing
+
+        :return: list of (start, length, is_zero)
+        """
+        return [(extent['start'], extent['length'], not extent['data'])
+                for extent in self.extents
+                if extent.get('depth', 0) == 0 and
+                extent.get('present', extent['data'])]
+
+    def iter_ranges(self, start, end):
+        """
+        Iterate where the data of the guest range [start, end) is
+
+        Ranges after the end of the image read as zeros.
+
+        :return: generator of (length, path, host_offset), path is None
+                 for zeros
+        """
+        index = max(bisect.bisect_right(self._starts, start) - 1, 0)
+        pos = start
+        while pos < end:
+            if index >= len(self.extents):
+                yield end - pos, None, None
+                return
+            extent = self.extents[index]
+            extent_end = extent['start'] + extent['length']
+            if extent_end <= pos:
+                index += 1
+                continue
+            length = min(extent_end, end) - pos
+            if extent['data']:
+                yield (length, self.files[extent.get('depth', 0)],
+                       extent['offset'] + pos - extent['start'])
+            else:
+                yield length, None, None
+            pos += length
+            index += 1
+
+    def read(self, fds, start, length):
+        """
+        Read guest data of the image
+
+        :param fds: dict, path -> fd, files are opened on demand
+        :param start: int, guest offset
+        :param length: int, bytes to read, up to CHUNK_SIZE
+        :return: bytes
+        """
+        pieces = []
+        for size, path, host_offset in self.iter_ranges(start,
+                                                        start + length):
+            if path is None:
+                pieces.append(ZEROS[:size])
+                continue
+            if path not in fds:
+                fds[path] = os.open(path, os.O_RDONLY)
+            data = os.pread(fds[path], size, host_offset)
+            if len(data) < size:
+                # Preallocated tail of a raw file
+                data += ZEROS[:size - len(data)]
+            pieces.append(data)
+        return pieces[0] if len(pieces) == 1 else b''.join(pieces)
+
+
+def _iter_chunks(start, length, chunk_size=CHUNK_SIZE):
+    """
+    Split a range at the multiples of chunk_size
+    """
+    pos = start
+    end = start + length
+    while pos < end:
+        chunk_end = min((pos // chunk_size + 1) * chunk_size, end)
+        yield pos, chunk_end - pos
+        pos = chunk_end
+
+
+def compare_backup(original_map, backup_map, name=None):
+    """
+    Compare the allocated extents of a backup with the original image
+
+    :param original_map: ImageMap of the original disk
+    :param backup_map: ImageMap of the backup
+    :param name: str, name of the backup in the result
+    :return: dict with 'backup', 'identical', 'compared' and 'skipped'
+             bytes and 'mismatch', the guest offset of the first differing
+             chunk or None
+    """
+    result = {'backup': name or backup_map.files[0], 'identical': True,
+              'compared': 0, 'skipped': 0, 'mismatch': None}
+    fds = {}
+    try:
+        for start, length, is_zero in backup_map.get_allocated():
+            for pos, size in _iter_chunks(start, length):
+                original = original_map.read(fds, pos, size)
+                if is_zero:
+                    backup = ZEROS[:size]
+                else:
+                    backup = backup_map.read(fds, pos, size)
+                result['compared'] += size
+                if original != backup:
+                    result.update({'identical': False, 'mismatch': pos})
+                    LOG.debug("%s differs from the original in the %d bytes "
+                              "at %d", result['backup'], size, pos)
+                    return result
+    finally:
+        for fd in fds.values():
+            os.close(fd)
+    size = max(original_map.size, backup_map.size)
+    result['skipped'] = size - result['compared']
+    return result
+
+
+def _get_original_map(original, original_format, tmp_dir):
+    """
+    Map the original disk, make a local copy if it is not mappable
+    """
+    try:
+        return ImageMap.from_image(original, original_format), None
+    except UnmappedExtentError as detail:
+        if not tmp_dir:
+            raise
+        LOG.debug("Converting %s to a local image: %s", original, detail)
+    local_copy = os.path.join(tmp_dir, "original_data.qcow2")
+    fmt = " -f %s" % original_format if original_format else ""
+    process.run("qemu-img convert%s %s -O qcow2 %s"
+                % (fmt, original, local_copy), shell=True, verbose=True)
+    return ImageMap.from_image(local_copy, 'qcow2'), local_copy
+
+
+def verify_backups(original, backups, original_format='qcow2',
+                   backup_format='qcow2', tmp_dir=None, max_workers=None):
+    """
+    Verify backup images against the original disk in parallel
+
+    :param original: str, path or url of the original disk, the vm should
+                     not write to it anymore
+    :param backups: list of backup image paths
+    :param original_format: str, format of the original disk
+    :param backup_format: str, format of the backups
+    :param tmp_dir: str, directory for a local copy of an original disk
+                    which can not be read directly, None to raise
+                    UnmappedExtentError instead
+    :param max_workers: int, thread number, default is one per backup up
+                        to the cpu count
+    :return: list of the compare_backup() results in order of backups
+    """
+    backups = list(backups)
+    if not backups:
+        return []
+    original_map, local_copy = _get_original_map(original, original_format,
+                                                 tmp_dir)
+    if not max_workers:
+        max_workers = min(len(backups), os.cpu_count() or 1)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(
+                lambda backup: compare_backup(
+                    original_map, ImageMap.from_image(backup, backup_format),
+                    backup), backups))
+    finally:
+        if local_copy:
+            os.remove(local_copy)
+    compared = sum(result['compared'] for result in results)
+    skipped = sum(result['skipped'] for result in results)
+    LOG.info("Verified %d backups of %s: compared %d bytes, skipped %d "
+             "bytes", len(results), original, compared, skipped)
+    return results
@@ -0,0 +1,174 @@
+"""
+Hashing helpers for image and volume integrity checks
+
+Files are read with large readv() calls into one reused buffer, and
+holes reported by SEEK_DATA/SEEK_HOLE are not read at all. A hole is
+hashed as the zero bytes it reads as, so the digest only depends on the
+content: a sparse file and a fully allocated copy of it give the same
+result, which is what upload/download and blockcommit checks compare.
+"""
+
+import errno
+import hashlib
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+LOG = logging.getLogger('avocado.' + __name__)
+
+MIN_BUFFER_SIZE = 1024 * 1024
+MAX_BUFFER_SIZE = 8 * 1024 * 1024
+DEFAULT_BUFFER_SIZE = 4 * 1024 * 1024
+
+ALGORITHMS = ('md5', 'sha256', 'blake2b', 'xxhash')
+
+
+def get_hasher(algorithm='md5'):
+    """
+    Get a new hash object of the algorithm
+
+    :param algorithm: str, one of md5, sha256, blake2b or xxhash
+    :return: hash object with update() and hexdigest()
+    :raise: ValueError if the algorithm is unknown or not available
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError("Unknown hash algorithm:%s, should be one of %s"
+                         % (algorithm, ALGORITHMS))
+    if algorithm == 'xxhash':
+        if xxhash is None:
+            raise ValueError("Hash algorithm xxhash needs the python "
+                             "xxhash module")
+        return xxhash.xxh64()
+    return hashlib.new(algorithm)
+
+
+def _clamp_buffer_size(buffer_size):
+    """
+    Keep the buffer size between MIN_BUFFER_SIZE and MAX_BUFFER_SIZE
+    """
+    return max(MIN_BUFFER_SIZE, min(int(buffer_size), MAX_BUFFER_SIZE))
+
+
+def _get_end(fd):
+    """
+    Get the size of a regular file or a block device
+    """
+    return os.lseek(fd, 0, os.SEEK_END)
+
+
+def iter_extents(fd, start, end):
+    """
+    Iterate data and hole extents of the range [start, end)
+
+    Block devices and file systems without SEEK_DATA support are reported
+    as one data extent.
+
+    :param fd: int, file descriptor opened for reading
+    :param start: int, offset where the range begins
+    :param end: int, offset where the range ends
+    :return: generator of (offset, length, is_data)
+    """
+    seek_data = getattr(os, 'SEEK_DATA', None)
+    seek_hole = getattr(os, 'SEEK_HOLE', None)
+    pos = start
+    while pos < end:
+        if seek_data is None:
+            yield pos, end - pos, True
+            return
+        try:
+            data = os.lseek(fd, pos, seek_data)
+        except OSError as detail:
+            if detail.errno == errno.ENXIO:
+                # No more data after pos, the rest is a hole
+                yield pos, end - pos, False
+            else:
+                yield pos, end - pos, True
+            return
+        if data > pos:
+            hole_end = min(data, end)
+            yield pos, hole_end - pos, False
+            pos = hole_end
+            continue
+        try:
+            hole = os.lseek(fd, pos, seek_hole)
+        except OSError:
+            hole = end
+        data_end = min(max(hole, pos + 1), end)
+        yield pos, data_end - pos, True
+        pos = data_end
+
+
+def file_digest(path, offset=0, length=0, algorithm='md5',
+                buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Hash length bytes of a file or block device, begin at offset
+
+    :param path: str, file or device absolute path to read
+    :param offset: int, offset that begin to read
+    :param length: int, length will read, 0 means read to the end
+    :param algorithm: str, one of ALGORITHMS
+    :param buffer_size: int, read buffer size, kept between 1 and 8 MiB
+    :return: str, hexdigest of the content
+    """
+    hasher = get_hasher(algorithm)
+    buffer_size = _clamp_buffer_size(buffer_size)
+    buf = memoryview(bytearray(buffer_size))
+    zeros = memoryview(bytes(buffer_size))
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        end = _get_end(fd)
+        if length:
+            end = min(end, offset + length)
+        for ext_offset, ext_length, is_data in iter_extents(fd, offset, end):
+            if not is_data:
+                while ext_length:
+                    chunk = min(ext_length, buffer_size)
+                    hasher.update(zeros[:chunk])
+                    ext_length -= chunk
+                continue
+            os.lseek(fd, ext_offset, os.SEEK_SET)
+            while ext_length:
+                chunk = min(ext_length, buffer_size)
+                got = os.readv(fd, [buf[:chunk]])
+                if not got:
+                    break
+                hasher.update(buf[:got])
+                ext_length -= got
+    finally:
+        os.close(fd)
+    return hasher.hexdigest()
+
+
+def hash_files(paths, algorithm='sha256', max_workers=None,
+               buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Hash many files in parallel on a thread pool
+
+    hashlib releases the GIL when hashing large buffers, so threads hash
+    the files concurrently.
+
+    :param paths: list of file or device paths
+    :param algorithm: str, one of ALGORITHMS
+    :param max_workers: int, thread number, default is one per file up to
+                        the cpu count
+    :param buffer_size: int, read buffer size of each thread
+    :return: dict, path -> hexdigest
+    """
+    paths = list(paths)
+    if not paths:
+        return {}
+    if not max_workers:
+        max_workers = min(len(paths), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        digests = executor.map(
+            lambda path: file_digest(path, algorithm=algorithm,
+                                     buffer_size=buffer_size), paths)
+        result = dict(zip(paths, digests))
+    LOG.debug("%s of files: %s", algorithm, result)
+    return result
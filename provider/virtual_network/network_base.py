@@ -1,6 +1,9 @@
 import logging
+import re
 import shutil
 
+from concurrent.futures import ThreadPoolExecutor
+
 import aexpect
 
 from avocado.core import exceptions
@@ -46,52 +49,187 @@ def get_test_ips(session, mac, ep_session, ep_mac, net_name=None,
     return ips
 
 
-def ping_check(params, ips, session=None, force_ipv4=True, **args):
+def _get_ping_probes(params, ips, force_ipv4=True):
     """
-    Ping between multiple targets and check results according to
-    settings from params
+    Get the ping probes set by '<source>_ping_<destination>' params
 
     :param params: test params
     :param ips: a dict of ip addresses
-    :param session: vm session to ping from
     :param force_ipv4: whether to force ping with ipv4
-    :param args: other kwargs
+    :return: list of (pattern, source, destination, dest_ip, expect_result)
     """
-    outside_ip = ips.get('outside_ip')
-    vm_ip = ips.get('vm_ip')
-    ep_vm_ip = ips.get('ep_vm_ip')
-    host_public_ip = ips.get('host_public_ip')
-    host_virbr_ip = ips.get('host_virbr_ip')
-    outside_ip = ips.get('outside_ip')
+    probes = []
     ping_patterns = {k: v for k, v in params.items() if '_ping_' in k}
-
     for pattern, expect_result in ping_patterns.items():
         source, destination = pattern.split('_ping_')
         if destination == 'outside' and not force_ipv4:
             LOG.debug('No need to test ping outside with ipv6')
             continue
-        dest_ip = eval(f'{destination}_ip')
+        dest_ip = ips.get(f'{destination}_ip')
         if dest_ip is None:
             raise exceptions.TestError(f'IP of {destination} is None')
+        probes.append((pattern, source, destination, dest_ip, expect_result))
+    return probes
+
+
+def _parse_ping_output(output):
+    """
+    Parse rtt and packet loss from ping output
+
+    :param output: output of ping command
+    :return: dict with rtt min/avg/max in ms and packet loss in percent,
+             None for the items not found
+    """
+    stats = {'min': None, 'avg': None, 'max': None, 'loss': None}
+    loss = re.search(r'([\d.]+)% packet loss', output or '')
+    if loss:
+        stats['loss'] = float(loss.group(1))
+    rtt = re.search(r'= ([\d.]+)/([\d.]+)/([\d.]+)', output or '')
+    if rtt:
+        stats.update(zip(('min', 'avg', 'max'), map(float, rtt.groups())))
+    return stats
+
+
+def _run_ping_probe(probe, session, force_ipv4, ping_args, fast=False):
+    """
+    Run one ping probe
+
+    :param probe: a probe returned by _get_ping_probes
+    :param session: session to ping from, None to ping from host
+    :param force_ipv4: whether to force ping with ipv4
+    :param ping_args: other kwargs of utils_net.ping
+    :param fast: send the 5 echo requests 0.2s apart instead of 1s
+    :return: dict of the probe result
+    """
+    pattern, source, destination, dest_ip, expect_result = probe
+    LOG.info(f'TEST_STEP: Ping from {source} to {destination} '
+             f'(ip: {dest_ip})')
+    # Any reply of the 5 requests passes, so a first request lost e.g.
+    # to arp resolution does not fail the probe
+    kwargs = {'count': 5, 'timeout': 10}
+    if fast:
+        kwargs['interval'] = 0.2
+    kwargs.update(ping_args)
+    status, output = utils_net.ping(dest=dest_ip, session=session,
+                                    force_ipv4=force_ipv4, **kwargs)
+    result = {'source': source, 'destination': destination,
+              'ip': dest_ip, 'expect': expect_result,
+              'status': status,
+              'passed': (status == 0) == (expect_result == 'pass')}
+    result.update(_parse_ping_output(output))
+    return result
+
+
+def _check_ping_result(result):
+    """
+    Check a ping probe result against the expectation
+
+    :param result: dict returned by _run_ping_probe
+    :return: message of the check
+    """
+    return f'Expect ping from {result["source"]} to ' \
+           f'{result["destination"]} should {result["expect"]}, actual ' \
+           f'result is {"pass" if result["status"] == 0 else "fail"}'
+
+
+def ping_matrix(params, ips, session=None, force_ipv4=True, vm=None,
+                max_workers=None, **args):
+    """
+    Run all ping probes set in params concurrently
+
+    Probes from host run in their own threads. Probes from vm run in
+    separate sessions of vm if it is given, otherwise they share session
+    and run one after another in one thread. vm can only be given when
+    it is reachable by network login, a serial console has one session.
+    Each probe sends 5 echo requests 0.2s apart and passes with any
+    reply, like ping_check().
+
+    :param params: test params
+    :param ips: a dict of ip addresses
+    :param session: vm session to ping from
+    :param force_ipv4: whether to force ping with ipv4
+    :param vm: vm object to open a session per vm probe
+    :param max_workers: max threads, default is one per probe
+    :param args: other kwargs of utils_net.ping per pattern
+    :return: dict, pattern -> result dict with rtt min/avg/max and loss
+    """
+    probes = _get_ping_probes(params, ips, force_ipv4)
+    if not probes:
+        return {}
+
+    def _ping_from_new_session(probe):
+        vm_session = vm.wait_for_login()
+        try:
+            return [_run_ping_probe(probe, vm_session, force_ipv4,
+                                    args.get(probe[0], {}), fast=True)]
+        finally:
+            vm_session.close()
+
+    def _ping_in_order(probe_list, ping_session):
+        return [_run_ping_probe(probe, ping_session, force_ipv4,
+                                args.get(probe[0], {}), fast=True)
+                for probe in probe_list]
+
+    tasks = []
+    shared_vm_probes = []
+    for probe in probes:
+        if probe[1] != 'vm':
+            tasks.append((_ping_in_order, [probe], None))
+        elif vm is not None:
+            tasks.append((_ping_from_new_session, probe))
+        else:
+            shared_vm_probes.append(probe)
+    if shared_vm_probes:
+        tasks.append((_ping_in_order, shared_vm_probes, session))
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(tasks)) as pool:
+        futures = [pool.submit(*task) for task in tasks]
+        results = [result for future in futures
+                   for result in future.result()]
+    matrix = {f'{r["source"]}_ping_{r["destination"]}': r for r in results}
+    LOG.debug(f'Ping matrix: {matrix}')
+    return matrix
+
 
-        ping_args = args.get(pattern, {})
-
-        LOG.info(f'TEST_STEP: Ping from {source} to {destination} '
-                 f'(ip: {dest_ip})')
-        ping_session = session if source == 'vm' else None
-        status, _ = utils_net.ping(dest=dest_ip, count=5,
-                                   timeout=10,
-                                   session=ping_session,
-                                   force_ipv4=force_ipv4,
-                                   **ping_args)
-        msg = f'Expect ping from {source} to {destination} should ' \
-              f'{expect_result}, actual result is ' \
-              f'{"pass" if status == 0 else "fail"}'
-        ping_result = (status == 0) == (expect_result == 'pass')
-        if ping_result:
+def ping_check(params, ips, session=None, force_ipv4=True, vm=None,
+               **args):
+    """
+    Ping between multiple targets and check results according to
+    settings from params
+
+    With ping_check_concurrent = yes in params, all probes run at the
+    same time by ping_matrix().
+
+    :param params: test params
+    :param ips: a dict of ip addresses
+    :param session: vm session to ping from
+    :param force_ipv4: whether to force ping with ipv4
+    :param vm: vm object to open a session per vm probe in concurrent mode
+               by network login, None to run the vm probes in session
+    :param args: other kwargs
+    :return: dict, pattern -> result dict with rtt min/avg/max and loss
+    """
+    if params.get('ping_check_concurrent', 'no') == 'yes':
+        matrix = ping_matrix(params, ips, session, force_ipv4, vm=vm,
+                             **args)
+        failures = [_check_ping_result(result)
+                    for result in matrix.values() if not result['passed']]
+        if failures:
+            raise exceptions.TestFail('\n'.join(failures))
+        return matrix
+
+    matrix = {}
+    for probe in _get_ping_probes(params, ips, force_ipv4):
+        ping_session = session if probe[1] == 'vm' else None
+        result = _run_ping_probe(probe, ping_session, force_ipv4,
+                                 args.get(probe[0], {}))
+        matrix[probe[0]] = result
+        msg = _check_ping_result(result)
+        if result['passed']:
             LOG.debug(msg)
         else:
             raise exceptions.TestFail(msg)
+    return matrix
 
 
 def create_tap(tap_name, bridge_name, user):